@@ -0,0 +1,178 @@
+"""
+Подписки на пересечение цены: /alert <подарок> above|below <TON>.
+
+Подписки хранятся в users.db (таблица alerts). snifer.py держит их в памяти
+в индексе AlertIndex: для каждого подарка два отсортированных по порогу списка
+(above и below). Проверка новой цены — бинарный поиск, O(log n + k), где k —
+число сработавших подписок; перебора всех подписок нет.
+
+Сработавшая подписка одноразовая: snifer.py выключает её (active = 0) и пишет
+событие в alert_events, откуда бот забирает и доставляет уведомления.
+"""
+import bisect
+from datetime import datetime
+
+from anomaly import base_gift_name
+
+USERS_DB_FILE = "users.db"
+DIRECTIONS = ("above", "below")
+REFRESH_SECONDS = 5
+
+ALERTS_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        chat_id INTEGER,
+        gift_name TEXT,
+        direction TEXT,
+        threshold REAL,
+        created_at TEXT,
+        active INTEGER DEFAULT 1
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_alerts_user ON alerts (user_id, active)",
+    '''
+    CREATE TABLE IF NOT EXISTS alert_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        alert_id INTEGER,
+        price_ton REAL,
+        source TEXT,
+        date TEXT,
+        delivered INTEGER DEFAULT 0
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_alert_events_pending ON alert_events (delivered, id)",
+)
+
+
+class AlertIndex:
+    def __init__(self):
+        # (gift, direction) -> (отсортированные пороги, id подписок в том же порядке)
+        self.books = {}
+        # id -> ((gift, direction), threshold)
+        self.alerts = {}
+        # Сработавшие подписки, ещё не выключенные в users.db: id -> ((gift, direction), threshold)
+        self.fired = {}
+        self.max_id = 0
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def add(self, alert_id: int, gift_name: str, direction: str, threshold: float) -> None:
+        if alert_id in self.alerts or alert_id in self.fired or direction not in DIRECTIONS:
+            return
+        self._insert(alert_id, (base_gift_name(gift_name), direction), threshold)
+        self.max_id = max(self.max_id, alert_id)
+
+    def _insert(self, alert_id: int, key, threshold: float) -> None:
+        thresholds, ids = self.books.setdefault(key, ([], []))
+        i = bisect.bisect_right(thresholds, threshold)
+        thresholds.insert(i, threshold)
+        ids.insert(i, alert_id)
+        self.alerts[alert_id] = (key, threshold)
+
+    def remove(self, alert_id: int) -> None:
+        entry = self.alerts.pop(alert_id, None)
+        if entry is None:
+            return
+        key, threshold = entry
+        thresholds, ids = self.books[key]
+        i = bisect.bisect_left(thresholds, threshold)
+        while i < len(ids) and ids[i] != alert_id:
+            i += 1
+        if i < len(ids):
+            del thresholds[i]
+            del ids[i]
+
+    def match(self, gift_name: str, price: float) -> list:
+        """
+        Возвращает id подписок, для которых цена пересекла порог, и убирает их из индекса.
+        above срабатывает при price >= threshold, below — при price <= threshold.
+        После записи в users.db вызывается confirm, при ошибке записи — restore.
+        """
+        if price is None:
+            return []
+        gift = base_gift_name(gift_name)
+        fired = []
+
+        book = self.books.get((gift, "above"))
+        if book and book[0] and book[0][0] <= price:
+            thresholds, ids = book
+            i = bisect.bisect_right(thresholds, price)
+            fired.extend(ids[:i])
+            del thresholds[:i]
+            del ids[:i]
+
+        book = self.books.get((gift, "below"))
+        if book and book[0] and book[0][-1] >= price:
+            thresholds, ids = book
+            i = bisect.bisect_left(thresholds, price)
+            fired.extend(ids[i:])
+            del thresholds[i:]
+            del ids[i:]
+
+        for alert_id in fired:
+            self.fired[alert_id] = self.alerts.pop(alert_id)
+        return fired
+
+    def confirm(self, alert_ids) -> None:
+        """
+        Сработавшие подписки выключены в users.db: забываем их.
+        """
+        for alert_id in alert_ids:
+            self.fired.pop(alert_id, None)
+
+    def restore(self, alert_ids) -> None:
+        """
+        Запись сработавших подписок не удалась: возвращаем их в индекс, чтобы они сработали
+        на следующей цене (load_new_alerts их уже не догрузит — читает только id > max_id).
+        """
+        for alert_id in alert_ids:
+            entry = self.fired.pop(alert_id, None)
+            if entry is not None:
+                self._insert(alert_id, *entry)
+
+
+async def ensure_schema_async(db) -> None:
+    for ddl in ALERTS_SCHEMA:
+        await db.execute(ddl)
+    await db.commit()
+
+
+async def load_new_alerts(db, index: AlertIndex) -> int:
+    """
+    Догружает в индекс подписки, созданные после последней загрузки.
+    """
+    async with db.execute(
+        "SELECT id, gift_name, direction, threshold FROM alerts WHERE active = 1 AND id > ? ORDER BY id",
+        (index.max_id,)
+    ) as cursor:
+        rows = await cursor.fetchall()
+    for alert_id, gift_name, direction, threshold in rows:
+        index.add(alert_id, gift_name, direction, threshold)
+    return len(rows)
+
+
+async def record_matches(db, alert_ids, price_ton: float, source: str) -> int:
+    """
+    Выключает сработавшие подписки и ставит уведомления в очередь для бота.
+    Подписки, отменённые пользователем до срабатывания, пропускаются.
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    recorded = 0
+    try:
+        for alert_id in alert_ids:
+            cursor = await db.execute("UPDATE alerts SET active = 0 WHERE id = ? AND active = 1", (alert_id,))
+            if cursor.rowcount == 1:
+                await db.execute(
+                    "INSERT INTO alert_events (alert_id, price_ton, source, date) VALUES (?, ?, ?, ?)",
+                    (alert_id, price_ton, source, now)
+                )
+                recorded += 1
+        await db.commit()
+    except Exception:
+        # Частично выполненные UPDATE не должны уйти в users.db со следующим commit
+        await db.rollback()
+        raise
+    return recorded
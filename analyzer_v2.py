@@ -1,598 +1,1206 @@
-import nest_asyncio
-nest_asyncio.apply()
-import matplotlib.dates as mdates
-
-import asyncio
-import aiosqlite
-import logging
-import io
-from datetime import datetime, timedelta
-import matplotlib
-matplotlib.use('Agg')  # Неинтерактивный backend
-
-import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression, RANSACRegressor
-from telegram import InputMediaPhoto
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import (
-    ApplicationBuilder,
-    CommandHandler,
-    CallbackQueryHandler,
-    ContextTypes,
-)
-
-# Для экспоненциального сглаживания (Holt)
-from statsmodels.tsa.holtwinters import ExponentialSmoothing
-
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-gift_db = None
-user_db = None
-
-# Пример списка подарков (названия должны соответствовать записям в таблице gifts)
-GIFT_LIST = [
-    "Precious Peach", "Spiced Wine", "Perfume Bottle", "Magic Potion",
-    "Evil Eye", "Sharp Tongue", "Scared Cat", "Trapped Heart",
-    "Skull Flower", "Homemade Cake", "Santa Hat", "Kissed Frog",
-    "Spy Agaric", "Vintage Cigar", "Signet Ring", "Plush Pepe",
-    "Eternal Rose", "Durov's Cap", "Berry Box", "Hex Pot",
-    "Jelly Bunny", "Lunar Snake", "Party Sparkler", "Witch Hat",
-    "Jester Hat", "Desk Calendar", "Snow Mittens", "Cookie Heart",
-    "Jingle Bells", "Hanging Star", "Love Candle", "Mad Pumpkin",
-    "Voodoo Doll", "B-Day Candle", "Bunny Muffin", "Hypno Lollipop",
-    "Crystal Ball", "Eternal Candle", "Flying Broom", "Lol Pop",
-    "Ginger Cookie", "Star Notepad", "Love Potion", "Toy Bear",
-    "Diamond Ring","Loot Bag"
-]
-
-# Словарь для rate limiting (user_id: last_command_time)
-user_last_command = {}
-COMMAND_COOLDOWN = 2
-
-def rate_limit(func):
-    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        now = datetime.now()
-        last_time = user_last_command.get(user_id)
-        if last_time and (now - last_time).total_seconds() < COMMAND_COOLDOWN:
-            await update.message.reply_text("Пожалуйста, не спамьте команды.")
-            return
-        user_last_command[user_id] = now
-        return await func(update, context)
-    return wrapper
-
-def parse_date(date_str: str) -> datetime:
-    try:
-        return datetime.strptime(date_str, "%Y.%m.%d - %H:%M:%S")
-    except Exception as e:
-        logger.error(f"Ошибка при обработке даты {date_str}: {e}")
-        raise e
-
-# Инициализация базы данных подарков
-async def init_gift_db():
-    global gift_db
-    gift_db = await aiosqlite.connect('gifts.db')
-    await gift_db.execute("PRAGMA foreign_keys = ON;")
-    await gift_db.commit()
-
-# Инициализация базы данных пользователей
-async def init_user_db():
-    global user_db
-    user_db = await aiosqlite.connect('users.db')
-    await user_db.execute("PRAGMA foreign_keys = ON;")
-    await user_db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            chat_id INTEGER,
-            join_date TEXT,
-            command_count INTEGER DEFAULT 0
-        );
-    """)
-    await user_db.commit()
-
-async def register_user(update: Update):
-    user = update.effective_user
-    chat_id = update.effective_chat.id
-    join_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    async with user_db.execute("SELECT user_id FROM users WHERE user_id = ?", (user.id,)) as cursor:
-        exists = await cursor.fetchone()
-    if not exists:
-        await user_db.execute(
-            "INSERT INTO users (user_id, username, chat_id, join_date, command_count) VALUES (?, ?, ?, ?, ?)",
-            (user.id, user.username, chat_id, join_date, 1)
-        )
-    else:
-        await user_db.execute(
-            "UPDATE users SET command_count = command_count + 1 WHERE user_id = ?",
-            (user.id,)
-        )
-    await user_db.commit()
-
-@rate_limit
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await register_user(update)
-    await update.message.reply_text(
-        "Привет! Я бот для анализа подарков (цены в TON).\n\n"
-        "Доступные команды:\n"
-        "/gifts – выбор подарка с инлайн-кнопками\n"
-        "/gift <название> – информация о подарке\n"
-        "/forecast <название> – прогноз цены (TON)\n"
-        "/detailed <название> – подробный анализ подарка\n"
-        "/myprofile – информация о пользователе\n"
-        "/help – помощь"
-    )
-
-@rate_limit
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await register_user(update)
-    await update.message.reply_text(
-        "Доступные команды:\n"
-        "/start – Запуск бота\n"
-        "/gift <название> – Информация о подарке\n"
-        "/forecast <название> – Прогноз цены (TON)\n"
-        "/detailed <название> – Подробный анализ подарка\n"
-        "/gifts – Выбор подарка с инлайн-кнопками\n"
-        "/myprofile – Информация о пользователе\n"
-        "/help – Помощь"
-    )
-
-@rate_limit
-async def myprofile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await register_user(update)
-    user = update.effective_user
-    async with user_db.execute("SELECT username, join_date, command_count FROM users WHERE user_id = ?", (user.id,)) as cursor:
-        record = await cursor.fetchone()
-    if record:
-        username, join_date, command_count = record
-        text = (f"👤 <b>Мой профиль</b>\n"
-                f"Username: {username}\n"
-                f"Дата регистрации: {join_date}\n"
-                f"Всего команд использовано: {command_count}")
-    else:
-        text = "Информация о пользователе не найдена."
-    await update.message.reply_html(text)
-
-@rate_limit
-async def gift_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not context.args:
-        await update.message.reply_text("Укажите название подарка. Пример: /gift Perfume Bottle")
-        return
-    gift_name = " ".join(context.args)
-    await register_user(update)
-
-    # Получаем базовую инфу о подарке
-    async with gift_db.execute("SELECT id, name, total_count FROM gifts WHERE name = ?", (gift_name,)) as cursor:
-        gift = await cursor.fetchone()
-    if not gift:
-        await update.message.reply_text(f"Подарок '{gift_name}' не найден.")
-        return
-    gift_id, name, total_count = gift
-
-    text = (f"📦 <b>Информация о подарке:</b>\n"
-            f"ID: {gift_id}\n"
-            f"Название: {name}\n"
-            f"Общее количество: {total_count}\n")
-
-    # Пример анализа delta_ton
-    async with gift_db.execute("SELECT delta_ton FROM prices WHERE gift_name = ? ORDER BY date ASC", (gift_name,)) as cursor:
-        rows = await cursor.fetchall()
-    if rows:
-        delta_values = [r[0] for r in rows if r[0] is not None]
-        if delta_values:
-            avg_delta = sum(delta_values)/len(delta_values)
-            trend = "растут" if avg_delta > 0 else "падают" if avg_delta < 0 else "стабильны"
-            text += (f"\n📊 <b>Анализ цен (TON):</b>\n"
-                     f"Среднее изменение (delta_ton): {avg_delta:.4f}\n"
-                     f"Тренд: цены {trend}.")
-        else:
-            text += "\nНет валидных данных delta_ton."
-    else:
-        text += "\nИнформация о ценах отсутствует."
-
-    await update.message.reply_html(text)
-
-@rate_limit
-async def forecast_prices(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Подсказка пользователю. Реальный прогноз идёт через inline-кнопки /gifts.
-    """
-    await register_user(update)
-    if not context.args:
-        await update.message.reply_text("Укажите название подарка. Пример: /forecast Perfume Bottle")
-        return
-    gift_name = " ".join(context.args)
-    await update.message.reply_text(
-        "Используйте /gifts для выбора подарка с инлайн-кнопками.\n"
-        "Или выберите подарок из списка ниже."
-    )
-
-@rate_limit
-async def detailed_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """
-    Аналогичная подсказка, так как детальный анализ вызывается через inline-кнопки.
-    """
-    await register_user(update)
-    if not context.args:
-        await update.message.reply_text("Укажите название подарка. Пример: /detailed Perfume Bottle")
-        return
-    gift_name = " ".join(context.args)
-    await update.message.reply_text(
-        "Используйте /gifts для выбора подарка с инлайн-кнопками.\n"
-        "Или выберите подарок из списка ниже."
-    )
-
-async def get_gift_info_text(gift_name: str) -> str:
-    async with gift_db.execute("SELECT id, name, total_count FROM gifts WHERE name = ?", (gift_name,)) as cursor:
-        gift = await cursor.fetchone()
-    if not gift:
-        return f"Подарок '{gift_name}' не найден."
-    gift_id, name, total_count = gift
-
-    text = (f"📦 <b>Информация о подарке:</b>\n"
-            f"ID: {gift_id}\n"
-            f"Название: {name}\n"
-            f"Общее количество: {total_count}\n")
-
-    # Анализ delta_ton
-    async with gift_db.execute("SELECT delta_ton FROM prices WHERE gift_name = ? ORDER BY date ASC", (gift_name,)) as cursor:
-        rows = await cursor.fetchall()
-    if rows:
-        deltas = [r[0] for r in rows if r[0] is not None]
-        if deltas:
-            avg_d = sum(deltas)/len(deltas)
-            trend = "растут" if avg_d > 0 else "падают" if avg_d < 0 else "стабильны"
-            text += (f"\n📊 <b>Анализ (TON):</b>\n"
-                     f"Среднее изменение (delta_ton): {avg_d:.4f}\n"
-                     f"Тренд: {trend}")
-        else:
-            text += "\nНет валидных данных delta_ton."
-    else:
-        text += "\nИнформация о ценах отсутствует."
-
-    return text
-
-def build_sub_buttons(gift_name: str) -> InlineKeyboardMarkup:
-    keyboard = [
-        [
-            InlineKeyboardButton("Прогноз (TON)", callback_data=f"forecast:{gift_name}"),
-            InlineKeyboardButton("Детальный анализ", callback_data=f"detailed:{gift_name}")
-        ],
-        [
-            InlineKeyboardButton("Вернуться", callback_data="list")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-async def display_gift_info(gift_name: str, query) -> None:
-    text = await get_gift_info_text(gift_name)
-    markup = build_sub_buttons(gift_name)
-    if query.message.text:
-        await query.edit_message_text(text, parse_mode='HTML', reply_markup=markup)
-    else:
-        await query.edit_message_caption(caption=text, parse_mode='HTML', reply_markup=markup)
-
-async def forecast_inline_otc(gift_name: str, query) -> None:
-    """
-    Прогноз цены (TON) для OTC-рынка:
-      - Использует данные из таблиц prices (поле floor_ton) и sales (поле price_ton),
-      - Строит три модели: RANSAC, обычная линейная регрессия и Holt (экспоненциальное сглаживание).
-      - Итоговый прогноз = среднее значений всех моделей.
-    """
-    combined_data = []
-
-    # 1) Извлекаем данные из таблицы prices (floor_ton)
-    async with gift_db.execute("""
-        SELECT date, floor_ton
-        FROM prices
-        WHERE gift_name = ? AND floor_ton IS NOT NULL
-        ORDER BY date ASC
-    """, (gift_name,)) as cursor:
-        price_rows = await cursor.fetchall()
-    for date_str, price_ton in price_rows:
-        try:
-            d = parse_date(date_str)
-            combined_data.append((d, price_ton))
-        except Exception:
-            continue
-
-    # 2) Извлекаем данные из таблицы sales (price_ton)
-    async with gift_db.execute("""
-        SELECT date, price_ton
-        FROM sales
-        WHERE gift_name LIKE ?
-        ORDER BY date ASC
-    """, (f"{gift_name}%",)) as cursor:
-        sales_rows = await cursor.fetchall()
-    for date_str, price_ton in sales_rows:
-        try:
-            d = parse_date(date_str)
-            combined_data.append((d, price_ton))
-        except Exception:
-            continue
-
-    if not combined_data or len(combined_data) < 2:
-        await query.edit_message_text("Недостаточно данных (TON) для анализа данного подарка.")
-        return
-
-    # 3) Сортируем объединённый ряд по дате
-    combined_data.sort(key=lambda x: x[0])
-    dates = [item[0] for item in combined_data]
-    prices = [item[1] for item in combined_data]
-
-    # Преобразуем даты в числовой формат
-    X = np.array([d.toordinal() for d in dates]).reshape(-1, 1)
-    y = np.array(prices)
-
-    # Весовая функция для свежести данных (больше веса – последним данным)
-    alpha = 0.1
-    last_date_ord = dates[-1].toordinal()
-    weights = np.exp(-alpha * (last_date_ord - X.flatten()))
-
-    # Модель 1: RANSAC (устойчивая регрессия)
-    ransac = RANSACRegressor(estimator=LinearRegression(), max_trials=100, min_samples=0.6)
-    ransac.fit(X, y, sample_weight=weights)
-
-    future_date = dates[-1] + timedelta(days=1)
-    future_day_ord = np.array([[future_date.toordinal()]])
-    ransac_forecast = ransac.predict(future_day_ord)[0]
-    ransac_forecast = max(ransac_forecast, 0)  # цена не может быть отрицательной
-
-    # Модель 2: обычная линейная регрессия
-    lin_model = LinearRegression()
-    lin_model.fit(X, y, sample_weight=weights)
-    lin_future = lin_model.predict(future_day_ord)[0]
-    lin_future = max(lin_future, 0)
-
-    # Модель 3: Holt (экспоненциальное сглаживание)
-    try:
-        from statsmodels.tsa.holtwinters import ExponentialSmoothing
-        holt_model = ExponentialSmoothing(y, trend="add", damped_trend=True, seasonal=None)
-        holt_fit = holt_model.fit(optimized=True)
-        holt_forecast = holt_fit.forecast(1)[0]
-        holt_forecast = max(holt_forecast, 0)
-    except Exception as e:
-        logger.error(f"Holt model error: {e}")
-        holt_forecast = lin_future
-
-    # Итоговый прогноз (среднее значение)
-    final_forecast = (ransac_forecast + lin_future + holt_forecast) / 3.0
-
-    # --- Построение графика ---
-    import matplotlib.dates as mdates
-    plt.figure(figsize=(12, 6))
-    
-    # Фактические цены с прозрачностью
-    plt.scatter(dates, y, color='blue', alpha=0.8, s=60, label="Фактические цены (TON)")
-    
-    # Линейная регрессия
-    plt.plot(dates, lin_model.predict(X), 'g--', linewidth=1.5, label="Лин. регрессия")
-    
-    # RANSAC регрессия
-    plt.plot(dates, ransac.predict(X), 'r--', linewidth=1.5, label="RANSAC регрессия")
-    
-    # Holt сглаживание (если доступно)
-    try:
-        plt.plot(dates, holt_fit.fittedvalues, 'm--', linewidth=1.5, label="Holt сглаживание")
-    except:
-        pass
-
-    # Прогнозные точки
-    plt.scatter(future_date, ransac_forecast, color='red', s=100, label=f"RANSAC прогноз ({ransac_forecast:.2f})")
-    plt.scatter(future_date, lin_future, color='green', s=100, label=f"Лин. прогноз ({lin_future:.2f})")
-    plt.scatter(future_date, holt_forecast, color='magenta', s=100, label=f"Holt прогноз ({holt_forecast:.2f})")
-    plt.scatter(future_date, final_forecast, color='black', s=120, label=f"Итоговый прогноз ({final_forecast:.2f})")
-    
-    # Форматирование оси X как даты
-    ax = plt.gca()
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
-    ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
-    plt.xticks(rotation=45)
-    
-    plt.ylim(bottom=0)
-    plt.xlabel("Дата")
-    plt.ylabel("Цена (TON)")
-    plt.title(f"OTC-прогноз (TON) для подарка: {gift_name}")
-    plt.grid(True, linestyle=':')
-    plt.legend()
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
-
-    text = (
-        f"🔮 <b>OTC-прогноз (TON) для подарка: {gift_name}</b>\n"
-        f"Дата прогноза: {future_date.strftime('%Y-%m-%d')}\n\n"
-        f"Использованы данные из таблиц prices (floor_ton) и sales (price_ton).\n"
-        f"Модели прогнозирования:\n"
-        f"  • RANSAC: {ransac_forecast:.2f} TON\n"
-        f"  • Линейная регрессия: {lin_future:.2f} TON\n"
-        f"  • Holt сглаживание: {holt_forecast:.2f} TON\n\n"
-        f"Итоговый прогноз (среднее): <b>{final_forecast:.2f} TON</b>"
-    )
-
-    markup = InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data=f"gift:{gift_name}")]])
-    await query.edit_message_media(
-        media=InputMediaPhoto(media=buf, caption=text, parse_mode='HTML'),
-        reply_markup=markup
-    )
-
-
-# --- ДЕТАЛЬНЫЙ АНАЛИЗ (пример) ---
-async def detailed_inline(gift_name: str, query) -> None:
-    # Получаем базовую информацию о подарке
-    async with gift_db.execute("SELECT id, name, total_count FROM gifts WHERE name = ?", (gift_name,)) as cursor:
-        gift = await cursor.fetchone()
-    if not gift:
-        await query.edit_message_text(f"Подарок '{gift_name}' не найден.")
-        return
-    gift_id, name, total_count = gift
-
-    combined_data = []
-
-    # 1) Извлекаем данные из таблицы prices (поле floor_ton)
-    async with gift_db.execute("""
-        SELECT date, floor_ton
-        FROM prices
-        WHERE gift_name = ? AND floor_ton IS NOT NULL
-        ORDER BY date ASC
-    """, (gift_name,)) as cursor:
-        price_rows = await cursor.fetchall()
-    for date_str, floor_ton in price_rows:
-        try:
-            d = parse_date(date_str)
-            combined_data.append((d, floor_ton))
-        except Exception:
-            continue
-
-    # 2) Извлекаем данные из таблицы sales (поле price_ton)
-    async with gift_db.execute("""
-        SELECT date, price_ton
-        FROM sales
-        WHERE gift_name LIKE ?
-        ORDER BY date ASC
-    """, (f"{gift_name}%",)) as cursor:
-        sales_rows = await cursor.fetchall()
-    for date_str, price_ton in sales_rows:
-        try:
-            d = parse_date(date_str)
-            combined_data.append((d, price_ton))
-        except Exception:
-            continue
-
-    if not combined_data or len(combined_data) < 2:
-        await query.edit_message_text("Недостаточно данных (TON) для детального анализа.")
-        return
-
-    # Сортируем объединённый ряд по дате
-    combined_data.sort(key=lambda x: x[0])
-    dates = [item[0] for item in combined_data]
-    ton_prices = [item[1] for item in combined_data]
-
-    # Вычисляем статистические показатели
-    import statistics
-    mean_price = statistics.mean(ton_prices)
-    min_price = min(ton_prices)
-    max_price = max(ton_prices)
-    std_price = statistics.stdev(ton_prices) if len(ton_prices) > 1 else 0
-
-    # Строим модель линейной регрессии для прогноза
-    X = np.array([d.toordinal() for d in dates]).reshape(-1, 1)
-    y = np.array(ton_prices)
-    lin_model = LinearRegression()
-    lin_model.fit(X, y)
-    future_date = dates[-1] + timedelta(days=1)
-    forecast_lin = lin_model.predict([[future_date.toordinal()]])[0]
-
-    # Формируем текстовый отчет
-    analysis_text = (
-        f"📊 <b>Детальный анализ (TON):</b>\n"
-        f"Подарок: {name}\n"
-        f"Общее количество: {total_count}\n\n"
-        f"Статистика по цене (TON):\n"
-        f"  • Средняя: {mean_price:.2f}\n"
-        f"  • Мин: {min_price:.2f}, Макс: {max_price:.2f}\n"
-        f"  • Стандартное отклонение: {std_price:.2f}\n"
-        f"Линейный прогноз на {future_date.strftime('%Y-%m-%d')}: {forecast_lin:.2f} TON\n"
-    )
-
-    # Построение графика
-    import matplotlib.dates as mdates
-    fig, ax = plt.subplots(figsize=(12, 6))
-    ax.plot(dates, ton_prices, 'bo-', label="Фактические цены (TON)")
-    y_lin_pred = lin_model.predict(X)
-    ax.plot(dates, y_lin_pred, 'r--', linewidth=1.5, label="Линейная регрессия")
-    ax.scatter(future_date, forecast_lin, color='green', s=100, label=f"Прогноз ({forecast_lin:.2f} TON)")
-
-    # Форматируем ось X как даты
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
-    ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
-    plt.xticks(rotation=45)
-    ax.set_ylim(bottom=0)
-
-    ax.set_xlabel("Дата")
-    ax.set_ylabel("Цена (TON)")
-    ax.set_title(f"Детальный анализ (TON) для {name}")
-    ax.grid(True, linestyle=':')
-    ax.legend()
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
-
-    markup = InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data=f"gift:{gift_name}")]])
-    await query.edit_message_media(
-        media=InputMediaPhoto(media=buf, caption=analysis_text, parse_mode='HTML'),
-        reply_markup=markup
-    )
-
-
-# --- ОБРАБОТЧИК CALLBACK ---
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    data = query.data
-    await query.answer()
-    if data.startswith("gift:"):
-        gift_name = data.split(":", 1)[1]
-        await display_gift_info(gift_name, query)
-    elif data.startswith("forecast:"):
-        gift_name = data.split(":", 1)[1]
-        await forecast_inline_otc(gift_name, query)
-    elif data.startswith("detailed:"):
-        gift_name = data.split(":", 1)[1]
-        await detailed_inline(gift_name, query)
-    elif data == "list":
-        await query.message.delete()
-        keyboard = []
-        row = []
-        for gift in GIFT_LIST:
-            row.append(InlineKeyboardButton(gift, callback_data=f"gift:{gift}"))
-            if len(row) == 3:
-                keyboard.append(row)
-                row = []
-        if row:
-            keyboard.append(row)
-        markup = InlineKeyboardMarkup(keyboard)
-        await context.bot.send_message(chat_id=query.message.chat_id, text="Выберите подарок:", reply_markup=markup)
-    else:
-        await query.edit_message_text("Неизвестная команда.")
-
-@rate_limit
-async def list_gifts_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await register_user(update)
-    keyboard = []
-    row = []
-    for gift in GIFT_LIST:
-        row.append(InlineKeyboardButton(gift, callback_data=f"gift:{gift}"))
-        if len(row) == 3:
-            keyboard.append(row)
-            row = []
-    if row:
-        keyboard.append(row)
-    markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Выберите подарок:", reply_markup=markup)
-
-async def main() -> None:
-    await init_gift_db()
-    await init_user_db()
-    application = ApplicationBuilder().token("BOT-TOKEN").build()
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("gifts", list_gifts_command))
-    application.add_handler(CommandHandler("gift", gift_info))
-    application.add_handler(CommandHandler("forecast", forecast_prices))
-    application.add_handler(CommandHandler("detailed", detailed_analysis))
-    application.add_handler(CommandHandler("myprofile", myprofile))
-    application.add_handler(CallbackQueryHandler(handle_callback))
-
-    logger.info("Bot started")
-    await application.run_polling(close_loop=False)
-
-if __name__ == '__main__':
-    asyncio.run(main())
+import nest_asyncio
+nest_asyncio.apply()
+import matplotlib.dates as mdates
+
+import asyncio
+import aiosqlite
+import functools
+import logging
+import io
+import json
+import math
+import os
+import sqlite3
+import sys
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import matplotlib
+matplotlib.use('Agg')  # Неинтерактивный backend
+
+import numpy as np
+import matplotlib.pyplot as plt
+from sklearn.linear_model import LinearRegression
+from telegram import InputMediaPhoto
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.ext import (
+    ApplicationBuilder,
+    CommandHandler,
+    CallbackQueryHandler,
+    ContextTypes,
+)
+
+import alerts
+import changefeed
+import forecasting
+import gift_stats
+from outbox import GLOBAL_RATE, Outbox, PRIORITY_ALERT, PRIORITY_BROADCAST
+from anomaly import ensure_schema_async
+import portfolio
+from retention import DATE_GLOB, PRICES_DAILY_SCHEMA
+import sketches
+import spreads
+from log_setup import setup_logging
+from metrics import Counter, Gauge, Histogram, is_locked_error, start_http_server
+import profiling
+from profiling import stage
+
+logger = logging.getLogger("analyzer")
+
+gift_db = None
+user_db = None
+outbox = None  # планировщик исходящих рассылок (outbox.py), создаётся при старте приложения
+floor_cache = portfolio.FloorCache()  # последние floor/average по подаркам для оценки портфелей
+
+# Локальный эндпоинт Prometheus: http://127.0.0.1:9102/metrics (None — отключить).
+# Воркеры webhook.py занимают порты METRICS_PORT + номер воркера.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9102)) or None
+
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "BOT-TOKEN")
+# Адрес Bot API (например, fake_bot_api.py для проверки); None — api.telegram.org
+BOT_API_URL = os.environ.get("BOT_API_URL")
+# Воркеры webhook.py читают gifts.db только через mmap: страницы базы лежат в общем
+# страничном кэше ОС, а не копируются в кэш SQLite каждого процесса
+GIFT_DB_MMAP_BYTES = 256 * 1024 * 1024
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время выполнения обработчиков бота", ["handler"])
+HANDLER_ERRORS_TOTAL = Counter("bot_handler_errors_total", "Исключения в обработчиках бота", ["handler"])
+DB_QUERY_SECONDS = Histogram("bot_db_query_seconds", "Время запросов к gifts.db", ["query"])
+DB_COMMIT_SECONDS = Histogram("bot_db_commit_seconds", "Время commit в users.db")
+DB_LOCKED_TOTAL = Counter("bot_db_locked_total", "Ошибки 'database is locked'", ["operation"])
+QUEUE_DEPTH = Gauge("bot_queue_depth", "Размер внутренних очередей бота", ["queue"])
+SERIES_CACHE_TOTAL = Counter("bot_series_cache_total", "Обращения к кэшу рядов цен", ["result"])
+CHANGE_EVENTS_TOTAL = Counter("bot_change_events_total", "События changefeed.py о новых строках", ["table"])
+
+# Исключать строки, помеченные детектором выбросов при инжесте (anomaly.py), из статистики и графиков
+EXCLUDE_SUSPICIOUS = os.environ.get("EXCLUDE_SUSPICIOUS", "1") == "1"
+NOT_SUSPICIOUS = "AND suspicious = 0" if EXCLUDE_SUSPICIOUS else ""
+
+# Telegram user_id администраторов (через запятую), которым доступны служебные команды
+ADMIN_IDS = {int(x) for x in os.environ.get("BOT_ADMIN_IDS", "").split(",") if x.strip()}
+
+# Пример списка подарков (названия должны соответствовать записям в таблице gifts)
+GIFT_LIST = [
+    "Precious Peach", "Spiced Wine", "Perfume Bottle", "Magic Potion",
+    "Evil Eye", "Sharp Tongue", "Scared Cat", "Trapped Heart",
+    "Skull Flower", "Homemade Cake", "Santa Hat", "Kissed Frog",
+    "Spy Agaric", "Vintage Cigar", "Signet Ring", "Plush Pepe",
+    "Eternal Rose", "Durov's Cap", "Berry Box", "Hex Pot",
+    "Jelly Bunny", "Lunar Snake", "Party Sparkler", "Witch Hat",
+    "Jester Hat", "Desk Calendar", "Snow Mittens", "Cookie Heart",
+    "Jingle Bells", "Hanging Star", "Love Candle", "Mad Pumpkin",
+    "Voodoo Doll", "B-Day Candle", "Bunny Muffin", "Hypno Lollipop",
+    "Crystal Ball", "Eternal Candle", "Flying Broom", "Lol Pop",
+    "Ginger Cookie", "Star Notepad", "Love Potion", "Toy Bear",
+    "Diamond Ring","Loot Bag"
+]
+
+# Словарь для rate limiting (user_id: last_command_time)
+user_last_command = {}
+COMMAND_COOLDOWN = 2
+
+def instrumented(func):
+    """
+    Гистограмма времени выполнения обработчика + счётчик исключений.
+    Если для обработчика взведено профилирование (см. profiling.py), вызов идёт под cProfile.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            with HANDLER_SECONDS.time(handler=name):
+                if profiling.enabled and profiling.should_profile(name):
+                    return await profiling.run(name, func, *args, **kwargs)
+                return await func(*args, **kwargs)
+        except Exception as e:
+            HANDLER_ERRORS_TOTAL.inc(handler=name)
+            if isinstance(e, sqlite3.OperationalError) and is_locked_error(e):
+                DB_LOCKED_TOTAL.inc(operation=name)
+            raise
+    return wrapper
+
+def rate_limit(func):
+    @functools.wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        now = datetime.now()
+        last_time = user_last_command.get(user_id)
+        if last_time and (now - last_time).total_seconds() < COMMAND_COOLDOWN:
+            await update.message.reply_text("Пожалуйста, не спамьте команды.")
+            return
+        user_last_command[user_id] = now
+        return await func(update, context)
+    return wrapper
+
+def parse_date(date_str: str) -> datetime:
+    try:
+        return datetime.strptime(date_str, "%Y.%m.%d - %H:%M:%S")
+    except Exception as e:
+        logger.error(f"Ошибка при обработке даты {date_str}: {e}")
+        raise e
+
+# Инициализация базы данных подарков
+async def init_gift_db(read_only: bool = False):
+    global gift_db
+    if read_only:
+        # Воркер webhook.py: схему уже создал фронт-процесс
+        gift_db = await aiosqlite.connect('file:gifts.db?mode=ro', uri=True)
+        await gift_db.execute(f"PRAGMA mmap_size = {GIFT_DB_MMAP_BYTES}")
+        return
+    gift_db = await aiosqlite.connect('gifts.db')
+    await gift_db.execute("PRAGMA foreign_keys = ON;")
+    # Дневные агрегаты, в которые retention.py сворачивает старую историю prices
+    await gift_db.execute(PRICES_DAILY_SCHEMA)
+    await gift_db.execute(sketches.SALE_SKETCHES_SCHEMA)
+    await gift_db.commit()
+    await ensure_schema_async(gift_db)
+    await spreads.ensure_schema_async(gift_db)
+    await gift_stats.ensure_schema_async(gift_db)
+
+# Инициализация базы данных пользователей
+async def init_user_db():
+    global user_db
+    user_db = await aiosqlite.connect('users.db')
+    await user_db.execute("PRAGMA foreign_keys = ON;")
+    # snifer.py пишет в users.db сработавшие подписки — WAL, чтобы не блокировать друг друга
+    await user_db.execute("PRAGMA journal_mode=WAL;")
+    await user_db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            chat_id INTEGER,
+            join_date TEXT,
+            command_count INTEGER DEFAULT 0
+        );
+    """)
+    await user_db.commit()
+    await alerts.ensure_schema_async(user_db)
+    await portfolio.ensure_schema_async(user_db)
+
+async def register_user(update: Update):
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    join_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    async with user_db.execute("SELECT user_id FROM users WHERE user_id = ?", (user.id,)) as cursor:
+        exists = await cursor.fetchone()
+    if not exists:
+        await user_db.execute(
+            "INSERT INTO users (user_id, username, chat_id, join_date, command_count) VALUES (?, ?, ?, ?, ?)",
+            (user.id, user.username, chat_id, join_date, 1)
+        )
+    else:
+        await user_db.execute(
+            "UPDATE users SET command_count = command_count + 1 WHERE user_id = ?",
+            (user.id,)
+        )
+    with DB_COMMIT_SECONDS.time():
+        await user_db.commit()
+
+@instrumented
+@rate_limit
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await register_user(update)
+    await update.message.reply_text(
+        "Привет! Я бот для анализа подарков (цены в TON).\n\n"
+        "Доступные команды:\n"
+        "/gifts – выбор подарка с инлайн-кнопками\n"
+        "/gift <название> – информация о подарке\n"
+        "/forecast <название> – прогноз цены (TON)\n"
+        "/detailed <название> – подробный анализ подарка\n"
+        "/alert <название> above|below <TON> – уведомить о пересечении цены\n"
+        "/alerts – мои подписки\n"
+        "/portfolio – мой портфель подарков\n"
+        "/spreads – продажи дальше всего от floor\n"
+        "/myprofile – информация о пользователе\n"
+        "/help – помощь"
+    )
+
+@instrumented
+@rate_limit
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await register_user(update)
+    await update.message.reply_text(
+        "Доступные команды:\n"
+        "/start – Запуск бота\n"
+        "/gift <название> – Информация о подарке\n"
+        "/forecast <название> – Прогноз цены (TON)\n"
+        "/detailed <название> – Подробный анализ подарка\n"
+        "/gifts – Выбор подарка с инлайн-кнопками\n"
+        "/alert <название> above|below <TON> – Уведомить о пересечении цены\n"
+        "/alerts – Мои подписки, /unalert <id> – отменить подписку\n"
+        "/portfolio – Портфель: add/set/remove позиций, chart – график стоимости\n"
+        f"/spreads [часов] – Продажи с наибольшим отклонением от floor (по умолчанию за {spreads.DEFAULT_HOURS} ч)\n"
+        "/myprofile – Информация о пользователе\n"
+        "/help – Помощь"
+    )
+
+@instrumented
+@rate_limit
+async def myprofile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await register_user(update)
+    user = update.effective_user
+    async with user_db.execute("SELECT username, join_date, command_count FROM users WHERE user_id = ?", (user.id,)) as cursor:
+        record = await cursor.fetchone()
+    if record:
+        username, join_date, command_count = record
+        text = (f"👤 <b>Мой профиль</b>\n"
+                f"Username: {username}\n"
+                f"Дата регистрации: {join_date}\n"
+                f"Всего команд использовано: {command_count}")
+    else:
+        text = "Информация о пользователе не найдена."
+    await update.message.reply_html(text)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /profile <обработчик> [N] – профилировать следующие N вызовов обработчика
+    /profile off – отключить профилирование
+    /profile – показать, что взведено
+    """
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    args = context.args or []
+    if not args:
+        armed = profiling.status()
+        text = "\n".join(f"{h}: осталось {n}" for h, n in armed.items()) or "Профилирование не взведено."
+        await update.message.reply_text(text)
+        return
+    if args[0] == "off":
+        profiling.disarm()
+        await update.message.reply_text("Профилирование отключено.")
+        return
+    handler = args[0]
+    try:
+        count = int(args[1]) if len(args) > 1 else 1
+    except ValueError:
+        await update.message.reply_text("Пример: /profile forecast_inline_otc 5")
+        return
+    profiling.arm(handler, count)
+    await update.message.reply_text(
+        f"Следующие {count} вызовов {handler} будут профилированы. Результаты: {profiling.PROFILE_DIR}/"
+    )
+
+async def fetch_gift_summary(gift_name: str):
+    """
+    Подарок и его сводка gift_stats (gift_stats.py) одной строкой; None, если подарка нет.
+    """
+    with stage("sql"), DB_QUERY_SECONDS.time(query="select_gift_summary"):
+        async with gift_db.execute("""
+            SELECT g.id, g.name, g.total_count, s.price_rows, s.delta_count, s.delta_sum,
+                   s.last_floor, s.last_price_date, s.sale_count, s.last_sale_price, s.last_sale_date
+            FROM gifts AS g LEFT JOIN gift_stats AS s ON s.gift_name = g.name
+            WHERE g.name = ?
+        """, (gift_name,)) as cursor:
+            return await cursor.fetchone()
+
+@instrumented
+@rate_limit
+async def gift_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not context.args:
+        await update.message.reply_text("Укажите название подарка. Пример: /gift Perfume Bottle")
+        return
+    gift_name = " ".join(context.args)
+    await register_user(update)
+    await update.message.reply_html(await get_gift_info_text(gift_name))
+
+@instrumented
+@rate_limit
+async def forecast_prices(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Подсказка пользователю. Реальный прогноз идёт через inline-кнопки /gifts.
+    """
+    await register_user(update)
+    if not context.args:
+        await update.message.reply_text("Укажите название подарка. Пример: /forecast Perfume Bottle")
+        return
+    gift_name = " ".join(context.args)
+    await update.message.reply_text(
+        "Используйте /gifts для выбора подарка с инлайн-кнопками.\n"
+        "Или выберите подарок из списка ниже."
+    )
+
+@instrumented
+@rate_limit
+async def detailed_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Аналогичная подсказка, так как детальный анализ вызывается через inline-кнопки.
+    """
+    await register_user(update)
+    if not context.args:
+        await update.message.reply_text("Укажите название подарка. Пример: /detailed Perfume Bottle")
+        return
+    gift_name = " ".join(context.args)
+    await update.message.reply_text(
+        "Используйте /gifts для выбора подарка с инлайн-кнопками.\n"
+        "Или выберите подарок из списка ниже."
+    )
+
+async def get_gift_info_text(gift_name: str) -> str:
+    gift = await fetch_gift_summary(gift_name)
+    if not gift:
+        return f"Подарок '{gift_name}' не найден."
+    (gift_id, name, total_count, price_rows, delta_count, delta_sum,
+     last_floor, last_price_date, sale_count, last_sale_price, last_sale_date) = gift
+
+    text = (f"📦 <b>Информация о подарке:</b>\n"
+            f"ID: {gift_id}\n"
+            f"Название: {name}\n"
+            f"Общее количество: {total_count}\n")
+
+    # Анализ delta_ton
+    if price_rows:
+        if delta_count:
+            avg_d = delta_sum / delta_count
+            trend = "растут" if avg_d > 0 else "падают" if avg_d < 0 else "стабильны"
+            text += (f"\n📊 <b>Анализ (TON):</b>\n"
+                     f"Среднее изменение (delta_ton): {avg_d:.4f}\n"
+                     f"Тренд: {trend}")
+        else:
+            text += "\nНет валидных данных delta_ton."
+        if last_floor is not None:
+            text += f"\nПоследний floor: {last_floor:.2f} TON ({last_price_date})"
+    else:
+        text += "\nИнформация о ценах отсутствует."
+    if sale_count:
+        text += f"\nПродаж: {sale_count}"
+        if last_sale_price is not None:
+            text += f", последняя: {last_sale_price:.2f} TON ({last_sale_date})"
+
+    return text
+
+async def fetch_daily_series(gift_name: str) -> list:
+    """
+    Свёрнутая retention.py история: одна точка на день — floor на закрытие дня.
+    """
+    with stage("sql"), DB_QUERY_SECONDS.time(query="select_daily_series"):
+        async with gift_db.execute("""
+            SELECT last_date, close_floor
+            FROM prices_daily
+            WHERE gift_name = ? AND close_floor IS NOT NULL
+        """, (gift_name,)) as cursor:
+            daily_rows = await cursor.fetchall()
+    points = []
+    with stage("parse_date"):
+        for date_str, close_floor in daily_rows:
+            try:
+                points.append((parse_date(date_str), close_floor))
+            except Exception:
+                continue
+    return points
+
+# Окна перцентилей цен продаж в детальном анализе (дней; None — вся история)
+SALE_PERCENTILE_WINDOWS = {"7 дней": 7, "30 дней": 30, "Всё время": None}
+
+# --- КЭШ РЯДОВ ЦЕН ---
+# Ряд подарка (дневные закрытия + floor + продажи) хранится в памяти и дочитывается
+# по id только после события changefeed.py о новых строках этого подарка.
+SERIES_CACHE_SIZE = 256
+series_cache = OrderedDict()  # gift_name -> {"points", "price_id", "sale_id", "loaded", "stale", "lock"}
+
+def on_gift_changed(table: str, gift_name, rowid: int) -> None:
+    """
+    Обработчик событий changefeed.py: помечает закэшированные ряды устаревшими.
+    """
+    CHANGE_EVENTS_TOTAL.inc(table=table)
+    floor_cache.on_change(table, gift_name, rowid)
+    if table == changefeed.RESET:
+        series_cache.clear()
+        return
+    id_key = "price_id" if table == "prices" else "sale_id"
+    for name, entry in series_cache.items():
+        # Продажи выбираются по LIKE 'name%' (в названии есть номер экземпляра)
+        matches = name == gift_name or (table == "sales" and gift_name and gift_name.startswith(name))
+        if matches and rowid > entry[id_key]:
+            entry["stale"] = True
+
+async def fetch_price_series(gift_name: str) -> list:
+    """
+    Отсортированный по дате ряд (datetime, цена TON) без подозрительных строк.
+    """
+    entry = series_cache.get(gift_name)
+    if entry is None:
+        entry = {"points": [], "price_id": 0, "sale_id": 0, "loaded": False, "stale": True, "lock": asyncio.Lock()}
+        series_cache[gift_name] = entry
+        while len(series_cache) > SERIES_CACHE_SIZE:
+            series_cache.popitem(last=False)
+    else:
+        series_cache.move_to_end(gift_name)
+
+    async with entry["lock"]:
+        if not entry["stale"]:
+            SERIES_CACHE_TOTAL.inc(result="hit")
+            return list(entry["points"])
+        SERIES_CACHE_TOTAL.inc(result="refresh" if entry["loaded"] else "miss")
+        # Сбрасываем флаг до запросов: событие, пришедшее во время чтения, снова его выставит
+        entry["stale"] = False
+        try:
+            # Дневные закрытия меняет только retention.py, а после него приходит сброс кэша
+            new_points = [] if entry["loaded"] else await fetch_daily_series(gift_name)
+            with stage("sql"), DB_QUERY_SECONDS.time(query="select_floor_series"):
+                async with gift_db.execute(f"""
+                    SELECT id, date, floor_ton
+                    FROM prices
+                    WHERE gift_name = ? AND id > ? AND floor_ton IS NOT NULL {NOT_SUSPICIOUS}
+                    ORDER BY id
+                """, (gift_name, entry["price_id"])) as cursor:
+                    price_rows = await cursor.fetchall()
+            with stage("sql"), DB_QUERY_SECONDS.time(query="select_sales_series"):
+                async with gift_db.execute(f"""
+                    SELECT id, date, price_ton
+                    FROM sales
+                    WHERE gift_name LIKE ? AND id > ? {NOT_SUSPICIOUS}
+                    ORDER BY id
+                """, (f"{gift_name}%", entry["sale_id"])) as cursor:
+                    sales_rows = await cursor.fetchall()
+        except Exception:
+            entry["stale"] = True
+            raise
+
+        with stage("parse_date"):
+            for _, date_str, price_ton in price_rows + sales_rows:
+                try:
+                    new_points.append((parse_date(date_str), price_ton))
+                except Exception:
+                    continue
+        entry["loaded"] = True
+        if price_rows:
+            entry["price_id"] = price_rows[-1][0]
+        if sales_rows:
+            entry["sale_id"] = sales_rows[-1][0]
+        if new_points:
+            entry["points"].extend(new_points)
+            # Почти отсортированный список: timsort досортирует хвост за линейное время
+            entry["points"].sort(key=lambda x: x[0])
+        return list(entry["points"])
+
+async def fetch_price_stats(gift_name: str):
+    """
+    Средняя, минимум, максимум и выборочное стандартное отклонение по тому же ряду,
+    что строит fetch_price_series, — агрегатами в SQLite, без выгрузки строк.
+    Дисперсия считается в два прохода (отклонения от средней), как в statistics.stdev.
+    """
+    with stage("sql"), DB_QUERY_SECONDS.time(query="select_price_stats"):
+        async with gift_db.execute(f"""
+            WITH series(price) AS (
+                SELECT close_floor FROM prices_daily
+                WHERE gift_name = ? AND close_floor IS NOT NULL AND last_date GLOB ?
+                UNION ALL
+                SELECT floor_ton FROM prices
+                WHERE gift_name = ? AND floor_ton IS NOT NULL AND date GLOB ? {NOT_SUSPICIOUS}
+                UNION ALL
+                SELECT price_ton FROM sales
+                WHERE gift_name LIKE ? AND price_ton IS NOT NULL AND date GLOB ? {NOT_SUSPICIOUS}
+            ),
+            totals AS (SELECT COUNT(*) AS n, AVG(price) AS mean, MIN(price) AS lo, MAX(price) AS hi FROM series)
+            SELECT n, mean, lo, hi,
+                   (SELECT TOTAL((price - mean) * (price - mean)) FROM series) / MAX(n - 1, 1)
+            FROM totals
+        """, (gift_name, DATE_GLOB, gift_name, DATE_GLOB, f"{gift_name}%", DATE_GLOB)) as cursor:
+            n, mean_price, min_price, max_price, variance = await cursor.fetchone()
+    std_price = math.sqrt(variance) if n > 1 else 0
+    return mean_price, min_price, max_price, std_price
+
+def build_sub_buttons(gift_name: str) -> InlineKeyboardMarkup:
+    keyboard = [
+        [
+            InlineKeyboardButton("Прогноз (TON)", callback_data=f"forecast:{gift_name}"),
+            InlineKeyboardButton("Детальный анализ", callback_data=f"detailed:{gift_name}")
+        ],
+        [
+            InlineKeyboardButton("Вернуться", callback_data="list")
+        ]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@instrumented
+async def display_gift_info(gift_name: str, query) -> None:
+    text = await get_gift_info_text(gift_name)
+    markup = build_sub_buttons(gift_name)
+    if query.message.text:
+        await query.edit_message_text(text, parse_mode='HTML', reply_markup=markup)
+    else:
+        await query.edit_message_caption(caption=text, parse_mode='HTML', reply_markup=markup)
+
+@instrumented
+async def forecast_inline_otc(gift_name: str, query) -> None:
+    """
+    Прогноз цены (TON) для OTC-рынка:
+      - Использует данные из таблиц prices (поле floor_ton) и sales (поле price_ton),
+      - Строит три модели: RANSAC, обычная линейная регрессия и Holt (экспоненциальное сглаживание).
+      - Итоговый прогноз = среднее значений всех моделей.
+    """
+    # Свёрнутая история (prices_daily), floor-цены и продажи — из кэша рядов
+    combined_data = await fetch_price_series(gift_name)
+
+    if not combined_data or len(combined_data) < 2:
+        await query.edit_message_text("Недостаточно данных (TON) для анализа данного подарка.")
+        return
+
+    # Ряд уже отсортирован по дате; модели обучаются только на окне последних точек
+    start = forecasting.window_start(combined_data)
+    dates = [item[0] for item in combined_data[start:]]
+    prices = [item[1] for item in combined_data[start:]]
+
+    # Преобразуем даты в числовой формат
+    X = forecasting.to_features(dates)
+    y = np.array(prices)
+
+    # Весовая функция для свежести данных (больше веса – последним данным)
+    weights = forecasting.recency_weights(X, forecasting.ALPHA)
+    future_date = dates[-1] + forecasting.HORIZON
+    future_day_ord = np.array([[future_date.toordinal()]])
+
+    with stage("ransac"):
+        # Модель 1: RANSAC (устойчивая регрессия)
+        try:
+            ransac, ransac_forecast = forecasting.fit_ransac(X, y, weights, future_day_ord)
+        except ValueError as e:
+            # Нет консенсусного множества (на коротком окне это вероятнее) — как и Holt,
+            # подменяется линейной регрессией
+            logger.error(f"RANSAC model error: {e}")
+            ransac = None
+
+    with stage("linreg"):
+        # Модель 2: обычная линейная регрессия
+        lin_model, lin_future = forecasting.fit_linear(X, y, weights, future_day_ord)
+    if ransac is None:
+        ransac_forecast = lin_future
+
+    with stage("holt"):
+        # Модель 3: Holt (экспоненциальное сглаживание)
+        try:
+            holt_fit, holt_forecast = forecasting.fit_holt(y)
+        except Exception as e:
+            logger.error(f"Holt model error: {e}")
+            holt_forecast = lin_future
+
+    # Итоговый прогноз (среднее значение)
+    final_forecast = forecasting.ensemble(ransac_forecast, lin_future, holt_forecast)
+
+    with stage("matplotlib"):
+        # --- Построение графика ---
+        import matplotlib.dates as mdates
+        plt.figure(figsize=(12, 6))
+    
+        # Фактические цены с прозрачностью
+        plt.scatter(dates, y, color='blue', alpha=0.8, s=60, label="Фактические цены (TON)")
+    
+        # Линейная регрессия
+        plt.plot(dates, lin_model.predict(X), 'g--', linewidth=1.5, label="Лин. регрессия")
+    
+        # RANSAC регрессия
+        if ransac is not None:
+            plt.plot(dates, ransac.predict(X), 'r--', linewidth=1.5, label="RANSAC регрессия")
+    
+        # Holt сглаживание (если доступно)
+        try:
+            plt.plot(dates, holt_fit.fittedvalues, 'm--', linewidth=1.5, label="Holt сглаживание")
+        except:
+            pass
+
+        # Прогнозные точки
+        plt.scatter(future_date, ransac_forecast, color='red', s=100, label=f"RANSAC прогноз ({ransac_forecast:.2f})")
+        plt.scatter(future_date, lin_future, color='green', s=100, label=f"Лин. прогноз ({lin_future:.2f})")
+        plt.scatter(future_date, holt_forecast, color='magenta', s=100, label=f"Holt прогноз ({holt_forecast:.2f})")
+        plt.scatter(future_date, final_forecast, color='black', s=120, label=f"Итоговый прогноз ({final_forecast:.2f})")
+    
+        # Форматирование оси X как даты
+        ax = plt.gca()
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
+        ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
+        plt.xticks(rotation=45)
+    
+        plt.ylim(bottom=0)
+        plt.xlabel("Дата")
+        plt.ylabel("Цена (TON)")
+        plt.title(f"OTC-прогноз (TON) для подарка: {gift_name}")
+        plt.grid(True, linestyle=':')
+        plt.legend()
+        plt.tight_layout()
+
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png')
+        buf.seek(0)
+        plt.close()
+
+    text = (
+        f"🔮 <b>OTC-прогноз (TON) для подарка: {gift_name}</b>\n"
+        f"Дата прогноза: {future_date.strftime('%Y-%m-%d')}\n\n"
+        f"Использованы данные из таблиц prices (floor_ton) и sales (price_ton).\n"
+        f"Окно обучения: {len(dates)} точек с {dates[0].strftime('%Y-%m-%d')}\n"
+        f"Модели прогнозирования:\n"
+        f"  • RANSAC: {ransac_forecast:.2f} TON\n"
+        f"  • Линейная регрессия: {lin_future:.2f} TON\n"
+        f"  • Holt сглаживание: {holt_forecast:.2f} TON\n\n"
+        f"Итоговый прогноз (среднее): <b>{final_forecast:.2f} TON</b>"
+    )
+
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data=f"gift:{gift_name}")]])
+    with stage("send"):
+        await query.edit_message_media(
+            media=InputMediaPhoto(media=buf, caption=text, parse_mode='HTML'),
+            reply_markup=markup
+        )
+
+
+# --- ДЕТАЛЬНЫЙ АНАЛИЗ (пример) ---
+@instrumented
+async def detailed_inline(gift_name: str, query) -> None:
+    # Получаем базовую информацию о подарке
+    with stage("sql"), DB_QUERY_SECONDS.time(query="select_gift"):
+        async with gift_db.execute("SELECT id, name, total_count FROM gifts WHERE name = ?", (gift_name,)) as cursor:
+            gift = await cursor.fetchone()
+    if not gift:
+        await query.edit_message_text(f"Подарок '{gift_name}' не найден.")
+        return
+    gift_id, name, total_count = gift
+
+    # Свёрнутая история (prices_daily), floor-цены и продажи — из кэша рядов
+    combined_data = await fetch_price_series(gift_name)
+
+    if not combined_data or len(combined_data) < 2:
+        await query.edit_message_text("Недостаточно данных (TON) для детального анализа.")
+        return
+
+    dates = [item[0] for item in combined_data]
+    ton_prices = [item[1] for item in combined_data]
+
+    # Статистические показатели считает SQLite
+    mean_price, min_price, max_price, std_price = await fetch_price_stats(gift_name)
+
+    with stage("linreg"):
+        # Строим модель линейной регрессии для прогноза
+        X = np.array([d.toordinal() for d in dates]).reshape(-1, 1)
+        y = np.array(ton_prices)
+        lin_model = LinearRegression()
+        lin_model.fit(X, y)
+        future_date = dates[-1] + timedelta(days=1)
+        forecast_lin = lin_model.predict([[future_date.toordinal()]])[0]
+
+    # Формируем текстовый отчет
+    analysis_text = (
+        f"📊 <b>Детальный анализ (TON):</b>\n"
+        f"Подарок: {name}\n"
+        f"Общее количество: {total_count}\n\n"
+        f"Статистика по цене (TON):\n"
+        f"  • Средняя: {mean_price:.2f}\n"
+        f"  • Мин: {min_price:.2f}, Макс: {max_price:.2f}\n"
+        f"  • Стандартное отклонение: {std_price:.2f}\n"
+        f"Линейный прогноз на {future_date.strftime('%Y-%m-%d')}: {forecast_lin:.2f} TON\n"
+    )
+    with stage("sql"), DB_QUERY_SECONDS.time(query="select_sale_sketches"):
+        windows = await sketches.load_windows(gift_db, gift_name, SALE_PERCENTILE_WINDOWS)
+    if any(sketch.count for sketch in windows.values()):
+        analysis_text += "\nПродажи, перцентили (TON): p10 / медиана / p90\n"
+        for title, sketch in windows.items():
+            if sketch.count:
+                analysis_text += (f"  • {title}: {sketch.quantile(0.1):.2f} / {sketch.quantile(0.5):.2f} / "
+                                  f"{sketch.quantile(0.9):.2f} ({sketch.count} прод.)\n")
+    if EXCLUDE_SUSPICIOUS:
+        with stage("sql"), DB_QUERY_SECONDS.time(query="count_suspicious"):
+            async with gift_db.execute("""
+                SELECT (SELECT COUNT(*) FROM prices WHERE gift_name = ? AND suspicious = 1),
+                       (SELECT COUNT(*) FROM sales WHERE gift_name LIKE ? AND suspicious = 1)
+            """, (gift_name, f"{gift_name}%")) as cursor:
+                excluded_prices, excluded_sales = await cursor.fetchone()
+        if excluded_prices or excluded_sales:
+            analysis_text += f"Исключено подозрительных точек: {excluded_prices + excluded_sales}\n"
+
+    with stage("matplotlib"):
+        # Построение графика
+        import matplotlib.dates as mdates
+        fig, ax = plt.subplots(figsize=(12, 6))
+        ax.plot(dates, ton_prices, 'bo-', label="Фактические цены (TON)")
+        y_lin_pred = lin_model.predict(X)
+        ax.plot(dates, y_lin_pred, 'r--', linewidth=1.5, label="Линейная регрессия")
+        ax.scatter(future_date, forecast_lin, color='green', s=100, label=f"Прогноз ({forecast_lin:.2f} TON)")
+
+        # Форматируем ось X как даты
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
+        ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
+        plt.xticks(rotation=45)
+        ax.set_ylim(bottom=0)
+
+        ax.set_xlabel("Дата")
+        ax.set_ylabel("Цена (TON)")
+        ax.set_title(f"Детальный анализ (TON) для {name}")
+        ax.grid(True, linestyle=':')
+        ax.legend()
+        plt.tight_layout()
+
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png')
+        buf.seek(0)
+        plt.close()
+
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data=f"gift:{gift_name}")]])
+    with stage("send"):
+        await query.edit_message_media(
+            media=InputMediaPhoto(media=buf, caption=analysis_text, parse_mode='HTML'),
+            reply_markup=markup
+        )
+
+
+# --- ПОДПИСКИ НА ЦЕНУ ---
+MAX_ALERTS_PER_USER = 20
+ALERT_DELIVERY_SECONDS = 5
+
+@instrumented
+@rate_limit
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /alert <название> above|below <TON>
+    """
+    await register_user(update)
+    args = context.args or []
+    usage = "Пример: /alert Plush Pepe below 25"
+    if len(args) < 3 or args[-2].lower() not in alerts.DIRECTIONS:
+        await update.message.reply_text(usage)
+        return
+    gift_name = " ".join(args[:-2])
+    direction = args[-2].lower()
+    try:
+        threshold = float(args[-1].replace(",", "."))
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+    if threshold <= 0:
+        await update.message.reply_text("Порог должен быть больше нуля.")
+        return
+
+    with stage("sql"), DB_QUERY_SECONDS.time(query="select_gift"):
+        async with gift_db.execute("SELECT name FROM gifts WHERE name = ?", (gift_name,)) as cursor:
+            gift = await cursor.fetchone()
+    if not gift:
+        await update.message.reply_text(f"Подарок '{gift_name}' не найден.")
+        return
+
+    user = update.effective_user
+    async with user_db.execute("SELECT COUNT(*) FROM alerts WHERE user_id = ? AND active = 1", (user.id,)) as cursor:
+        (active_count,) = await cursor.fetchone()
+    if active_count >= MAX_ALERTS_PER_USER:
+        await update.message.reply_text(f"Можно держать не больше {MAX_ALERTS_PER_USER} активных подписок.")
+        return
+
+    cursor = await user_db.execute(
+        "INSERT INTO alerts (user_id, chat_id, gift_name, direction, threshold, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (user.id, update.effective_chat.id, gift_name, direction, threshold, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+    with DB_COMMIT_SECONDS.time():
+        await user_db.commit()
+    sign = "≥" if direction == "above" else "≤"
+    await update.message.reply_text(
+        f"Подписка #{cursor.lastrowid} создана: {gift_name} {sign} {threshold:g} TON.\n"
+        f"Уведомление придёт один раз, когда цена floor или продажи пересечёт порог."
+    )
+
+@instrumented
+@rate_limit
+async def alerts_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await register_user(update)
+    async with user_db.execute(
+        "SELECT id, gift_name, direction, threshold FROM alerts WHERE user_id = ? AND active = 1 ORDER BY id",
+        (update.effective_user.id,)
+    ) as cursor:
+        rows = await cursor.fetchall()
+    if not rows:
+        await update.message.reply_text("Активных подписок нет. Создать: /alert Plush Pepe below 25")
+        return
+    lines = [f"#{alert_id}: {gift_name} {'≥' if direction == 'above' else '≤'} {threshold:g} TON"
+             for alert_id, gift_name, direction, threshold in rows]
+    await update.message.reply_text("🔔 Ваши подписки:\n" + "\n".join(lines) + "\n\nОтменить: /unalert <id>")
+
+@instrumented
+@rate_limit
+async def unalert_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await register_user(update)
+    try:
+        alert_id = int((context.args or [""])[0].lstrip("#"))
+    except ValueError:
+        await update.message.reply_text("Пример: /unalert 12")
+        return
+    cursor = await user_db.execute(
+        "UPDATE alerts SET active = 0 WHERE id = ? AND user_id = ? AND active = 1",
+        (alert_id, update.effective_user.id)
+    )
+    with DB_COMMIT_SECONDS.time():
+        await user_db.commit()
+    if cursor.rowcount:
+        await update.message.reply_text(f"Подписка #{alert_id} отменена.")
+    else:
+        await update.message.reply_text(f"Активная подписка #{alert_id} не найдена.")
+
+async def deliver_alerts_loop() -> None:
+    """
+    Забирает из alert_events уведомления, записанные snifer.py, и ставит их в outbox.
+    Событие помечается доставленным только после отправки; после перезапуска
+    неотправленные события будут поставлены в очередь заново.
+    """
+    last_queued_id = 0
+    while True:
+        await asyncio.sleep(ALERT_DELIVERY_SECONDS)
+        try:
+            async with user_db.execute("""
+                SELECT e.id, a.chat_id, a.gift_name, a.direction, a.threshold, e.price_ton, e.source
+                FROM alert_events e JOIN alerts a ON a.id = e.alert_id
+                WHERE e.delivered = 0 AND e.id > ?
+                ORDER BY e.id
+                LIMIT 1000
+            """, (last_queued_id,)) as cursor:
+                events = await cursor.fetchall()
+            for event_id, chat_id, gift_name, direction, threshold, price_ton, source in events:
+                what = "Floor" if source == "floor" else "Продажа"
+                sign = "≥" if direction == "above" else "≤"
+                outbox.submit(
+                    chat_id,
+                    f"🔔 {gift_name}: {what} {price_ton:g} TON ({sign} {threshold:g} TON)",
+                    PRIORITY_ALERT,
+                    on_sent=functools.partial(mark_alert_delivered, event_id),
+                )
+                last_queued_id = event_id
+        except Exception as e:
+            logger.error(f"Ошибка доставки уведомлений: {e}")
+
+async def mark_alert_delivered(event_id: int) -> None:
+    await user_db.execute("UPDATE alert_events SET delivered = 1 WHERE id = ?", (event_id,))
+    await user_db.commit()
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /broadcast <текст> – объявление всем пользователям бота (только для администраторов).
+    Идёт через outbox с низшим приоритетом и не мешает уведомлениям о ценах.
+    """
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    text = " ".join(context.args or []).strip()
+    if not text:
+        await update.message.reply_text("Пример: /broadcast Бот будет перезапущен в 03:00")
+        return
+    async with user_db.execute("SELECT user_id FROM users") as cursor:
+        user_ids = [row[0] for row in await cursor.fetchall()]
+    for user_id in user_ids:
+        # В личном чате chat_id совпадает с user_id
+        outbox.submit(user_id, text, PRIORITY_BROADCAST)
+    await update.message.reply_text(f"Объявление поставлено в очередь для {len(user_ids)} пользователей.")
+
+# --- ПОРТФЕЛЬ ---
+PORTFOLIO_USAGE = (
+    "Портфель:\n"
+    "/portfolio – оценка по последнему floor\n"
+    "/portfolio add 3 Plush Pepe, 10 Lunar Snake – добавить подарки\n"
+    "/portfolio set 5 Plush Pepe – задать количество (0 – убрать)\n"
+    "/portfolio remove Plush Pepe – убрать позицию\n"
+    f"/portfolio chart [дней] – график стоимости (по умолчанию {portfolio.CHART_DAYS})"
+)
+
+@instrumented
+@rate_limit
+async def portfolio_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /portfolio [add|set|remove <позиции> | chart [дней]]
+    """
+    await register_user(update)
+    args = context.args or []
+    action = args[0].lower() if args else ""
+    if action in ("add", "set", "remove"):
+        if not await update_holdings(update, action, " ".join(args[1:])):
+            return
+    elif action == "chart":
+        await portfolio_chart(update, args[1:])
+        return
+    elif action:
+        await update.message.reply_text(PORTFOLIO_USAGE)
+        return
+    await update.message.reply_text(await portfolio_text(update.effective_user.id))
+
+async def update_holdings(update: Update, action: str, text: str) -> bool:
+    try:
+        items = portfolio.parse_holdings(text, default_quantity=0 if action == "remove" else 1)
+    except ValueError as e:
+        await update.message.reply_text(f"Не удалось разобрать позицию '{e}'.\n\n{PORTFOLIO_USAGE}")
+        return False
+    if not items:
+        await update.message.reply_text(PORTFOLIO_USAGE)
+        return False
+
+    names = sorted({name for name, _ in items})
+    with stage("sql"), DB_QUERY_SECONDS.time(query="select_gift"):
+        async with gift_db.execute(
+            f"SELECT name FROM gifts WHERE name IN ({', '.join('?' * len(names))})", names
+        ) as cursor:
+            known = {row[0] for row in await cursor.fetchall()}
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        await update.message.reply_text(f"Подарки не найдены: {', '.join(unknown)}")
+        return False
+
+    user_id = update.effective_user.id
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    holdings = dict(await portfolio.load_holdings(user_db, user_id))
+    for name, quantity in items:
+        if action == "add":
+            holdings[name] = min(holdings.get(name, 0) + quantity, portfolio.MAX_QUANTITY)
+        elif action == "set" and quantity > 0:
+            holdings[name] = quantity
+        else:
+            holdings.pop(name, None)
+    if len(holdings) > portfolio.MAX_HOLDINGS:
+        await update.message.reply_text(f"В портфеле может быть не больше {portfolio.MAX_HOLDINGS} позиций.")
+        return False
+
+    for name in names:
+        if name in holdings:
+            await user_db.execute("""
+                INSERT INTO holdings (user_id, gift_name, quantity, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, gift_name) DO UPDATE SET quantity = excluded.quantity, updated_at = excluded.updated_at
+            """, (user_id, name, holdings[name], now))
+        else:
+            await user_db.execute("DELETE FROM holdings WHERE user_id = ? AND gift_name = ?", (user_id, name))
+    with DB_COMMIT_SECONDS.time():
+        await user_db.commit()
+    return True
+
+async def portfolio_text(user_id: int) -> str:
+    holdings = await portfolio.load_holdings(user_db, user_id)
+    if not holdings:
+        return "Портфель пуст.\n\n" + PORTFOLIO_USAGE
+    with stage("sql"), DB_QUERY_SECONDS.time(query="refresh_floor_cache"):
+        await floor_cache.refresh(gift_db, NOT_SUSPICIOUS)
+    lines, total_floor, total_average = floor_cache.value(holdings)
+    text = "💼 Портфель (TON):\n"
+    for gift_name, quantity, floor, average, amount, date in lines:
+        if floor is None:
+            text += f"  • {quantity} × {gift_name}: нет данных о цене\n"
+        else:
+            text += f"  • {quantity} × {gift_name}: floor {floor:.2f} → {amount:.2f} ({date[:10]})\n"
+    text += (f"\nИтого по floor: {total_floor:.2f} TON\n"
+             f"По средней цене: {total_average:.2f} TON")
+    return text
+
+async def portfolio_chart(update: Update, args: list) -> None:
+    try:
+        days = int(args[0]) if args else portfolio.CHART_DAYS
+    except ValueError:
+        await update.message.reply_text(PORTFOLIO_USAGE)
+        return
+    days = max(1, min(days, 365))
+    holdings = await portfolio.load_holdings(user_db, update.effective_user.id)
+    if not holdings:
+        await update.message.reply_text("Портфель пуст.\n\n" + PORTFOLIO_USAGE)
+        return
+    with stage("sql"), DB_QUERY_SECONDS.time(query="select_daily_closes"):
+        closes = await portfolio.load_daily_closes(gift_db, [name for name, _ in holdings], days, NOT_SUSPICIOUS)
+    history = portfolio.value_history(closes, holdings)
+    if len(history) < 2:
+        await update.message.reply_text(f"Недостаточно данных о ценах за {days} дн. для графика.")
+        return
+
+    with stage("matplotlib"):
+        dates = [datetime.strptime(day, portfolio.DAY_FORMAT) for day, _ in history]
+        values = [value for _, value in history]
+        fig, ax = plt.subplots(figsize=(12, 6))
+        ax.plot(dates, values, 'b.-', label="Стоимость по floor (TON)")
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
+        plt.xticks(rotation=45)
+        ax.set_ylim(bottom=0)
+        ax.set_xlabel("Дата")
+        ax.set_ylabel("Стоимость (TON)")
+        ax.set_title(f"Портфель за {days} дн. (текущий состав)")
+        ax.grid(True, linestyle=':')
+        ax.legend()
+        plt.tight_layout()
+
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png')
+        buf.seek(0)
+        plt.close()
+
+    with stage("send"):
+        await update.message.reply_photo(
+            photo=buf,
+            caption=f"💼 Стоимость портфеля: {values[0]:.2f} → {values[-1]:.2f} TON ({history[0][0]} – {history[-1][0]})"
+        )
+
+# --- СПРЕДЫ ПРОДАЖ К FLOOR ---
+@instrumented
+@rate_limit
+async def spreads_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /spreads [часов] — крупнейшие отклонения цены продажи от floor (считает snifer.py).
+    """
+    await register_user(update)
+    try:
+        hours = int(context.args[0]) if context.args else spreads.DEFAULT_HOURS
+        if not 1 <= hours <= 24 * 30:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("Использование: /spreads [часов], от 1 до 720.")
+        return
+    with stage("sql"), DB_QUERY_SECONDS.time(query="select_spreads"):
+        rows = await spreads.load_top(gift_db, hours)
+    if not rows:
+        await update.message.reply_text(f"За последние {hours} ч продаж с известным floor нет.")
+        return
+    text = f"📊 Продажи дальше всего от floor за {hours} ч:\n"
+    for gift_name, date, price_ton, floor_ton, spread_ton, spread_pct in rows:
+        arrow = "🔻" if spread_ton < 0 else "🔺"
+        text += (f"{arrow} {gift_name}: {price_ton:.2f} TON при floor {floor_ton:.2f} "
+                 f"({spread_pct:+.1f}%, {spread_ton:+.2f} TON) — {date}\n")
+    await update.message.reply_text(text)
+
+# --- ОБРАБОТЧИК CALLBACK ---
+@instrumented
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    data = query.data
+    await query.answer()
+    if data.startswith("gift:"):
+        gift_name = data.split(":", 1)[1]
+        await display_gift_info(gift_name, query)
+    elif data.startswith("forecast:"):
+        gift_name = data.split(":", 1)[1]
+        await forecast_inline_otc(gift_name, query)
+    elif data.startswith("detailed:"):
+        gift_name = data.split(":", 1)[1]
+        await detailed_inline(gift_name, query)
+    elif data == "list":
+        await query.message.delete()
+        keyboard = []
+        row = []
+        for gift in GIFT_LIST:
+            row.append(InlineKeyboardButton(gift, callback_data=f"gift:{gift}"))
+            if len(row) == 3:
+                keyboard.append(row)
+                row = []
+        if row:
+            keyboard.append(row)
+        markup = InlineKeyboardMarkup(keyboard)
+        await context.bot.send_message(chat_id=query.message.chat_id, text="Выберите подарок:", reply_markup=markup)
+    else:
+        await query.edit_message_text("Неизвестная команда.")
+
+@instrumented
+@rate_limit
+async def list_gifts_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await register_user(update)
+    keyboard = []
+    row = []
+    for gift in GIFT_LIST:
+        row.append(InlineKeyboardButton(gift, callback_data=f"gift:{gift}"))
+        if len(row) == 3:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text("Выберите подарок:", reply_markup=markup)
+
+async def on_startup(application) -> None:
+    start_background_tasks(application)
+
+def start_background_tasks(application, deliver_alerts: bool = True, workers: int = 1) -> None:
+    """
+    Outbox, доставка уведомлений о ценах и подписка на изменения gifts.db.
+    В webhook-режиме лимит Bot API делится между workers воркерами, а уведомления
+    доставляет только один из них.
+    """
+    global outbox
+    outbox = Outbox(application.bot.send_message, global_rate=GLOBAL_RATE / workers)
+    application.create_task(outbox.run())
+    if deliver_alerts:
+        application.create_task(deliver_alerts_loop())
+    application.create_task(changefeed.Subscriber("analyzer", on_gift_changed, gift_db).run())
+
+def build_application(builder):
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot")
+    application = builder.token(BOT_TOKEN).build()
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("gifts", list_gifts_command))
+    application.add_handler(CommandHandler("gift", gift_info))
+    application.add_handler(CommandHandler("forecast", forecast_prices))
+    application.add_handler(CommandHandler("detailed", detailed_analysis))
+    application.add_handler(CommandHandler("myprofile", myprofile))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("alert", alert_command))
+    application.add_handler(CommandHandler("alerts", alerts_command))
+    application.add_handler(CommandHandler("unalert", unalert_command))
+    application.add_handler(CommandHandler("portfolio", portfolio_command))
+    application.add_handler(CommandHandler("spreads", spreads_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CallbackQueryHandler(handle_callback))
+    return application
+
+def start_metrics(application, port) -> None:
+    QUEUE_DEPTH.set_function(application.update_queue.qsize, queue="updates")
+    QUEUE_DEPTH.set_function(lambda: len(outbox) if outbox is not None else 0, queue="outbox")
+    start_http_server(port)
+    logger.info(f"Metrics on http://127.0.0.1:{port}/metrics")
+
+async def main() -> None:
+    # httpx пишет строку на каждый запрос к Bot API — оставляем только предупреждения
+    setup_logging("analyzer", levels={"httpx": "WARNING"})
+    await init_gift_db()
+    await init_user_db()
+    profiling.arm_from_env()
+    application = build_application(ApplicationBuilder().post_init(on_startup))
+
+    if METRICS_PORT:
+        start_metrics(application, METRICS_PORT)
+
+    logger.info("Bot started")
+    await application.run_polling(close_loop=False)
+
+async def run_worker(index: int, workers: int) -> None:
+    """
+    Воркер webhook.py: получает обновления от фронт-процесса через stdin (JSON по строке)
+    и обрабатывает их по очереди — порядок обновлений одного пользователя сохраняется,
+    потому что фронт всегда отправляет их одному и тому же воркеру.
+    """
+    setup_logging(f"analyzer-{index}", levels={"httpx": "WARNING"})
+    await init_gift_db(read_only=True)
+    await init_user_db()
+    profiling.arm_from_env()
+    application = build_application(ApplicationBuilder().updater(None))
+    await application.initialize()
+    await application.start()
+    start_background_tasks(application, deliver_alerts=index == 0, workers=workers)
+    if METRICS_PORT:
+        start_metrics(application, METRICS_PORT + index)
+    logger.info(f"Worker {index}/{workers} started")
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=1 << 22)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    try:
+        while line := await reader.readline():
+            try:
+                update = Update.de_json(json.loads(line), application.bot)
+            except Exception as e:
+                logger.error(f"Некорректное обновление от фронт-процесса: {e}")
+                continue
+            await application.update_queue.put(update)
+    finally:
+        # stdin закрыт — фронт завершается: дорабатываем очередь и выходим
+        await application.stop()
+        await application.shutdown()
+        await gift_db.close()
+        await user_db.close()
+
+async def init_databases() -> None:
+    """
+    Создаёт схемы gifts.db и users.db (webhook.py — до запуска воркеров).
+    """
+    await init_gift_db()
+    await init_user_db()
+    await gift_db.close()
+    await user_db.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        asyncio.run(run_worker(int(sys.argv[2]), int(sys.argv[3])))
+    elif sys.argv[1:] == ["--init-db"]:
+        asyncio.run(init_databases())
+    else:
+        asyncio.run(main())
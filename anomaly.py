@@ -0,0 +1,179 @@
+"""
+Потоковое обнаружение выбросов в ценах при инжесте.
+
+Для каждого подарка (отдельно для floor-цен и для продаж) поддерживается
+EWMA-полоса: экспоненциальное среднее цены и экспоненциальное среднее
+абсолютного отклонения. Новая цена помечается как подозрительная, если она
+не положительна или выходит за mean ± K * dev. Обработка одной строки — O(1),
+память — O(число подарков).
+
+Подозрительная цена не сдвигает полосу целиком: в состояние попадает значение,
+обрезанное по границе полосы, поэтому одиночная «ошибка пальцем» не портит
+оценку, а реальный сдвиг уровня принимается за несколько сообщений.
+
+Полоса помнит дату последней точки. Строки старше неё (импорт старого
+экспорта после того, как детектор прогрет на свежих данных) проверяются
+отдельной «исторической» полосой подарка: уровень цен полгода назад мог быть
+совсем другим, и сравнение со свежей полосой пометило бы всю историю.
+Историческая полоса начинается заново, когда даты снова идут назад.
+
+Флаг пишется в колонку suspicious таблиц prices и sales; analyzer_v2.py
+исключает такие строки из статистики и графиков.
+"""
+import re
+
+ALPHA = 0.05        # вес новой точки в EWMA
+K = 6.0             # ширина полосы в единицах среднего абсолютного отклонения
+WARMUP = 20         # сколько точек подарка нужно, прежде чем что-то помечать
+MIN_REL_DEV = 0.02  # нижняя граница отклонения: 2% от среднего (для «плоских» рядов)
+WARMUP_ROWS = 50_000  # сколько последних строк читать из БД для прогрева
+
+SCHEMA_MIGRATIONS = (
+    ("prices", "ALTER TABLE prices ADD COLUMN suspicious INTEGER DEFAULT 0"),
+    ("sales", "ALTER TABLE sales ADD COLUMN suspicious INTEGER DEFAULT 0"),
+)
+
+FLOOR_WARMUP_QUERY = '''
+    SELECT gift_name, floor_ton, date FROM prices
+    WHERE floor_ton IS NOT NULL AND id > (SELECT COALESCE(MAX(id), 0) FROM prices) - ?
+    ORDER BY id
+'''
+SALE_WARMUP_QUERY = '''
+    SELECT gift_name, price_ton, date FROM sales
+    WHERE price_ton IS NOT NULL AND id > (SELECT COALESCE(MAX(id), 0) FROM sales) - ?
+    ORDER BY id
+'''
+
+_ITEM_NUMBER = re.compile(r"\s*#\d+$")
+
+
+def base_gift_name(gift_name: str) -> str:
+    """
+    "Plush Pepe #1234" -> "Plush Pepe" (продажи приходят с номером экземпляра).
+    """
+    return _ITEM_NUMBER.sub("", gift_name or "").strip()
+
+
+def _date_key(date):
+    """
+    Приводит даты snifer.py ("2025.01.13 - 03:13:19") и экспортов Telegram
+    ("2025-01-13T03:13:19") к одному виду, сравнимому как строка.
+    """
+    return date.replace(".", "-", 2).replace(" - ", "T") if date else None
+
+
+class _Band:
+    __slots__ = ("mean", "dev", "n", "last")
+
+    def __init__(self, value: float, last=None):
+        self.mean = value
+        self.dev = 0.0
+        self.n = 1
+        self.last = last
+
+
+class AnomalyDetector:
+    def __init__(self, alpha: float = ALPHA, k: float = K, warmup: int = WARMUP, min_rel_dev: float = MIN_REL_DEV):
+        self.alpha = alpha
+        self.k = k
+        self.warmup = warmup
+        self.min_rel_dev = min_rel_dev
+        self.bands = {}
+        # Полосы для строк старше последней точки основной полосы
+        self.history = {}
+
+    def _band(self, key, value, date):
+        """
+        Полоса для точки с датой date (уже приведённой _date_key): основная или историческая.
+        None — полосы ещё не было, она создана по этой точке.
+        """
+        band = self.bands.get(key)
+        if band is None:
+            self.bands[key] = _Band(value, date)
+            return None
+        if date is None or band.last is None or date >= band.last:
+            if date is not None:
+                band.last = date
+            return band
+        history = self.history.get(key)
+        if history is None or (history.last is not None and date < history.last):
+            self.history[key] = _Band(value, date)
+            return None
+        history.last = date
+        return history
+
+    def observe(self, key, value, date=None) -> bool:
+        """
+        Проверяет значение и обновляет состояние. Возвращает True для подозрительного значения.
+        date — дата строки: более старые, чем уже виденные, строки проверяются исторической полосой.
+        """
+        if value is None:
+            return False
+        if value <= 0:
+            return True
+        band = self._band(key, value, _date_key(date))
+        if band is None:
+            return False
+
+        width = self.k * max(band.dev, self.min_rel_dev * abs(band.mean))
+        suspicious = band.n >= self.warmup and abs(value - band.mean) > width
+
+        # Обновляем по значению, обрезанному по полосе (после прогрева)
+        if band.n >= self.warmup:
+            value = min(max(value, band.mean - width), band.mean + width)
+        band.dev += self.alpha * (abs(value - band.mean) - band.dev)
+        band.mean += self.alpha * (value - band.mean)
+        band.n += 1
+        return suspicious
+
+    def observe_floor(self, gift_name: str, floor_ton, date: str = None) -> bool:
+        return self.observe(("floor", gift_name), floor_ton, date)
+
+    def observe_sale(self, gift_name: str, price_ton, date: str = None) -> bool:
+        return self.observe(("sale", base_gift_name(gift_name)), price_ton, date)
+
+    def warm_up(self, floor_rows, sale_rows) -> None:
+        for gift_name, floor_ton, date in floor_rows:
+            self.observe_floor(gift_name, floor_ton, date)
+        for gift_name, price_ton, date in sale_rows:
+            self.observe_sale(gift_name, price_ton, date)
+
+
+def ensure_schema(conn) -> None:
+    """
+    Добавляет колонку suspicious (синхронное соединение sqlite3).
+    """
+    for table, ddl in SCHEMA_MIGRATIONS:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if "suspicious" not in columns:
+            conn.execute(ddl)
+    conn.commit()
+
+
+async def ensure_schema_async(db) -> None:
+    """
+    Добавляет колонку suspicious (соединение aiosqlite).
+    """
+    for table, ddl in SCHEMA_MIGRATIONS:
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if "suspicious" not in columns:
+            await db.execute(ddl)
+    await db.commit()
+
+
+def load_detector(conn) -> AnomalyDetector:
+    detector = AnomalyDetector()
+    detector.warm_up(conn.execute(FLOOR_WARMUP_QUERY, (WARMUP_ROWS,)),
+                     conn.execute(SALE_WARMUP_QUERY, (WARMUP_ROWS,)).fetchall())
+    return detector
+
+
+async def load_detector_async(db) -> AnomalyDetector:
+    detector = AnomalyDetector()
+    async with db.execute(FLOOR_WARMUP_QUERY, (WARMUP_ROWS,)) as cursor:
+        floor_rows = await cursor.fetchall()
+    async with db.execute(SALE_WARMUP_QUERY, (WARMUP_ROWS,)) as cursor:
+        sale_rows = await cursor.fetchall()
+    detector.warm_up(floor_rows, sale_rows)
+    return detector
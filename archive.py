@@ -0,0 +1,121 @@
+"""
+Архив сырых сообщений каналов: snifer.py записывает каждое полученное сообщение
+до разбора, поэтому сообщения, которые отверг парсер с ошибкой, не теряются —
+после исправления парсера их можно прогнать заново (python snifer.py --replay).
+
+Формат — сегменты archive/YYYYmmdd-HHMMSS-<pid>.jsonl.gz, по строке JSON
+на сообщение: {"channel", "id", "date" (ISO 8601), "text", "raw_text"}.
+Сегменты только дописываются; новый сегмент начинается после SEGMENT_BYTES
+несжатых данных, через SEGMENT_SECONDS или при перезапуске процесса.
+Каждая запись сбрасывается на диск (Z_SYNC_FLUSH), так что при аварийном
+завершении теряется не больше одной записи; оборванный хвост сегмента
+читатель пропускает.
+"""
+import gzip
+import json
+import logging
+import os
+import time
+import zlib
+from datetime import datetime
+from types import SimpleNamespace
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+SEGMENT_BYTES = 64 * 1024 * 1024   # несжатых данных в сегменте
+SEGMENT_SECONDS = 24 * 3600
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+logger = logging.getLogger("archive")
+
+
+class ArchiveWriter:
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self.file = None
+        self.path = None
+        self.opened_at = 0.0
+        self.segment_bytes = 0
+        self.written = 0
+        self.errors = 0
+
+    def _rotate(self) -> None:
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}{SEGMENT_SUFFIX}"
+        self.path = os.path.join(self.directory, name)
+        self.file = gzip.open(self.path, "ab")
+        self.opened_at = time.monotonic()
+        self.segment_bytes = 0
+        logger.info(f"Новый сегмент архива: {self.path}")
+
+    def append(self, channel: str, message) -> None:
+        """
+        Дописывает сообщение Telethon в текущий сегмент. Ошибки записи не
+        прерывают инжест: они логируются и считаются в self.errors.
+        """
+        record = {
+            "channel": channel,
+            "id": message.id,
+            "date": message.date.isoformat() if message.date else None,
+            "text": message.text,
+            "raw_text": getattr(message, "raw_text", None),
+        }
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            if (self.file is None or self.segment_bytes >= SEGMENT_BYTES
+                    or time.monotonic() - self.opened_at >= SEGMENT_SECONDS):
+                self._rotate()
+            self.file.write(line)
+            self.file.flush()
+            self.segment_bytes += len(line)
+            self.written += 1
+        except OSError as e:
+            self.errors += 1
+            logger.error(f"Ошибка записи в архив {self.path}: {e}")
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def segments(directory: str = ARCHIVE_DIR) -> list:
+    """
+    Сегменты в порядке записи (имя начинается с времени открытия).
+    """
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)]
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+def read(directory: str = ARCHIVE_DIR, channels=None):
+    """
+    Записи архива по порядку. channels — множество каналов для фильтра (None — все).
+    """
+    for path in segments(directory):
+        with gzip.open(path, "rb") as f:
+            try:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя строка сегмента
+                        continue
+                    if channels is None or record.get("channel") in channels:
+                        yield record
+            except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+                logger.warning(f"Сегмент {path} оборван, прочитан до места обрыва: {e}")
+
+
+def to_message(record: dict):
+    """
+    Объект с полями id, date, text, raw_text — то, что читают парсеры snifer.py.
+    """
+    return SimpleNamespace(
+        id=record.get("id"),
+        date=datetime.fromisoformat(record["date"]) if record.get("date") else None,
+        text=record.get("text"),
+        raw_text=record.get("raw_text"),
+    )
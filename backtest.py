@@ -0,0 +1,243 @@
+"""
+Бэктест ансамбля прогнозов analyzer_v2.py (forecasting.py) на истории gifts.db.
+
+Rolling-origin: для каждого подарка выбирается до --origins точек отсечения;
+модели обучаются на ряде до точки отсечения и прогнозируют следующий день
+(как в боте), прогноз сравнивается со средней фактической ценой за этот день.
+Для каждой модели и для ансамбля считаются MAE и MAPE.
+
+Перебирается сетка параметров (вес свежести alpha, min_samples у RANSAC).
+Задачи «подарок × часть сетки» выполняются параллельно в ProcessPoolExecutor;
+Holt от параметров не зависит и считается один раз на точку отсечения внутри задачи.
+Модели, как и в боте, обучаются на окне forecasting.window_start (--lookback-days,
+--lookback-mass; окно по весу считается при alpha бота, чтобы оно было общим для сетки).
+
+Запуск:
+    python backtest.py --db gifts.db --alphas 0.03,0.1,0.3 --min-samples 0.6
+    python backtest.py --gifts "Plush Pepe,Lol Pop" --workers 4 --per-gift
+"""
+import argparse
+import math
+import os
+import sqlite3
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import forecasting
+from anomaly import base_gift_name
+from retention import DATE_GLOB
+
+DB_FILE = "gifts.db"
+DATE_FORMAT = "%Y.%m.%d - %H:%M:%S"
+MODELS = ("ransac", "linear", "holt", "ensemble")
+DEFAULT_ALPHAS = (0.0, 0.03, 0.1, 0.3, 1.0)
+DEFAULT_MIN_SAMPLES = (forecasting.RANSAC_MIN_SAMPLES,)
+MIN_TRAIN = 10       # минимальная длина обучающего ряда
+MAX_ORIGINS = 50     # точек отсечения на подарок
+TASKS_PER_WORKER = 4
+
+_conn = None
+
+
+def _init_worker(db_file: str) -> None:
+    global _conn
+    _conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    warnings.filterwarnings("ignore")
+
+
+def load_series(conn: sqlite3.Connection, gift_name: str) -> list:
+    """
+    Тот же ряд, что строит forecast_inline_otc: дневные закрытия из prices_daily,
+    floor из prices и цены продаж, без строк, помеченных anomaly.py.
+    """
+    rows = []
+    try:
+        rows += conn.execute(
+            "SELECT last_date, close_floor FROM prices_daily WHERE gift_name = ? AND close_floor IS NOT NULL",
+            (gift_name,)).fetchall()
+    except sqlite3.OperationalError:
+        pass  # retention.py ещё не запускался
+    rows += conn.execute(
+        "SELECT date, floor_ton FROM prices WHERE gift_name = ? AND floor_ton IS NOT NULL AND suspicious = 0",
+        (gift_name,)).fetchall()
+    rows += conn.execute(
+        "SELECT date, price_ton FROM sales WHERE gift_name LIKE ? AND price_ton IS NOT NULL AND suspicious = 0",
+        (f"{gift_name}%",)).fetchall()
+    series = []
+    for date_str, price in rows:
+        try:
+            series.append((datetime.strptime(date_str, DATE_FORMAT), price))
+        except (TypeError, ValueError):
+            continue
+    series.sort(key=lambda x: x[0])
+    return series
+
+
+def rolling_origins(dates: list, n_origins: int = MAX_ORIGINS, min_train: int = MIN_TRAIN) -> list:
+    """
+    Точки отсечения: (длина обучающего ряда, индексы фактических точек горизонта).
+    Отсечение ставится после последней точки дня, горизонт — следующий календарный день.
+    """
+    candidates = []
+    for i in range(min_train, len(dates)):
+        if dates[i].date() != dates[i - 1].date():
+            target_day = (dates[i - 1] + forecasting.HORIZON).date()
+            j = i
+            while j < len(dates) and dates[j].date() == target_day:
+                j += 1
+            if j > i:
+                candidates.append((i, j))
+    if len(candidates) > n_origins:
+        step = len(candidates) / n_origins
+        candidates = [candidates[int(k * step)] for k in range(n_origins)]
+    return candidates
+
+
+def _run_task(task):
+    gift_name, grid, n_origins, (lookback_days, lookback_mass) = task
+    started = time.perf_counter()
+    series = load_series(_conn, gift_name)
+    dates = [d for d, _ in series]
+    prices = np.array([p for _, p in series], dtype=float)
+    X_all = forecasting.to_features(dates) if dates else None
+
+    # errors[params][model] -> список (абсолютная ошибка, фактическая цена)
+    errors = {params: {model: [] for model in MODELS} for params in grid}
+    failures = 0
+    for train_end, target_end in rolling_origins(dates, n_origins):
+        start = forecasting.window_start(series[:train_end], lookback_days, lookback_mass)
+        X, y = X_all[start:train_end], prices[start:train_end]
+        actual = float(prices[train_end:target_end].mean())
+        future_ord = np.array([[(dates[train_end - 1] + forecasting.HORIZON).toordinal()]])
+        try:
+            _, holt_forecast = forecasting.fit_holt(y)
+        except Exception:
+            holt_forecast = None
+        for params in grid:
+            alpha, min_samples = params
+            weights = forecasting.recency_weights(X, alpha)
+            _, lin_forecast = forecasting.fit_linear(X, y, weights, future_ord)
+            try:
+                _, ransac_forecast = forecasting.fit_ransac(X, y, weights, future_ord, min_samples)
+            except ValueError:
+                # Нет консенсусного множества — как и Holt в боте, подменяем линейной регрессией
+                failures += 1
+                ransac_forecast = lin_forecast
+            holt = lin_forecast if holt_forecast is None else holt_forecast
+            forecasts = {
+                "ransac": ransac_forecast,
+                "linear": lin_forecast,
+                "holt": holt,
+                "ensemble": forecasting.ensemble(ransac_forecast, lin_forecast, holt),
+            }
+            for model, value in forecasts.items():
+                errors[params][model].append((abs(value - actual), actual))
+    return gift_name, errors, failures, time.perf_counter() - started
+
+
+def _chunks(items: list, n: int) -> list:
+    n = max(1, min(n, len(items)))
+    size = math.ceil(len(items) / n)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def summarize(pairs: list) -> tuple:
+    """
+    (MAE, MAPE в %, число прогнозов). MAPE считается по точкам с ненулевой фактической ценой.
+    """
+    if not pairs:
+        return float("nan"), float("nan"), 0
+    mae = sum(err for err, _ in pairs) / len(pairs)
+    ape = [err / actual for err, actual in pairs if actual]
+    mape = 100 * sum(ape) / len(ape) if ape else float("nan")
+    return mae, mape, len(pairs)
+
+
+def list_gifts(conn: sqlite3.Connection) -> list:
+    names = {row[0] for row in conn.execute("SELECT DISTINCT gift_name FROM prices WHERE date GLOB ?", (DATE_GLOB,))}
+    names |= {base_gift_name(row[0]) for row in conn.execute("SELECT DISTINCT gift_name FROM sales")}
+    return sorted(name for name in names if name)
+
+
+def run(db_file: str = DB_FILE, gifts: list = None, alphas=DEFAULT_ALPHAS, min_samples=DEFAULT_MIN_SAMPLES,
+        n_origins: int = MAX_ORIGINS, workers: int = None, per_gift: bool = False,
+        lookback_days=forecasting.LOOKBACK_DAYS, lookback_mass=forecasting.LOOKBACK_MASS) -> dict:
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        gifts = gifts or list_gifts(conn)
+    finally:
+        conn.close()
+    grid = [(alpha, ms) for alpha in alphas for ms in min_samples]
+    workers = workers or os.cpu_count() or 1
+
+    # Если подарков меньше, чем нужно для загрузки всех ядер, делим и сетку
+    grid_parts = max(1, min(len(grid), math.ceil(workers * TASKS_PER_WORKER / max(len(gifts), 1))))
+    lookback = (lookback_days, lookback_mass)
+    tasks = [(gift_name, part, n_origins, lookback) for gift_name in gifts for part in _chunks(grid, grid_parts)]
+
+    started = time.perf_counter()
+    totals = {params: {model: [] for model in MODELS} for params in grid}
+    by_gift = {}
+    failures = 0
+    cpu_seconds = 0.0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_file,)) as pool:
+        for gift_name, errors, task_failures, task_seconds in pool.map(_run_task, tasks):
+            failures += task_failures
+            cpu_seconds += task_seconds
+            for params, models in errors.items():
+                for model, pairs in models.items():
+                    totals[params][model].extend(pairs)
+                    by_gift.setdefault(gift_name, {}).setdefault(params, {})[model] = pairs
+    elapsed = time.perf_counter() - started
+
+    print(f"Подарков: {len(gifts)}, точек сетки: {len(grid)}, задач: {len(tasks)}, процессов: {workers}, "
+          f"окно: {lookback_days or '—'} дней, {lookback_mass or '—'} веса")
+    print(f"Время: {elapsed:.1f} с (суммарно в задачах {cpu_seconds:.1f} с), отказов RANSAC: {failures}")
+    header = f"{'alpha':>7} {'min_s':>6} " + " ".join(f"{model + ' MAE':>14} {'MAPE':>7}" for model in MODELS) + f" {'N':>7}"
+    print(header)
+    ranked = sorted(grid, key=lambda params: summarize(totals[params]["ensemble"])[0])
+    for params in ranked:
+        line = f"{params[0]:>7g} {params[1]:>6g} "
+        n = 0
+        for model in MODELS:
+            mae, mape, n = summarize(totals[params][model])
+            line += f"{mae:>14.3f} {mape:>6.1f}%"
+            line += " "
+        print(line + f"{n:>7}")
+
+    if per_gift:
+        print("\nЛучшие параметры по подаркам (по MAE ансамбля):")
+        for gift_name in sorted(by_gift):
+            results = by_gift[gift_name]
+            best = min(results, key=lambda params: summarize(results[params]["ensemble"])[0])
+            mae, mape, n = summarize(results[best]["ensemble"])
+            if n:
+                print(f"  {gift_name}: alpha={best[0]:g}, min_samples={best[1]:g} — MAE {mae:.3f}, MAPE {mape:.1f}% ({n})")
+    return totals
+
+
+def _floats(value: str) -> tuple:
+    return tuple(float(x) for x in value.split(",") if x.strip())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rolling-origin бэктест прогнозов analyzer_v2.py")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--gifts", default="", help="подарки через запятую (по умолчанию все)")
+    parser.add_argument("--alphas", type=_floats, default=DEFAULT_ALPHAS, help="сетка веса свежести")
+    parser.add_argument("--min-samples", type=_floats, default=DEFAULT_MIN_SAMPLES, help="сетка min_samples RANSAC")
+    parser.add_argument("--origins", type=int, default=MAX_ORIGINS, help="точек отсечения на подарок")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — все ядра)")
+    parser.add_argument("--per-gift", action="store_true", help="показать лучшие параметры для каждого подарка")
+    parser.add_argument("--lookback-days", type=int, default=forecasting.LOOKBACK_DAYS,
+                        help="окно обучения в днях (0 — без ограничения)")
+    parser.add_argument("--lookback-mass", type=float, default=forecasting.LOOKBACK_MASS,
+                        help="доля веса свежести в окне обучения (0 или 1 — без ограничения)")
+    args = parser.parse_args()
+    gift_names = [name.strip() for name in args.gifts.split(",") if name.strip()]
+    run(args.db, gift_names, args.alphas, args.min_samples, args.origins, args.workers, args.per_gift,
+        args.lookback_days or None, args.lookback_mass or None)
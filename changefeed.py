@@ -0,0 +1,196 @@
+"""
+Локальная шина изменений gifts.db: инжест (snifer.py, main.py) сообщает читателям
+(analyzer_v2.py), что у подарка появились новые строки.
+
+Событие — (таблица, подарок, rowid): «в таблице prices/sales у подарка есть строки
+с id до rowid включительно». Событие ("*", None, 0) — сброс: строки удалялись
+(retention.py), всё закэшированное нужно перечитать.
+
+Транспорт — Unix datagram сокеты в каталоге CHANGEFEED_DIR: каждый подписчик
+создаёт в нём свой сокет, издатель после commit рассылает накопленные события
+во все сокеты каталога. Отправка неблокирующая: если подписчик не успевает,
+датаграмма теряется. Поэтому подписчик дополнительно сверяется с БД
+(MAX(id) по таблицам) — редко при работающих сокетах и часто, если сокеты
+недоступны (Windows или ошибка bind).
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+
+CHANGEFEED_DIR = os.environ.get("CHANGEFEED_DIR", "changefeed")
+TABLES = ("prices", "sales")
+RESET = "*"
+POLL_SECONDS = 2          # сверка с БД, когда сокеты недоступны
+RECONCILE_SECONDS = 60    # сверка с БД на случай потерянных датаграмм
+MAX_DATAGRAM_EVENTS = 200
+
+logger = logging.getLogger("changefeed")
+
+
+class Publisher:
+    def __init__(self, directory: str = CHANGEFEED_DIR):
+        self.directory = directory
+        self.pending = {}  # (table, gift) -> максимальный rowid
+        self.sock = None
+        self.sent = 0
+        self.dropped = 0
+        if hasattr(socket, "AF_UNIX"):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+    def publish(self, table: str, gift_name, rowid: int = 0) -> None:
+        """
+        Запоминает событие; отправка — в flush() после commit.
+        """
+        key = (table, gift_name)
+        if rowid >= self.pending.get(key, -1):
+            self.pending[key] = rowid
+
+    def reset(self) -> None:
+        self.publish(RESET, None, 0)
+
+    def _subscribers(self) -> list:
+        try:
+            return [entry.path for entry in os.scandir(self.directory) if entry.name.endswith(".sock")]
+        except FileNotFoundError:
+            return []
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        events = [[table, gift_name, rowid] for (table, gift_name), rowid in self.pending.items()]
+        self.pending.clear()
+        if self.sock is None:
+            return
+        targets = self._subscribers()
+        if not targets:
+            return
+        for i in range(0, len(events), MAX_DATAGRAM_EVENTS):
+            payload = json.dumps(events[i:i + MAX_DATAGRAM_EVENTS], ensure_ascii=False).encode("utf-8")
+            for path in targets:
+                try:
+                    self.sock.sendto(payload, path)
+                    self.sent += 1
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Подписчик завершился, не удалив сокет
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                except (BlockingIOError, OSError):
+                    # Очередь подписчика переполнена — он догонит сверкой с БД
+                    self.dropped += 1
+
+
+class Subscriber:
+    def __init__(self, name: str, on_change, db, directory: str = CHANGEFEED_DIR):
+        """
+        on_change(table, gift_name, rowid) вызывается на каждое событие.
+        db — соединение aiosqlite с gifts.db для сверки.
+        """
+        self.on_change = on_change
+        self.db = db
+        self.directory = directory
+        self.path = os.path.join(directory, f"{name}-{os.getpid()}.sock")
+        self.sock = None
+        self.max_ids = {}
+        self.cutoff = None
+
+    def _bind(self) -> bool:
+        if not hasattr(socket, "AF_UNIX"):
+            return False
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            sock.bind(self.path)
+            sock.setblocking(False)
+        except OSError as e:
+            logger.warning(f"Сокет {self.path} недоступен, только опрос БД: {e}")
+            return False
+        self.sock = sock
+        return True
+
+    def _on_readable(self) -> None:
+        while True:
+            try:
+                payload = self.sock.recv(1 << 20)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                events = json.loads(payload)
+            except ValueError:
+                continue
+            for table, gift_name, rowid in events:
+                self._dispatch(table, gift_name, rowid)
+
+    def _dispatch(self, table, gift_name, rowid) -> None:
+        if table in self.max_ids:
+            self.max_ids[table] = max(self.max_ids[table], rowid)
+        try:
+            self.on_change(table, gift_name, rowid)
+        except Exception as e:
+            logger.error(f"Ошибка обработчика изменений: {e}")
+
+    async def _read_cutoff(self):
+        try:
+            async with self.db.execute("SELECT value FROM retention_state WHERE key = 'prices_cutoff'") as cursor:
+                row = await cursor.fetchone()
+        except Exception:
+            return None
+        return row[0] if row else None
+
+    async def _poll(self) -> None:
+        """
+        Сверка с БД: новые строки после последнего известного id и смена границы retention.py.
+        """
+        cutoff = await self._read_cutoff()
+        if cutoff != self.cutoff:
+            self.cutoff = cutoff
+            self._dispatch(RESET, None, 0)
+        for table in TABLES:
+            async with self.db.execute(
+                f"SELECT gift_name, MAX(id) FROM {table} WHERE id > ? GROUP BY gift_name", (self.max_ids[table],)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            for gift_name, rowid in rows:
+                self._dispatch(table, gift_name, rowid)
+
+    async def run(self) -> None:
+        for table in TABLES:
+            async with self.db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}") as cursor:
+                self.max_ids[table] = (await cursor.fetchone())[0]
+        self.cutoff = await self._read_cutoff()
+
+        loop = asyncio.get_running_loop()
+        interval = POLL_SECONDS
+        if self._bind():
+            loop.add_reader(self.sock.fileno(), self._on_readable)
+            interval = RECONCILE_SECONDS
+            logger.info(f"Подписка на изменения: {self.path}")
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self._poll()
+                except Exception as e:
+                    logger.error(f"Ошибка сверки изменений с БД: {e}")
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self.sock is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            except RuntimeError:
+                pass
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
@@ -0,0 +1,76 @@
+"""
+Каналы, которые читает snifer.py, и типы их парсеров — из файла channels.json
+(путь задаёт SNIFER_CHANNELS или snifer.py --channels). Без файла читаются два
+прежних канала: GiftChangesFloorPrices (floor) и GiftNotification (sale).
+
+Формат:
+    {
+      "channels": [
+        {"name": "GiftChangesFloorPrices", "parser": "floor"},
+        {"name": "GiftNotification", "parser": "sale", "group": "sales"}
+      ]
+    }
+
+parser — тип сообщений канала: floor (floor-цены, таблица prices) или sale
+(продажи, таблица sales). Все каналы идут через один конвейер snifer.py:
+разбор -> фильтр дубликатов -> запись пачками одной транзакцией.
+
+group — набор каналов одного процесса. Каналы группы main (по умолчанию)
+читает сам snifer.py, для каждой другой группы он запускает читателя
+(snifer.py --reader <группа>) со своей сессией Telethon (<session_name>-<группа>).
+Читатели только архивируют и разбирают сообщения и передают их snifer.py,
+который остаётся единственным процессом, пишущим в gifts.db.
+"""
+import json
+import os
+
+CHANNELS_FILE = os.environ.get("SNIFER_CHANNELS", "channels.json")
+PARSER_TYPES = ("floor", "sale")
+MAIN_GROUP = "main"
+
+DEFAULT_CHANNELS = [
+    {"name": "GiftChangesFloorPrices", "parser": "floor", "group": MAIN_GROUP},
+    {"name": "GiftNotification", "parser": "sale", "group": MAIN_GROUP},
+]
+
+
+def load(path: str = CHANNELS_FILE) -> list:
+    """
+    Список каналов [{"name", "parser", "group"}]. Ошибки конфигурации — ValueError:
+    лучше не запуститься, чем молча не читать канал.
+    """
+    if not os.path.exists(path):
+        return [dict(channel) for channel in DEFAULT_CHANNELS]
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    channels = []
+    names = set()
+    for entry in config.get("channels", []):
+        name = entry.get("name")
+        parser = entry.get("parser")
+        if not name:
+            raise ValueError(f"{path}: у канала не указано имя: {entry}")
+        if parser not in PARSER_TYPES:
+            raise ValueError(f"{path}: неизвестный парсер {parser!r} у канала {name} (есть: {', '.join(PARSER_TYPES)})")
+        if name in names:
+            raise ValueError(f"{path}: канал {name} указан дважды")
+        names.add(name)
+        channels.append({"name": name, "parser": parser, "group": entry.get("group") or MAIN_GROUP})
+    if not channels:
+        raise ValueError(f"{path}: не указано ни одного канала")
+    return channels
+
+
+def groups(channels: list) -> dict:
+    """
+    {группа: [каналы]} в порядке первого упоминания группы.
+    """
+    result = {}
+    for channel in channels:
+        result.setdefault(channel["group"], []).append(channel)
+    return result
+
+
+def session_for(session_name: str, group: str) -> str:
+    # У каждого процесса своя сессия: файл сессии Telethon нельзя открыть из двух процессов
+    return session_name if group == MAIN_GROUP else f"{session_name}-{group}"
@@ -0,0 +1,322 @@
+"""
+Компактная раскладка таблицы prices (необязательная).
+
+В обычной раскладке каждая строка prices хранит floor и average в четырёх
+валютах, хотя USD/Star/RUB — это цена в TON, умноженная на курс, общий для всех
+подарков в этот момент. Компактная раскладка хранит в строке только TON
+(таблица prices_compact) и номер курса; сами курсы за 1 TON лежат один раз
+в таблице rates. Новый курс записывается, только когда текущий перестаёт
+воспроизводить цены из сообщения канала (с точностью до округления в канале:
+одна единица последнего знака или RATE_TOLERANCE относительно).
+
+prices после миграции — представление с теми же колонками: запросы
+analyzer_v2.py, export.py, retention.py и остальных модулей не меняются.
+Вставка, изменение и удаление через представление выполняются триггерами
+INSTEAD OF; изменить пересчитанные колонки (floor_usd, ...) нельзя —
+они всегда вычисляются из TON и курса.
+
+Запуск:
+    python compact.py --db gifts.db            # перевести базу в компактную раскладку
+    python compact.py --db gifts.db --revert   # вернуть обычную таблицу prices
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import time
+
+from retention import bench_queries
+
+DB_FILE = "gifts.db"
+RATE_TOLERANCE = 0.001
+BENCH_REPEATS = 5
+
+# (колонка, колонка с ценой в TON, курс в rates, допуск округления в канале)
+CONVERTED_COLUMNS = (
+    ("floor_usd", "floor_ton", "usd", 0.01),
+    ("floor_star", "floor_ton", "star", 1.0),
+    ("floor_rub", "floor_ton", "rub", 1.0),
+    ("average_usd", "average_ton", "usd", 0.01),
+    ("average_star", "average_ton", "star", 1.0),
+    ("average_rub", "average_ton", "rub", 1.0),
+)
+
+WIDE_PRICES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS prices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        gift_name TEXT,
+        date TEXT,
+        delta_ton REAL,
+        floor_ton REAL,
+        floor_usd REAL,
+        floor_star REAL,
+        floor_rub REAL,
+        average_ton REAL,
+        average_usd REAL,
+        average_star REAL,
+        average_rub REAL,
+        suspicious INTEGER DEFAULT 0
+    )
+'''
+PRICES_INDEX = "CREATE INDEX IF NOT EXISTS idx_prices_gift_date ON {table} (gift_name, date)"
+LAYOUT_QUERY = "SELECT type FROM sqlite_master WHERE name = 'prices'"
+
+COMPACT_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS rates (
+        id INTEGER PRIMARY KEY,
+        since TEXT,
+        usd REAL,
+        star REAL,
+        rub REAL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS prices_compact (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        gift_name TEXT,
+        date TEXT,
+        delta_ton REAL,
+        floor_ton REAL,
+        average_ton REAL,
+        suspicious INTEGER DEFAULT 0,
+        rate_id INTEGER
+    )
+    ''',
+    PRICES_INDEX.format(table="prices_compact"),
+)
+
+
+def _fits(new: str, rate: str) -> str:
+    """
+    Условие «курс rate воспроизводит все пересчитанные цены строки new».
+    """
+    checks = []
+    for column, ton, currency, unit in CONVERTED_COLUMNS:
+        checks.append(
+            f"({new}.{column} IS NULL OR {new}.{ton} IS NULL OR "
+            f"ABS({new}.{ton} * {rate}.{currency} - {new}.{column}) "
+            f"<= MAX(ABS({new}.{column}) * {RATE_TOLERANCE}, {unit}))"
+        )
+    return " AND ".join(checks)
+
+
+def _derived_rate(currency: str) -> str:
+    # Курс из floor, а если floor нет (или он нулевой) — из average; деление на 0 в SQLite даёт NULL
+    return (f"COALESCE(NEW.floor_{currency} / NULLIF(NEW.floor_ton, 0), "
+            f"NEW.average_{currency} / NULLIF(NEW.average_ton, 0))")
+
+
+def _converted(column: str, ton: str, currency: str) -> str:
+    # Подзапрос, а не JOIN: курс ищется только для колонок, которые запрос действительно читает,
+    # поэтому проходы по TON-колонкам (все запросы анализатора) rates не трогают
+    return f"p.{ton} * (SELECT {currency} FROM rates WHERE id = p.rate_id) AS {column}"
+
+
+PRICES_VIEW = f'''
+    CREATE VIEW prices AS
+    SELECT p.id, p.gift_name, p.date, p.delta_ton,
+           p.floor_ton, {_converted("floor_usd", "floor_ton", "usd")},
+           {_converted("floor_star", "floor_ton", "star")}, {_converted("floor_rub", "floor_ton", "rub")},
+           p.average_ton, {_converted("average_usd", "average_ton", "usd")},
+           {_converted("average_star", "average_ton", "star")}, {_converted("average_rub", "average_ton", "rub")},
+           p.suspicious
+    FROM prices_compact AS p
+'''
+
+PRICES_TRIGGERS = (
+    f'''
+    CREATE TRIGGER prices_insert INSTEAD OF INSERT ON prices
+    BEGIN
+        INSERT INTO rates (since, usd, star, rub)
+        SELECT NEW.date, {_derived_rate("usd")}, {_derived_rate("star")}, {_derived_rate("rub")}
+        WHERE COALESCE(NEW.floor_usd, NEW.average_usd) IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM rates AS r
+              WHERE r.id = (SELECT MAX(id) FROM rates)
+                AND ({_fits("NEW", "r")}
+                     -- floor и average сообщения не сходятся ни с каким одним курсом: не плодим копии
+                     OR (r.usd IS {_derived_rate("usd")} AND r.star IS {_derived_rate("star")}
+                         AND r.rub IS {_derived_rate("rub")}))
+          );
+        INSERT INTO prices_compact (id, gift_name, date, delta_ton, floor_ton, average_ton, suspicious, rate_id)
+        VALUES (NEW.id, NEW.gift_name, NEW.date, NEW.delta_ton, NEW.floor_ton, NEW.average_ton,
+                COALESCE(NEW.suspicious, 0), (SELECT MAX(id) FROM rates));
+    END
+    ''',
+    '''
+    CREATE TRIGGER prices_update INSTEAD OF UPDATE ON prices
+    BEGIN
+        UPDATE prices_compact
+        SET gift_name = NEW.gift_name, date = NEW.date, delta_ton = NEW.delta_ton,
+            floor_ton = NEW.floor_ton, average_ton = NEW.average_ton, suspicious = NEW.suspicious
+        WHERE id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER prices_delete INSTEAD OF DELETE ON prices
+    BEGIN
+        DELETE FROM prices_compact WHERE id = OLD.id;
+    END
+    ''',
+)
+
+_COLUMNS = ("id, gift_name, date, delta_ton, floor_ton, floor_usd, floor_star, floor_rub, "
+            "average_ton, average_usd, average_star, average_rub, suspicious")
+
+
+def layout(conn: sqlite3.Connection):
+    """
+    "table" — обычная раскладка, "view" — компактная, None — таблицы prices ещё нет.
+    """
+    row = conn.execute(LAYOUT_QUERY).fetchone()
+    return row[0] if row else None
+
+
+def ensure_index(conn: sqlite3.Connection) -> None:
+    """
+    Индекс (gift_name, date) для обычной раскладки; у компактной он уже есть на prices_compact.
+    """
+    if layout(conn) == "table":
+        conn.execute(PRICES_INDEX.format(table="prices"))
+
+
+async def ensure_index_async(db) -> None:
+    async with db.execute(LAYOUT_QUERY) as cursor:
+        row = await cursor.fetchone()
+    if row and row[0] == "table":
+        await db.execute(PRICES_INDEX.format(table="prices"))
+
+
+def _sequence(conn: sqlite3.Connection, table: str):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_sequence(conn: sqlite3.Connection, table: str, seq) -> None:
+    # AUTOINCREMENT не должен выдать заново id, которые уже видели changefeed.py и export.py
+    if seq is None:
+        return
+    current = _sequence(conn, table)
+    if current is None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, seq))
+    elif seq > current:
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (seq, table))
+
+
+def to_compact(conn: sqlite3.Connection) -> dict:
+    """
+    Переводит prices в компактную раскладку. Одна транзакция; строки проходят
+    через тот же триггер вставки, что и новые данные snifer.py/main.py.
+    """
+    seq = _sequence(conn, "prices")
+    with conn:
+        conn.execute("ALTER TABLE prices RENAME TO prices_wide")
+        # Индекс переименованной таблицы сохраняет имя — освобождаем его для prices_compact
+        conn.execute("DROP INDEX IF EXISTS idx_prices_gift_date")
+        for ddl in COMPACT_SCHEMA:
+            conn.execute(ddl)
+        conn.execute(PRICES_VIEW)
+        for ddl in PRICES_TRIGGERS:
+            conn.execute(ddl)
+        conn.execute(f"INSERT INTO prices ({_COLUMNS}) SELECT {_COLUMNS} FROM prices_wide ORDER BY id")
+        _set_sequence(conn, "prices_compact", seq)
+        # Сверка: насколько пересчёт через курс расходится с исходными ценами
+        drift = conn.execute(f'''
+            SELECT SUM(NOT COALESCE({_fits("w", "r")}, 0)),
+                   MAX(ABS(w.floor_ton * r.usd - w.floor_usd) / NULLIF(ABS(w.floor_usd), 0)),
+                   MAX(ABS(w.floor_ton * r.rub - w.floor_rub) / NULLIF(ABS(w.floor_rub), 0))
+            FROM prices_wide AS w
+            JOIN prices_compact AS p ON p.id = w.id
+            LEFT JOIN rates AS r ON r.id = p.rate_id
+        ''').fetchone()
+        conn.execute("DROP TABLE prices_wide")
+    return {
+        "rates": conn.execute("SELECT COUNT(*) FROM rates").fetchone()[0],
+        "drift_rows": drift[0] or 0,
+        "max_usd_drift": drift[1] or 0.0,
+        "max_rub_drift": drift[2] or 0.0,
+    }
+
+
+def to_wide(conn: sqlite3.Connection) -> None:
+    """
+    Возвращает обычную таблицу prices с пересчитанными из курсов колонками.
+    """
+    seq = _sequence(conn, "prices_compact")
+    with conn:
+        conn.execute(WIDE_PRICES_SCHEMA.replace("prices (", "prices_wide (", 1))
+        conn.execute(f"INSERT INTO prices_wide ({_COLUMNS}) SELECT {_COLUMNS} FROM prices ORDER BY id")
+        conn.execute("DROP VIEW prices")
+        conn.execute("DROP TABLE prices_compact")
+        conn.execute("DROP TABLE rates")
+        conn.execute("ALTER TABLE prices_wide RENAME TO prices")
+        _set_sequence(conn, "prices", seq)
+        conn.execute(PRICES_INDEX.format(table="prices"))
+
+
+def _table_bytes(conn: sqlite3.Connection) -> int:
+    """
+    Байт на диске под данные и индексы цен (dbstat, если SQLite собран с ним).
+    """
+    try:
+        row = conn.execute('''
+            SELECT SUM(pgsize) FROM dbstat
+            WHERE name IN ('prices', 'prices_compact', 'rates', 'idx_prices_gift_date')
+        ''').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def _bench_scan(conn: sqlite3.Connection, query: str) -> float:
+    timings = []
+    for _ in range(BENCH_REPEATS):
+        start = time.perf_counter()
+        conn.execute(query).fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def _report(title: str, conn: sqlite3.Connection, db_file: str) -> None:
+    print(f"{title} ({layout(conn)}):")
+    print(f"  Размер файла: {os.path.getsize(db_file) / 1024 / 1024:.2f} МБ, "
+          f"цены с индексом: {_table_bytes(conn) / 1024 / 1024:.2f} МБ")
+    print(f"  Медиана запросов анализатора на подарок: {bench_queries(conn):.2f} мс")
+    print(f"  Полный проход по floor_ton: "
+          f"{_bench_scan(conn, 'SELECT gift_name, COUNT(*), AVG(floor_ton) FROM prices GROUP BY gift_name'):.1f} мс")
+    print(f"  Полный проход по floor_usd: "
+          f"{_bench_scan(conn, 'SELECT gift_name, AVG(floor_usd) FROM prices GROUP BY gift_name'):.1f} мс")
+
+
+def run(db_file: str = DB_FILE, revert: bool = False) -> None:
+    conn = sqlite3.connect(db_file, timeout=30)
+    try:
+        current = layout(conn)
+        target = "table" if revert else "view"
+        if current is None:
+            print("В базе нет таблицы prices")
+            return
+        if current == target:
+            print("База уже в этой раскладке")
+            return
+        _report("До", conn, db_file)
+        if revert:
+            to_wide(conn)
+        else:
+            result = to_compact(conn)
+            print(f"Курсов в rates: {result['rates']}; строк, где пересчёт вышел за допуск округления: "
+                  f"{result['drift_rows']} (макс. расхождение USD {result['max_usd_drift']:.2%}, "
+                  f"RUB {result['max_rub_drift']:.2%})")
+        conn.execute("VACUUM")
+        _report("После", conn, db_file)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Компактная раскладка prices: цены в TON + таблица курсов")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--revert", action="store_true", help="вернуть обычную таблицу prices")
+    args = parser.parse_args()
+    run(args.db, args.revert)
@@ -0,0 +1,167 @@
+"""
+Фильтр уже известных записей для инжеста (main.py и snifer.py).
+
+При старте из gifts.db загружаются все sales.message_id и ключи (gift_name, date)
+таблицы prices. Дальше дубликаты отбрасываются в памяти, без запроса к БД,
+а новые записи вставляются без предварительного SELECT.
+
+Два режима:
+  - "set"   — точные множества (по умолчанию). Попадание = гарантированный дубликат.
+  - "bloom" — компактный фильтр Блума для очень длинной истории. Промах = гарантированно
+              новая запись; попадание = «возможно, дубликат», его нужно подтвердить в БД.
+
+Режим выбирается параметром или переменной окружения SEEN_FILTER=bloom.
+"""
+import hashlib
+import math
+import os
+
+DEFAULT_MODE = os.environ.get("SEEN_FILTER", "set")
+BLOOM_ERROR_RATE = 0.001
+# Запас ёмкости фильтра Блума относительно текущего размера истории
+BLOOM_GROWTH = 2.0
+BLOOM_MIN_CAPACITY = 1_000_000
+
+SALES_KEYS_QUERY = "SELECT message_id FROM sales WHERE message_id IS NOT NULL"
+PRICES_KEYS_QUERY = "SELECT gift_name, date FROM prices"
+COUNT_QUERY = "SELECT (SELECT COUNT(*) FROM sales), (SELECT COUNT(*) FROM prices)"
+MAX_IDS_QUERY = "SELECT (SELECT MAX(id) FROM sales), (SELECT MAX(id) FROM prices)"
+NEW_SALES_KEYS_QUERY = "SELECT message_id FROM sales WHERE id > ? AND message_id IS NOT NULL"
+NEW_PRICES_KEYS_QUERY = "SELECT gift_name, date FROM prices WHERE id > ?"
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        capacity = max(int(capacity), 1)
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+def _price_key(gift_name, date) -> str:
+    return f"{gift_name}\x00{date}"
+
+
+class SeenFilter:
+    def __init__(self, mode: str = None, expected_sales: int = 0, expected_prices: int = 0):
+        self.mode = mode or DEFAULT_MODE
+        if self.mode == "bloom":
+            self.sales = BloomFilter(max(expected_sales * BLOOM_GROWTH, BLOOM_MIN_CAPACITY))
+            self.prices = BloomFilter(max(expected_prices * BLOOM_GROWTH, BLOOM_MIN_CAPACITY))
+        elif self.mode == "set":
+            self.sales = set()
+            self.prices = set()
+        else:
+            raise ValueError(f"Неизвестный режим фильтра: {self.mode}")
+        # Последние загруженные id строк: refresh_seen дочитывает только более новые
+        self.last_sale_id = 0
+        self.last_price_id = 0
+
+    @property
+    def exact(self) -> bool:
+        """
+        True — попадание в фильтр означает гарантированный дубликат.
+        """
+        return self.mode == "set"
+
+    # ---- продажи ----
+    def sale_seen(self, message_id) -> bool:
+        return str(message_id) in self.sales if self.mode == "bloom" else message_id in self.sales
+
+    def add_sale(self, message_id) -> None:
+        if self.mode == "bloom":
+            self.sales.add(str(message_id))
+        else:
+            self.sales.add(message_id)
+
+    # ---- floor-цены ----
+    def price_seen(self, gift_name, date) -> bool:
+        if self.mode == "bloom":
+            return _price_key(gift_name, date) in self.prices
+        return (gift_name, date) in self.prices
+
+    def add_price(self, gift_name, date) -> None:
+        if self.mode == "bloom":
+            self.prices.add(_price_key(gift_name, date))
+        else:
+            self.prices.add((gift_name, date))
+
+    def _load_rows(self, sale_ids, price_keys) -> None:
+        for (message_id,) in sale_ids:
+            self.add_sale(message_id)
+        for gift_name, date in price_keys:
+            self.add_price(gift_name, date)
+
+
+def load_seen(conn, mode: str = None) -> SeenFilter:
+    """
+    Строит фильтр по синхронному соединению sqlite3 (main.py).
+    """
+    mode = mode or DEFAULT_MODE
+    n_sales, n_prices = conn.execute(COUNT_QUERY).fetchone()
+    seen = SeenFilter(mode, n_sales, n_prices)
+    # Границы берутся до загрузки ключей: строки, вставленные в промежутке, refresh_seen прочитает ещё раз
+    last_sale_id, last_price_id = conn.execute(MAX_IDS_QUERY).fetchone()
+    seen._load_rows(conn.execute(SALES_KEYS_QUERY), conn.execute(PRICES_KEYS_QUERY))
+    seen.last_sale_id, seen.last_price_id = last_sale_id or 0, last_price_id or 0
+    return seen
+
+
+def refresh_seen(conn, seen: SeenFilter) -> None:
+    """
+    Дочитывает в фильтр строки, вставленные после загрузки другим процессом
+    (snifer.py, пока main.py --watch ждёт новых файлов, и наоборот).
+    """
+    last_sale_id, last_price_id = conn.execute(MAX_IDS_QUERY).fetchone()
+    seen._load_rows(conn.execute(NEW_SALES_KEYS_QUERY, (seen.last_sale_id,)),
+                    conn.execute(NEW_PRICES_KEYS_QUERY, (seen.last_price_id,)))
+    seen.last_sale_id = max(seen.last_sale_id, last_sale_id or 0)
+    seen.last_price_id = max(seen.last_price_id, last_price_id or 0)
+
+
+async def load_seen_async(db, mode: str = None) -> SeenFilter:
+    """
+    Строит фильтр по соединению aiosqlite (snifer.py).
+    """
+    mode = mode or DEFAULT_MODE
+    async with db.execute(COUNT_QUERY) as cursor:
+        n_sales, n_prices = await cursor.fetchone()
+    seen = SeenFilter(mode, n_sales, n_prices)
+    async with db.execute(MAX_IDS_QUERY) as cursor:
+        last_sale_id, last_price_id = await cursor.fetchone()
+    async with db.execute(SALES_KEYS_QUERY) as cursor:
+        sale_ids = await cursor.fetchall()
+    async with db.execute(PRICES_KEYS_QUERY) as cursor:
+        price_keys = await cursor.fetchall()
+    seen._load_rows(sale_ids, price_keys)
+    seen.last_sale_id, seen.last_price_id = last_sale_id or 0, last_price_id or 0
+    return seen
+
+
+async def refresh_seen_async(db, seen: SeenFilter) -> None:
+    """
+    refresh_seen для соединения aiosqlite (snifer.py): строки, которые тем временем записал main.py.
+    """
+    async with db.execute(MAX_IDS_QUERY) as cursor:
+        last_sale_id, last_price_id = await cursor.fetchone()
+    async with db.execute(NEW_SALES_KEYS_QUERY, (seen.last_sale_id,)) as cursor:
+        sale_ids = await cursor.fetchall()
+    async with db.execute(NEW_PRICES_KEYS_QUERY, (seen.last_price_id,)) as cursor:
+        price_keys = await cursor.fetchall()
+    seen._load_rows(sale_ids, price_keys)
+    seen.last_sale_id = max(seen.last_sale_id, last_sale_id or 0)
+    seen.last_price_id = max(seen.last_price_id, last_price_id or 0)
@@ -0,0 +1,293 @@
+"""
+Колоночный экспорт таблиц prices и sales для офлайн-аналитики.
+
+Экспорт инкрементальный: в каталоге выгрузки хранится _state.json с последним
+выгруженным id каждой таблицы, и при следующем запуске читаются только новые строки.
+Данные раскладываются по месяцам:
+
+    export/prices/2025-01/part-000000000001-000000052000/<колонка>.npy
+    export/sales/2025-01/part-000000000001-000000003100.parquet   (если установлен pyarrow)
+
+Названия подарков кодируются целыми числами, словарь лежит в export/gift_names.json.
+Даты хранятся как секунды Unix (int64), NULL в числовых колонках — как NaN.
+
+Запуск:
+    python export.py --db gifts.db --out export [--format auto|npy|parquet]
+
+Загрузка (без копирования данных):
+    from export import iter_parts, load
+    for part in iter_parts("export", "prices", months=["2025-01"]):
+        part["floor_ton"]  # np.memmap
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+DB_FILE = "gifts.db"
+EXPORT_DIR = "export"
+CHUNK_SIZE = 200_000
+
+# Форматы дат: snifer.py пишет "2025.01.13 - 03:13:19", экспорт Telegram (main.py) — ISO
+DATE_FORMATS = ("%Y.%m.%d - %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S")
+
+EPOCH = datetime(1970, 1, 1)
+
+PRICE_FLOAT_COLUMNS = (
+    "delta_ton", "floor_ton", "floor_usd", "floor_star", "floor_rub",
+    "average_ton", "average_usd", "average_star", "average_rub",
+)
+
+TABLES = {
+    "prices": {
+        "query": f"SELECT id, gift_name, date, {', '.join(PRICE_FLOAT_COLUMNS)} FROM prices WHERE id > ? ORDER BY id",
+        "dtypes": dict({"id": np.int64, "gift": np.int32, "ts": np.int64}, **{c: np.float64 for c in PRICE_FLOAT_COLUMNS}),
+    },
+    "sales": {
+        "query": "SELECT id, gift_name, date, message_id, price_ton FROM sales WHERE id > ? ORDER BY id",
+        "dtypes": {"id": np.int64, "gift": np.int32, "ts": np.int64,
+                   "message_id": np.int64, "item_number": np.int32, "price_ton": np.float64},
+    },
+}
+
+_ITEM_NUMBER = re.compile(r"^(.*?)\s*#(\d+)$")
+
+
+def parse_ts(date_str):
+    """
+    Дата из БД -> секунды Unix (время трактуется как UTC). None, если формат не распознан.
+    """
+    if not date_str:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            dt = datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+        return int((dt - EPOCH).total_seconds())
+    return None
+
+
+def split_item_number(gift_name: str):
+    """
+    "Vintage Cigar #17369" -> ("Vintage Cigar", 17369)
+    """
+    m = _ITEM_NUMBER.match(gift_name or "")
+    if m:
+        return m.group(1), int(m.group(2))
+    return (gift_name or "").strip(), -1
+
+
+class GiftDictionary:
+    """
+    Стабильный словарь "название подарка -> код" (коды не меняются между запусками).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.names = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.names = json.load(f)
+        self.codes = {name: i for i, name in enumerate(self.names)}
+
+    def code(self, name: str) -> int:
+        c = self.codes.get(name)
+        if c is None:
+            c = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return c
+
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.names, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def _load_state(out_dir: str) -> dict:
+    path = os.path.join(out_dir, "_state.json")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_state(out_dir: str, state: dict) -> None:
+    path = os.path.join(out_dir, "_state.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _rows_to_columns(table: str, rows, gifts: GiftDictionary):
+    """
+    Строки sqlite3 -> {месяц: {колонка: список}}. Строки с нераспознанной датой пропускаются.
+    """
+    by_month = defaultdict(lambda: defaultdict(list))
+    skipped = 0
+    for row in rows:
+        ts = parse_ts(row[2])
+        if ts is None:
+            skipped += 1
+            continue
+        month = (EPOCH + timedelta(seconds=ts)).strftime("%Y-%m")
+        cols = by_month[month]
+        cols["id"].append(row[0])
+        cols["ts"].append(ts)
+        if table == "prices":
+            cols["gift"].append(gifts.code((row[1] or "").strip()))
+            for name, value in zip(PRICE_FLOAT_COLUMNS, row[3:]):
+                cols[name].append(value)
+        else:
+            base, number = split_item_number(row[1])
+            cols["gift"].append(gifts.code(base))
+            cols["item_number"].append(number)
+            cols["message_id"].append(row[3] if row[3] is not None else -1)
+            cols["price_ton"].append(row[4])
+    return by_month, skipped
+
+
+def _write_part(out_dir: str, table: str, month: str, columns: dict, fmt: str) -> str:
+    dtypes = TABLES[table]["dtypes"]
+    arrays = {name: np.array(columns[name], dtype=dtype) for name, dtype in dtypes.items()}
+    ids = arrays["id"]
+    part_name = f"part-{ids[0]:012d}-{ids[-1]:012d}"
+    month_dir = os.path.join(out_dir, table, month)
+    os.makedirs(month_dir, exist_ok=True)
+
+    if fmt == "parquet":
+        final = os.path.join(month_dir, part_name + ".parquet")
+        tmp = final + ".tmp"
+        pq.write_table(pa.table(arrays), tmp)
+        os.replace(tmp, final)
+        return final
+
+    # npy: каталог с файлом на колонку, записывается во временный каталог и переименовывается
+    final = os.path.join(month_dir, part_name)
+    tmp = final + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, name + ".npy"), arr)
+    if os.path.exists(final):
+        shutil.rmtree(final)
+    os.replace(tmp, final)
+    return final
+
+
+def export(db_file: str = DB_FILE, out_dir: str = EXPORT_DIR, fmt: str = "auto") -> dict:
+    """
+    Выгружает новые строки prices и sales. Возвращает число выгруженных строк по таблицам.
+    """
+    if fmt == "auto":
+        fmt = "parquet" if pa is not None else "npy"
+    if fmt == "parquet" and pa is None:
+        raise RuntimeError("Для формата parquet нужен pyarrow: pip install pyarrow")
+
+    os.makedirs(out_dir, exist_ok=True)
+    state = _load_state(out_dir)
+    if state.get("format", fmt) != fmt:
+        raise RuntimeError(f"Каталог {out_dir} уже содержит выгрузку в формате {state['format']}")
+    state["format"] = fmt
+    gifts = GiftDictionary(os.path.join(out_dir, "gift_names.json"))
+
+    # Только чтение: не мешаем snifer.py писать в живую базу
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    result = {}
+    try:
+        for table, spec in TABLES.items():
+            last_id = state.get(table, 0)
+            exported = 0
+            cursor = conn.execute(spec["query"], (last_id,))
+            while True:
+                rows = cursor.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    break
+                by_month, skipped = _rows_to_columns(table, rows, gifts)
+                for month, columns in sorted(by_month.items()):
+                    _write_part(out_dir, table, month, columns, fmt)
+                    exported += len(columns["id"])
+                if skipped:
+                    print(f"{table}: пропущено строк с нераспознанной датой: {skipped}")
+                # Словарь сохраняется до состояния, чтобы коды в записанных частях всегда были известны
+                gifts.save()
+                state[table] = rows[-1][0]
+                _save_state(out_dir, state)
+            result[table] = exported
+    finally:
+        conn.close()
+    return result
+
+
+# ----------------------- Загрузка -----------------------
+def _month_dirs(out_dir: str, table: str, months=None):
+    table_dir = os.path.join(out_dir, table)
+    if not os.path.isdir(table_dir):
+        return []
+    found = sorted(d for d in os.listdir(table_dir) if os.path.isdir(os.path.join(table_dir, d)))
+    if months is not None:
+        wanted = set(months)
+        found = [d for d in found if d in wanted]
+    return [os.path.join(table_dir, d) for d in found]
+
+
+def iter_parts(out_dir: str = EXPORT_DIR, table: str = "prices", months=None, columns=None):
+    """
+    Перебирает части выгрузки. Каждая часть — словарь {колонка: массив},
+    отображённый в память (np.memmap / буферы Arrow), без копирования.
+    """
+    for month_dir in _month_dirs(out_dir, table, months):
+        for entry in sorted(os.listdir(month_dir)):
+            path = os.path.join(month_dir, entry)
+            if entry.endswith(".tmp"):
+                continue
+            if entry.endswith(".parquet"):
+                if pq is None:
+                    raise RuntimeError("Для чтения parquet нужен pyarrow")
+                tbl = pq.read_table(path, columns=columns, memory_map=True)
+                yield {name: tbl.column(name).to_numpy() for name in tbl.column_names}
+            elif os.path.isdir(path):
+                names = columns or [f[:-4] for f in sorted(os.listdir(path)) if f.endswith(".npy")]
+                yield {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in names}
+
+
+def load(out_dir: str = EXPORT_DIR, table: str = "prices", months=None, columns=None) -> dict:
+    """
+    Склеивает все части в один набор колонок. Если часть одна, копирования нет.
+    """
+    parts = list(iter_parts(out_dir, table, months, columns))
+    if not parts:
+        return {}
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+
+
+def load_gift_names(out_dir: str = EXPORT_DIR) -> list:
+    return GiftDictionary(os.path.join(out_dir, "gift_names.json")).names
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Колоночный экспорт prices и sales")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--out", default=EXPORT_DIR)
+    parser.add_argument("--format", choices=("auto", "npy", "parquet"), default="auto")
+    args = parser.parse_args()
+    counts = export(args.db, args.out, args.format)
+    for table, n in counts.items():
+        print(f"{table}: выгружено новых строк: {n}")
@@ -0,0 +1,251 @@
+"""
+Локальный фейковый Telegram Bot API для проверки рассылок без настоящего бота.
+
+Поддерживает getMe и sendMessage и соблюдает лимиты Telegram: не больше 30
+сообщений в секунду на бота, одного сообщения в секунду в личный чат и 20 в
+минуту в группу (отрицательный chat_id). При превышении отвечает 429 с
+parameters.retry_after, как настоящий API. Статистика — GET /stats.
+
+Для сквозной проверки бота (webhook.py --e2e) отвечает и на остальные методы,
+которые вызывают обработчики analyzer_v2.py (sendPhoto, editMessageText,
+editMessageMedia, answerCallbackQuery, deleteMessage, setWebhook...), без лимитов;
+все вызовы по чатам записываются в calls.
+
+Запуск сервера:
+    python fake_bot_api.py --port 8081
+    Bot(token, base_url="http://127.0.0.1:8081/bot")
+
+Демонстрация планировщика outbox.py (и для сравнения — отправка без ограничений):
+    python fake_bot_api.py --demo 2000 --chats 300
+    python fake_bot_api.py --demo 2000 --chats 300 --naive
+"""
+import argparse
+import asyncio
+import json
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+GLOBAL_LIMIT = (30, 1.0)   # сообщений за окно в секундах
+CHAT_LIMIT = (1, 1.0)
+GROUP_LIMIT = (20, 60.0)
+DEFAULT_PORT = 8081
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, blocked=()):
+        self.host = host
+        self.port = port
+        self.blocked = set(blocked)
+        self.lock = threading.Lock()
+        self.global_window = deque()
+        self.chat_windows = defaultdict(deque)
+        self.messages = []  # (chat_id, text)
+        self.calls = []     # (метод, chat_id, текст/подпись)
+        self.webhook = None
+        self.stats = {"ok": 0, "too_many_requests": 0, "forbidden": 0, "bad_request": 0}
+        self.server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    @staticmethod
+    def _retry_after(window: deque, limit: int, period: float, now: float):
+        while window and window[0] <= now - period:
+            window.popleft()
+        if len(window) >= limit:
+            return max(1, math.ceil(window[0] + period - now))
+        return None
+
+    def send_message(self, chat_id: int, text: str):
+        """
+        Возвращает (HTTP-статус, тело ответа Bot API).
+        """
+        if not text:
+            self.stats["bad_request"] += 1
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message text is empty"}
+        if chat_id in self.blocked:
+            self.stats["forbidden"] += 1
+            return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        now = time.monotonic()
+        with self.lock:
+            limit, period = GROUP_LIMIT if chat_id < 0 else CHAT_LIMIT
+            chat_window = self.chat_windows[chat_id]
+            retry_after = (self._retry_after(self.global_window, *GLOBAL_LIMIT, now)
+                           or self._retry_after(chat_window, limit, period, now))
+            if retry_after:
+                self.stats["too_many_requests"] += 1
+                return 429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }
+            self.global_window.append(now)
+            chat_window.append(now)
+            self.messages.append((chat_id, text))
+            self.stats["ok"] += 1
+            message_id = len(self.messages)
+        return 200, {"ok": True, "result": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+            "text": text,
+        }}
+
+    def call(self, method: str, params: dict):
+        """
+        Остальные методы Bot API: запоминаем вызов и отвечаем правдоподобным результатом.
+        """
+        chat_id = int(params["chat_id"]) if params.get("chat_id") else None
+        text = params.get("text") or params.get("caption")
+        if method == "editMessageMedia" and params.get("media"):
+            media = params["media"]
+            text = (json.loads(media) if isinstance(media, str) else media).get("caption")
+        with self.lock:
+            self.calls.append((method, chat_id, text))
+            message_id = len(self.calls)
+        if method == "setWebhook":
+            self.webhook = params.get("url")
+        if method.startswith(("send", "edit")) and chat_id is not None:
+            return 200, {"ok": True, "result": {
+                "message_id": int(params.get("message_id") or message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+                "text": text or "",
+            }}
+        return 200, {"ok": True, "result": True}
+
+    def start(self) -> "FakeBotAPI":
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _params(self) -> dict:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("application/json"):
+                    return json.loads(body or b"{}")
+                if content_type.startswith("multipart/form-data"):
+                    message = BytesParser().parsebytes(
+                        f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+                    # Файлы (sendPhoto) не нужны — декодируем всё как текст с заменой байтов
+                    return {part.get_param("name", header="content-disposition"):
+                            part.get_payload(decode=True).decode("utf-8", "replace")
+                            for part in message.get_payload()}
+                return dict(parse_qsl(body.decode()))
+
+            def _reply(self, status: int, data: dict) -> None:
+                payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    self._reply(200, dict(api.stats, messages=len(api.messages), calls=len(api.calls)))
+                else:
+                    self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[-1]
+                params = self._params()
+                if method == "getMe":
+                    with api.lock:
+                        api.calls.append((method, None, None))
+                    self._reply(200, {"ok": True, "result": {
+                        "id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}})
+                elif method == "sendMessage":
+                    status, data = api.send_message(int(params["chat_id"]), params.get("text", ""))
+                    if status == 200:
+                        with api.lock:
+                            api.calls.append((method, int(params["chat_id"]), params.get("text", "")))
+                    self._reply(status, data)
+                else:
+                    self._reply(*api.call(method, params))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="fake-bot-api", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+async def _demo(api: FakeBotAPI, total: int, chats: int, naive: bool) -> None:
+    from telegram import Bot
+    from telegram.error import TelegramError
+    from telegram.request import HTTPXRequest
+
+    import outbox
+
+    bot = Bot("123456:fake", base_url=api.base_url, request=HTTPXRequest(connection_pool_size=64))
+    await bot.initialize()
+    chat_ids = [1000 + i for i in range(chats)]
+    start = time.perf_counter()
+    if naive:
+        async def send(i):
+            try:
+                await bot.send_message(chat_id=chat_ids[i % chats], text=f"Уведомление #{i}")
+                return True
+            except TelegramError:
+                return False
+        results = await asyncio.gather(*(send(i) for i in range(total)))
+        delivered = sum(results)
+    else:
+        box = outbox.Outbox(bot.send_message)
+        delivered = 0
+
+        async def on_sent():
+            nonlocal delivered
+            delivered += 1
+        for i in range(total):
+            priority = outbox.PRIORITY_BROADCAST if i % 3 else outbox.PRIORITY_ALERT
+            box.submit(chat_ids[i % chats], f"Уведомление #{i}", priority, on_sent)
+        runner = asyncio.create_task(box.run())
+        await box.drain()
+        runner.cancel()
+    elapsed = time.perf_counter() - start
+    await bot.shutdown()
+
+    print(f"Режим: {'без ограничений' if naive else 'outbox.py'}")
+    print(f"  Уведомлений: {total} в {chats} чатов, доставлено: {delivered}")
+    print(f"  Запросов sendMessage принято: {api.stats['ok']}, ответов 429: {api.stats['too_many_requests']}")
+    print(f"  Время: {elapsed:.1f} с")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API с лимитами")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--demo", type=int, default=0, help="отправить N уведомлений через outbox.py и выйти")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--naive", action="store_true", help="в демо отправлять без планировщика")
+    args = parser.parse_args()
+
+    if args.demo:
+        api = FakeBotAPI(args.host, 0).start()
+        try:
+            asyncio.run(_demo(api, args.demo, args.chats, args.naive))
+        finally:
+            api.stop()
+    else:
+        api = FakeBotAPI(args.host, args.port).start()
+        print(f"Fake Bot API: {api.base_url}<token>/sendMessage, статистика: http://{args.host}:{api.port}/stats")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            api.stop()
@@ -0,0 +1,109 @@
+"""
+Модели прогноза цены на следующий день, общие для analyzer_v2.py и backtest.py.
+
+Ансамбль — среднее трёх моделей:
+  - RANSAC (устойчивая линейная регрессия) с весами свежести;
+  - взвешенная линейная регрессия;
+  - Holt (экспоненциальное сглаживание с затухающим трендом).
+
+Вес точки: exp(-alpha * возраст в днях) относительно последней точки ряда.
+
+Модели обучаются на окне последних точек (window_start): старые точки с почти
+нулевым весом не меняют прогноз, но стоят времени. Окно задаётся сроком
+(FORECAST_LOOKBACK_DAYS) и/или долей суммарного веса (FORECAST_LOOKBACK_MASS):
+отбрасываются самые старые точки, на которые приходится не больше 1 - mass веса.
+Стоимость подбора окна и обучения зависит от размера окна, а не от длины истории.
+"""
+import bisect
+import os
+from datetime import timedelta
+from operator import itemgetter
+
+import numpy as np
+from sklearn.linear_model import LinearRegression, RANSACRegressor
+
+ALPHA = 0.1             # вес свежести данных
+RANSAC_MAX_TRIALS = 100
+RANSAC_MIN_SAMPLES = 0.6
+RANDOM_STATE = 0        # RANSAC детерминирован: один и тот же ряд — один и тот же прогноз
+HORIZON = timedelta(days=1)
+LOOKBACK_DAYS = int(os.environ.get("FORECAST_LOOKBACK_DAYS", 0)) or None
+LOOKBACK_MASS = float(os.environ.get("FORECAST_LOOKBACK_MASS", 0.999)) or None
+MIN_WINDOW_POINTS = 30  # окно не короче стольких точек (если они есть)
+
+
+def to_features(dates) -> np.ndarray:
+    return np.array([d.toordinal() for d in dates]).reshape(-1, 1)
+
+
+def recency_weights(X: np.ndarray, alpha: float = ALPHA) -> np.ndarray:
+    return np.exp(-alpha * (X[-1, 0] - X.flatten()))
+
+
+def _mass_start(series, lo: int, mass: float, alpha: float) -> int:
+    """
+    Первая точка окна, в котором остаётся не меньше mass суммарного веса точек series[lo:].
+    Хвост ряда удваивается, пока вес точек левее него (не больше их числа, умноженного
+    на вес самой старой точки хвоста) не уложится в допуск, — весь ряд не перебирается.
+    """
+    n = len(series)
+    size = MIN_WINDOW_POINTS
+    while True:
+        begin = max(lo, n - size)
+        weights = recency_weights(to_features([date for date, _ in series[begin:]]), alpha)
+        # Ряд отсортирован: точки левее begin не тяжелее weights[0]
+        rest = (begin - lo) * weights[0]
+        budget = (1 - mass) * weights.sum()
+        if begin == lo or rest <= budget:
+            break
+        size *= 2
+    # Отрезаем самые старые точки хвоста, пока их вес вместе с оценкой rest укладывается в допуск
+    return begin + int(np.searchsorted(np.cumsum(weights), budget - rest, side="right"))
+
+
+def window_start(series, days=LOOKBACK_DAYS, mass=LOOKBACK_MASS, alpha: float = ALPHA,
+                 min_points: int = MIN_WINDOW_POINTS) -> int:
+    """
+    Индекс первой точки окна обучения в отсортированном по дате ряду [(datetime, цена)].
+    days — срок окна (бинарный поиск по датам), mass — доля суммарного веса свежести;
+    если заданы оба, берётся более короткое окно. None — ограничения нет.
+    """
+    n = len(series)
+    if n <= min_points:
+        return 0
+    start = 0
+    if days:
+        start = bisect.bisect_left(series, series[-1][0] - timedelta(days=days), key=itemgetter(0))
+    if mass and mass < 1 and alpha > 0:
+        start = max(start, _mass_start(series, start, mass, alpha))
+    return min(start, n - min_points)
+
+
+def fit_ransac(X, y, weights, future_ord, min_samples=RANSAC_MIN_SAMPLES, random_state=RANDOM_STATE):
+    """
+    Возвращает (модель, прогноз). Прогноз не бывает отрицательным.
+    """
+    ransac = RANSACRegressor(estimator=LinearRegression(), max_trials=RANSAC_MAX_TRIALS,
+                             min_samples=min_samples, random_state=random_state)
+    ransac.fit(X, y, sample_weight=weights)
+    return ransac, max(ransac.predict(future_ord)[0], 0)
+
+
+def fit_linear(X, y, weights, future_ord):
+    lin_model = LinearRegression()
+    lin_model.fit(X, y, sample_weight=weights)
+    return lin_model, max(lin_model.predict(future_ord)[0], 0)
+
+
+def fit_holt(y):
+    """
+    Возвращает (результат fit, прогноз). Исключения statsmodels пробрасываются —
+    вызывающий код подставляет прогноз линейной регрессии.
+    """
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+    holt_fit = ExponentialSmoothing(y, trend="add", damped_trend=True, seasonal=None).fit(optimized=True)
+    return holt_fit, max(holt_fit.forecast(1)[0], 0)
+
+
+def ensemble(ransac_forecast: float, lin_forecast: float, holt_forecast: float) -> float:
+    return (ransac_forecast + lin_forecast + holt_forecast) / 3.0
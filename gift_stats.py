@@ -0,0 +1,303 @@
+"""
+Сводка по подарку, которая поддерживается при инжесте: таблица gift_stats.
+
+Одна строка на подарок: число строк цен, сумма и число delta_ton, последние floor
+и average, первая и последняя дата, число продаж и последняя продажа.
+snifer.py и main.py копят изменения пачки в GiftStatsWriter и дописывают их
+в gift_stats (UPSERT со сложением счётчиков) в той же транзакции, что и сами строки,
+поэтому /gift в analyzer_v2.py читает одну строку вместо агрегата по всей истории.
+
+Свёртка retention.py сводку не меняет: prices_daily хранит те же счётчики,
+что и удалённые строки prices. Подозрительные (anomaly.py) строки учитываются
+только в счётчиках строк и продаж и в датах first_seen/last_seen.
+
+Проверка и пересчёт по истории:
+    python gift_stats.py --db gifts.db --check
+    python gift_stats.py --db gifts.db --rebuild
+"""
+import argparse
+import math
+import re
+import sqlite3
+import sys
+
+import anomaly
+from anomaly import base_gift_name
+from retention import PRICES_DAILY_SCHEMA
+
+DB_FILE = "gifts.db"
+_DATE_RE = re.compile(r"^\d{4}\.\d{2}\.\d{2} - \d{2}:\d{2}:\d{2}$")
+
+GIFT_STATS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS gift_stats (
+        gift_name TEXT PRIMARY KEY,
+        price_rows INTEGER,
+        delta_count INTEGER,
+        delta_sum REAL,
+        last_floor REAL,
+        last_average REAL,
+        last_price_date TEXT,
+        first_seen TEXT,
+        last_seen TEXT,
+        sale_count INTEGER,
+        last_sale_price REAL,
+        last_sale_date TEXT
+    )
+'''
+
+COLUMNS = ("price_rows", "delta_count", "delta_sum", "last_floor", "last_average", "last_price_date",
+           "first_seen", "last_seen", "sale_count", "last_sale_price", "last_sale_date")
+
+# Слияние изменений пачки с уже записанной сводкой: счётчики складываются,
+# «последние» значения берутся из более свежей даты (при равенстве — из пачки)
+_UPSERT = f'''
+    INSERT INTO gift_stats (gift_name, {", ".join(COLUMNS)})
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (gift_name) DO UPDATE SET
+        price_rows = price_rows + excluded.price_rows,
+        delta_count = delta_count + excluded.delta_count,
+        delta_sum = delta_sum + excluded.delta_sum,
+        last_floor = CASE WHEN excluded.last_price_date >= COALESCE(last_price_date, '')
+                          THEN excluded.last_floor ELSE last_floor END,
+        last_average = CASE WHEN excluded.last_price_date >= COALESCE(last_price_date, '')
+                            THEN excluded.last_average ELSE last_average END,
+        last_price_date = MAX(COALESCE(last_price_date, excluded.last_price_date),
+                              COALESCE(excluded.last_price_date, last_price_date)),
+        first_seen = MIN(COALESCE(first_seen, excluded.first_seen), COALESCE(excluded.first_seen, first_seen)),
+        last_seen = MAX(COALESCE(last_seen, excluded.last_seen), COALESCE(excluded.last_seen, last_seen)),
+        sale_count = sale_count + excluded.sale_count,
+        last_sale_price = CASE WHEN excluded.last_sale_date >= COALESCE(last_sale_date, '')
+                               THEN excluded.last_sale_price ELSE last_sale_price END,
+        last_sale_date = MAX(COALESCE(last_sale_date, excluded.last_sale_date),
+                             COALESCE(excluded.last_sale_date, last_sale_date))
+'''
+
+# Источники для пересчёта: в порядке id, как их видел инжест
+_PRICES_QUERY = "SELECT gift_name, date, delta_ton, floor_ton, average_ton, suspicious FROM prices ORDER BY id"
+_DAILY_QUERY = '''
+    SELECT gift_name, row_count, delta_count, delta_sum, close_floor, close_average, first_date, last_date
+    FROM prices_daily
+'''
+_SALES_QUERY = "SELECT gift_name, date, price_ton, suspicious FROM sales ORDER BY id"
+
+
+def _valid_date(date) -> bool:
+    return bool(date and _DATE_RE.match(date))
+
+
+class _GiftDelta:
+    def __init__(self, gift_name):
+        self.gift_name = gift_name
+        self.price_rows = 0
+        self.delta_count = 0
+        self.delta_sum = 0.0
+        self.last_floor = self.last_average = self.last_price_date = None
+        self.first_seen = self.last_seen = None
+        self.sale_count = 0
+        self.last_sale_price = self.last_sale_date = None
+
+    def seen(self, first, last) -> None:
+        if _valid_date(first) and (self.first_seen is None or first < self.first_seen):
+            self.first_seen = first
+        if _valid_date(last) and (self.last_seen is None or last > self.last_seen):
+            self.last_seen = last
+
+    def close(self, date, floor_ton, average_ton) -> None:
+        if floor_ton is None or not _valid_date(date):
+            return
+        if self.last_price_date is None or date >= self.last_price_date:
+            self.last_floor, self.last_average, self.last_price_date = floor_ton, average_ton, date
+
+    def as_row(self):
+        return (self.gift_name, self.price_rows, self.delta_count, self.delta_sum,
+                self.last_floor, self.last_average, self.last_price_date, self.first_seen, self.last_seen,
+                self.sale_count, self.last_sale_price, self.last_sale_date)
+
+
+class GiftStatsWriter:
+    """
+    Копит изменения сводки за пачку; flush/flush_async вызываются перед commit,
+    при откате пачки pending просто очищается.
+    """
+
+    def __init__(self):
+        self.pending = {}  # подарок -> _GiftDelta
+
+    def _delta(self, gift_name: str) -> _GiftDelta:
+        delta = self.pending.get(gift_name)
+        if delta is None:
+            delta = self.pending[gift_name] = _GiftDelta(gift_name)
+        return delta
+
+    def add_price(self, gift_name: str, date: str, delta_ton, floor_ton, average_ton, suspicious=False) -> None:
+        delta = self._delta(gift_name)
+        delta.price_rows += 1
+        delta.seen(date, date)
+        if suspicious:
+            return
+        if delta_ton is not None:
+            delta.delta_count += 1
+            delta.delta_sum += delta_ton
+        delta.close(date, floor_ton, average_ton)
+
+    def add_daily(self, gift_name: str, row_count, delta_count, delta_sum, close_floor, close_average,
+                  first_date, last_date) -> None:
+        delta = self._delta(gift_name)
+        delta.price_rows += row_count or 0
+        delta.delta_count += delta_count or 0
+        delta.delta_sum += delta_sum or 0.0
+        delta.seen(first_date, last_date)
+        delta.close(last_date, close_floor, close_average)
+
+    def add_sale(self, gift_name: str, date: str, price_ton, suspicious=False) -> None:
+        delta = self._delta(base_gift_name(gift_name))
+        delta.sale_count += 1
+        delta.seen(date, date)
+        if suspicious or price_ton is None or not _valid_date(date):
+            return
+        if delta.last_sale_date is None or date >= delta.last_sale_date:
+            delta.last_sale_price, delta.last_sale_date = price_ton, date
+
+    def _rows(self) -> list:
+        rows = [delta.as_row() for delta in self.pending.values()]
+        self.pending.clear()
+        return rows
+
+    def flush(self, conn: sqlite3.Connection) -> None:
+        if self.pending:
+            conn.executemany(_UPSERT, self._rows())
+
+    async def flush_async(self, db) -> None:
+        if self.pending:
+            await db.executemany(_UPSERT, self._rows())
+
+
+def _table_exists(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'gift_stats'").fetchone() is not None
+
+
+def recompute(conn: sqlite3.Connection) -> dict:
+    """
+    Сводка по всей истории (prices, prices_daily, sales): {подарок: строка gift_stats}.
+    """
+    writer = GiftStatsWriter()
+    for gift_name, date, delta_ton, floor_ton, average_ton, suspicious in conn.execute(_PRICES_QUERY):
+        writer.add_price(gift_name, date, delta_ton, floor_ton, average_ton, suspicious)
+    for row in conn.execute(_DAILY_QUERY):
+        writer.add_daily(*row)
+    for gift_name, date, price_ton, suspicious in conn.execute(_SALES_QUERY):
+        writer.add_sale(gift_name, date, price_ton, suspicious)
+    return {row[0]: row for row in writer._rows()}
+
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    """
+    Пересчитывает gift_stats по всей истории. Чтение и запись — одна транзакция
+    с блокировкой на запись, чтобы не потерять пачки, закоммиченные между ними.
+    """
+    anomaly.ensure_schema(conn)
+    conn.execute(PRICES_DAILY_SCHEMA)
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(GIFT_STATS_SCHEMA)
+        rows = list(recompute(conn).values())
+        conn.execute("DELETE FROM gift_stats")
+        conn.executemany(_UPSERT, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """
+    Создаёт gift_stats; если таблицы ещё не было, заполняет её по существующей истории.
+    """
+    if not _table_exists(conn):
+        rebuild(conn)
+
+
+async def ensure_schema_async(db) -> None:
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'gift_stats'") as cursor:
+        if await cursor.fetchone():
+            return
+    await db.commit()
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        await db.execute(GIFT_STATS_SCHEMA)
+        writer = GiftStatsWriter()
+        async with db.execute(_PRICES_QUERY) as cursor:
+            async for gift_name, date, delta_ton, floor_ton, average_ton, suspicious in cursor:
+                writer.add_price(gift_name, date, delta_ton, floor_ton, average_ton, suspicious)
+        async with db.execute(_DAILY_QUERY) as cursor:
+            async for row in cursor:
+                writer.add_daily(*row)
+        async with db.execute(_SALES_QUERY) as cursor:
+            async for gift_name, date, price_ton, suspicious in cursor:
+                writer.add_sale(gift_name, date, price_ton, suspicious)
+        await db.execute("DELETE FROM gift_stats")
+        await writer.flush_async(db)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+
+def _same(stored, expected) -> bool:
+    if isinstance(stored, float) or isinstance(expected, float):
+        if stored is None or expected is None:
+            return stored is expected
+        # delta_sum свёрнутой истории сложена в другом порядке
+        return math.isclose(stored, expected, rel_tol=1e-9, abs_tol=1e-6)
+    return stored == expected
+
+
+def check(conn: sqlite3.Connection) -> list:
+    """
+    Сравнивает gift_stats с пересчётом по истории.
+    Возвращает расхождения [(подарок, колонка, в таблице, по истории)].
+    """
+    conn.execute("BEGIN")  # один снимок БД для обоих чтений
+    try:
+        stored = {row[0]: row for row in conn.execute(f"SELECT gift_name, {', '.join(COLUMNS)} FROM gift_stats")}
+        expected = recompute(conn)
+    finally:
+        conn.rollback()
+    mismatches = []
+    for gift_name in sorted(stored.keys() | expected.keys()):
+        left, right = stored.get(gift_name), expected.get(gift_name)
+        if left is None or right is None:
+            mismatches.append((gift_name, "gift_name", left and gift_name, right and gift_name))
+            continue
+        for column, a, b in zip(COLUMNS, left[1:], right[1:]):
+            if not _same(a, b):
+                mismatches.append((gift_name, column, a, b))
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Сводка по подаркам gift_stats")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--check", action="store_true", help="сравнить gift_stats с пересчётом по истории")
+    parser.add_argument("--rebuild", action="store_true", help="пересчитать gift_stats по всей истории")
+    args = parser.parse_args()
+    if not (args.check or args.rebuild):
+        parser.print_help()
+        sys.exit(0)
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        if args.rebuild:
+            print(f"Подарков в сводке: {rebuild(conn)}")
+        if args.check:
+            if not _table_exists(conn):
+                print("Таблицы gift_stats нет — запустите --rebuild")
+                sys.exit(1)
+            mismatches = check(conn)
+            for gift_name, column, stored, expected in mismatches:
+                print(f"{gift_name}: {column} = {stored!r}, по истории {expected!r}")
+            print(f"Расхождений: {len(mismatches)}")
+            sys.exit(1 if mismatches else 0)
+    finally:
+        conn.close()
@@ -0,0 +1,315 @@
+"""
+Нагрузочный и soak-тест обработчиков analyzer_v2.py без Telegram.
+
+Обработчики вызываются напрямую с синтетическими Update/CallbackQuery, ответы
+принимает фейковый бот (только считает их). Сценарий — смесь команд и нажатий
+inline-кнопок с заданными весами, нагрузка — N параллельных «пользователей».
+
+Отчёт: пропускная способность, p50/p95/p99 и максимум задержки по обработчикам,
+ошибки, задержка event loop (показывает, кто блокирует цикл) и рост памяти
+по tracemalloc с самыми растущими местами аллокаций.
+
+tracemalloc заметно замедляет тяжёлые обработчики (графики, прогноз — в разы),
+поэтому задержки лучше мерить отдельным прогоном с --trace-frames 0: тогда
+память оценивается только по RSS процесса.
+
+gifts.db открывается из --db, users.db создаётся во временном каталоге.
+
+Запуск:
+    python loadtest.py --db gifts.db --concurrency 50 --requests 2000
+    python loadtest.py --db gifts.db --concurrency 20 --duration 1800 --mem-interval 60
+    python loadtest.py --mix "gift_info=5,callback_gift=5,callback_forecast=0"
+    python loadtest.py --mix "callback_forecast=1,callback_detailed=1" --trace-frames 0
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import resource
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from types import SimpleNamespace
+
+DEFAULT_MIX = {
+    "start": 1,
+    "gift_info": 3,
+    "list_gifts": 1,
+    "callback_gift": 3,
+    "callback_forecast": 1,
+    "callback_detailed": 1,
+    "callback_list": 1,
+}
+LOOP_LAG_INTERVAL = 0.05
+TOP_ALLOCATIONS = 5
+
+
+# ----------------------- Фейковые объекты Telegram -----------------------
+class FakeBot:
+    def __init__(self):
+        self.replies = {}
+
+    def record(self, kind: str) -> None:
+        self.replies[kind] = self.replies.get(kind, 0) + 1
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.record("send_message")
+
+
+class FakeMessage:
+    def __init__(self, bot: FakeBot, chat_id: int, text: str = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        self.bot.record("reply_text")
+
+    async def reply_html(self, text, **kwargs):
+        self.bot.record("reply_html")
+
+    async def reply_photo(self, photo, **kwargs):
+        self.bot.record("reply_photo")
+
+    async def delete(self):
+        self.bot.record("delete")
+
+
+class FakeCallbackQuery:
+    def __init__(self, bot: FakeBot, chat_id: int, data: str):
+        self.bot = bot
+        self.data = data
+        self.message = FakeMessage(bot, chat_id, text="Выберите подарок:")
+
+    async def answer(self, *args, **kwargs):
+        self.bot.record("answer")
+
+    async def edit_message_text(self, text, **kwargs):
+        self.bot.record("edit_message_text")
+
+    async def edit_message_caption(self, caption=None, **kwargs):
+        self.bot.record("edit_message_caption")
+
+    async def edit_message_media(self, media, **kwargs):
+        self.bot.record("edit_message_media")
+
+
+def make_update(bot: FakeBot, user_id: int, callback_data: str = None):
+    user = SimpleNamespace(id=user_id, username=f"load{user_id}", first_name="Load", last_name="Test")
+    chat = SimpleNamespace(id=user_id)
+    return SimpleNamespace(
+        effective_user=user,
+        effective_chat=chat,
+        message=FakeMessage(bot, user_id),
+        callback_query=FakeCallbackQuery(bot, user_id, callback_data) if callback_data else None,
+    )
+
+
+# ----------------------- Сценарий -----------------------
+def build_scenarios(analyzer, bot: FakeBot, gifts: list) -> dict:
+    """
+    Название сценария -> функция (user_id) -> (обработчик, корутина).
+    """
+    def command(handler, args=None):
+        def make(user_id):
+            context = SimpleNamespace(args=args() if args else [], bot=bot)
+            return handler(make_update(bot, user_id), context)
+        return make
+
+    def callback(data):
+        def make(user_id):
+            context = SimpleNamespace(args=[], bot=bot)
+            return analyzer.handle_callback(make_update(bot, user_id, data()), context)
+        return make
+
+    return {
+        "start": command(analyzer.start),
+        "gift_info": command(analyzer.gift_info, lambda: random.choice(gifts).split()),
+        "list_gifts": command(analyzer.list_gifts_command),
+        "callback_gift": callback(lambda: f"gift:{random.choice(gifts)}"),
+        "callback_forecast": callback(lambda: f"forecast:{random.choice(gifts)}"),
+        "callback_detailed": callback(lambda: f"detailed:{random.choice(gifts)}"),
+        "callback_list": callback(lambda: "list"),
+    }
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.error_samples = {}
+        self.loop_lag = []
+        self.memory = []  # (секунда от старта, байт по tracemalloc)
+
+    def add(self, name: str, seconds: float, error: Exception = None) -> None:
+        self.latencies.setdefault(name, []).append(seconds)
+        if error is not None:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            self.error_samples.setdefault(name, repr(error))
+
+
+async def _loop_lag_monitor(stats: Stats, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        stats.loop_lag.append(time.perf_counter() - started - LOOP_LAG_INTERVAL)
+
+
+async def _memory_monitor(stats: Stats, stop: asyncio.Event, interval: float, started: float, snapshots: list):
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        if tracemalloc.is_tracing():
+            current, _ = tracemalloc.get_traced_memory()
+            snapshots[1] = tracemalloc.take_snapshot()
+        else:
+            current = _rss_bytes()
+        stats.memory.append((time.perf_counter() - started, current))
+
+
+def _rss_bytes() -> int:
+    # Пиковый RSS: в Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def run(db_file: str, concurrency: int, total: int, duration: float, mix: dict,
+              users: int, mem_interval: float, seed: int, trace_frames: int = 1) -> Stats:
+    random.seed(seed)
+    db_file = os.path.abspath(db_file)
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    # analyzer_v2.py открывает gifts.db и users.db относительно текущего каталога
+    os.symlink(db_file, os.path.join(workdir, "gifts.db"))
+    os.chdir(workdir)
+
+    import analyzer_v2 as analyzer
+    await analyzer.init_gift_db()
+    await analyzer.init_user_db()
+    gifts = [row[0] for row in sqlite3.connect(db_file).execute("SELECT name FROM gifts")] or analyzer.GIFT_LIST
+
+    bot = FakeBot()
+    scenarios = build_scenarios(analyzer, bot, gifts)
+    names = [name for name in mix if mix[name] > 0]
+    weights = [mix[name] for name in names]
+    # По умолчанию каждый запрос — новый пользователь (иначе сработает rate_limit бота)
+    user_ids = itertools.count(1_000_000) if not users else None
+
+    stats = Stats()
+    stop = asyncio.Event()
+    issued = itertools.count()
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+
+    async def worker():
+        while not stop.is_set():
+            if total and next(issued) >= total:
+                return
+            if deadline and time.perf_counter() >= deadline:
+                return
+            name = random.choices(names, weights)[0]
+            user_id = next(user_ids) if user_ids is not None else random.randrange(users) + 1_000_000
+            t0 = time.perf_counter()
+            error = None
+            try:
+                await scenarios[name](user_id)
+            except Exception as e:
+                error = e
+            stats.add(name, time.perf_counter() - t0, error)
+
+    snapshots = [None, None]
+    if trace_frames:
+        tracemalloc.start(trace_frames)
+        snapshots[0] = tracemalloc.take_snapshot()
+    monitors = [asyncio.create_task(_loop_lag_monitor(stats, stop)),
+                asyncio.create_task(_memory_monitor(stats, stop, mem_interval, started, snapshots))]
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*monitors)
+    if trace_frames:
+        snapshots[1] = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    else:
+        stats.memory.append((elapsed, _rss_bytes()))
+
+    await analyzer.gift_db.close()
+    await analyzer.user_db.close()
+    report(stats, elapsed, concurrency, bot, snapshots)
+    return stats
+
+
+def report(stats: Stats, elapsed: float, concurrency: int, bot: FakeBot, snapshots: list) -> None:
+    n = sum(len(v) for v in stats.latencies.values())
+    print(f"Запросов: {n} за {elapsed:.1f} с, параллельность {concurrency}: {n / elapsed:.1f} запр/с")
+    print(f"{'обработчик':<20} {'N':>6} {'ошибки':>7} {'запр/с':>8} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'max мс':>9}")
+    for name in sorted(stats.latencies):
+        values = sorted(stats.latencies[name])
+        print(f"{name:<20} {len(values):>6} {stats.errors.get(name, 0):>7} {len(values) / elapsed:>8.1f} "
+              f"{percentile(values, 0.5) * 1000:>9.1f} {percentile(values, 0.95) * 1000:>9.1f} "
+              f"{percentile(values, 0.99) * 1000:>9.1f} {values[-1] * 1000:>9.1f}")
+    for name, sample in stats.error_samples.items():
+        print(f"  ошибка в {name}: {sample}")
+
+    lag = sorted(stats.loop_lag)
+    if lag:
+        print(f"Задержка event loop: p50 {percentile(lag, 0.5) * 1000:.1f} мс, "
+              f"p99 {percentile(lag, 0.99) * 1000:.1f} мс, max {lag[-1] * 1000:.1f} мс")
+    print("Ответы бота: " + ", ".join(f"{kind}={count}" for kind, count in sorted(bot.replies.items())))
+
+    if len(stats.memory) >= 2:
+        (t_first, m_first), (t_last, m_last) = stats.memory[0], stats.memory[-1]
+        rate = (m_last - m_first) / max(t_last - t_first, 1e-9) * 60
+        source = "tracemalloc" if snapshots[0] is not None else "пиковый RSS"
+        print(f"Память ({source}): {m_first / 1024 / 1024:.1f} МБ -> {m_last / 1024 / 1024:.1f} МБ "
+              f"({rate / 1024:+.1f} КБ/мин между первым и последним замером)")
+        peak = max(m for _, m in stats.memory)
+        print(f"  Пик между замерами: {peak / 1024 / 1024:.1f} МБ, замеров: {len(stats.memory)}")
+    if snapshots[0] is not None and snapshots[1] is not None:
+        print("Наибольший рост аллокаций:")
+        for stat in snapshots[1].compare_to(snapshots[0], "lineno")[:TOP_ALLOCATIONS]:
+            print(f"  {stat}")
+
+
+def _parse_mix(value: str) -> dict:
+    mix = {name: 0 for name in DEFAULT_MIX}
+    for item in value.split(","):
+        if "=" in item:
+            name, weight = item.split("=", 1)
+            if name.strip() not in mix:
+                raise argparse.ArgumentTypeError(f"Неизвестный сценарий {name}; есть: {', '.join(DEFAULT_MIX)}")
+            mix[name.strip()] = float(weight)
+    return mix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота")
+    parser.add_argument("--db", default="gifts.db")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=1000, help="всего запросов (0 — без ограничения)")
+    parser.add_argument("--duration", type=float, default=0, help="длительность в секундах (soak-тест)")
+    parser.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX, help='веса сценариев: "gift_info=3,callback_forecast=1"')
+    parser.add_argument("--users", type=int, default=0, help="пул пользователей (по умолчанию — новый на каждый запрос)")
+    parser.add_argument("--mem-interval", type=float, default=10, help="интервал замеров памяти, с")
+    parser.add_argument("--trace-frames", type=int, default=1,
+                        help="глубина стека tracemalloc (0 — без tracemalloc, только RSS)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if args.duration:
+        args.requests = 0
+    warnings.filterwarnings("ignore")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    asyncio.run(run(args.db, args.concurrency, args.requests, args.duration, args.mix,
+                    args.users, args.mem_interval, args.seed, args.trace_frames))
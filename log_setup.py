@@ -0,0 +1,189 @@
+"""
+Общая настройка логирования для snifer.py, main.py и analyzer_v2.py.
+
+  - Записи кладутся в ограниченную очередь (QueueHandler), а форматирование и вывод
+    выполняются в отдельном потоке (QueueListener) — логирование не блокирует
+    парсинг и event loop. При переполнении очереди записи отбрасываются и считаются.
+  - Каждая запись — одна строка JSON: ts, level, logger, msg + поля из extra=...
+  - Уровни по компонентам:      LOG_LEVELS="snifer=INFO,snifer.floor=WARNING"
+  - Сэмплирование шумных логов: LOG_SAMPLE="snifer.floor=0.1,main.message=0.001"
+    (доля записей ниже WARNING, которые попадут в вывод; предупреждения и ошибки не сэмплируются)
+  - LOG_FORMAT=text — обычный человекочитаемый вывод вместо JSON.
+
+Пример:
+    from log_setup import setup_logging
+    setup_logging("snifer", sampling={"snifer.floor.raw": 0.01})
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+QUEUE_SIZE = 10_000
+
+# Стандартные атрибуты LogRecord — всё остальное считается структурированными полями из extra
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, component: str):
+        super().__init__()
+        self.component = component
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "component": self.component,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает долю rate записей логгера (и его потомков) ниже уровня WARNING.
+    Детерминированно: при rate=0.01 проходит каждая сотая запись.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        # Сначала самые длинные префиксы: "snifer.floor.raw" важнее "snifer.floor"
+        self.rates = sorted(rates.items(), key=lambda kv: -len(kv[0]))
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def _rate_for(self, name: str):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return prefix, rate
+        return None, 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        prefix, rate = self._rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        every = max(int(round(1.0 / rate)), 1)
+        with self.lock:
+            n = self.counters.get(prefix, 0)
+            self.counters[prefix] = n + 1
+        if n % every == 0:
+            record.sampled_every = every
+            return True
+        return False
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler, который никогда не ждёт: при полной очереди запись отбрасывается.
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Копия с уже подставленными аргументами; extra-поля сохраняются для JSON
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_pairs(value: str) -> dict:
+    result = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            key, val = item.split("=", 1)
+            result[key.strip()] = val.strip()
+    return result
+
+
+_listener = None
+_handler = None
+
+
+def setup_logging(component: str, level=logging.INFO, levels: dict = None, sampling: dict = None,
+                  stream=None, log_file: str = None) -> QueueListener:
+    """
+    Настраивает корневой логгер процесса. levels/sampling — значения по умолчанию,
+    переменные окружения LOG_LEVELS/LOG_SAMPLE их дополняют и переопределяют.
+    Повторный вызов заменяет предыдущую настройку.
+    """
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        logging.getLogger().removeHandler(_handler)
+
+    if os.environ.get("LOG_FORMAT", "json") == "text":
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    else:
+        formatter = JsonFormatter(component)
+
+    outputs = [logging.StreamHandler(stream or sys.stderr)]
+    if log_file:
+        outputs.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for h in outputs:
+        h.setFormatter(formatter)
+
+    rates = {name: float(rate) for name, rate in (sampling or {}).items()}
+    rates.update({name: float(rate) for name, rate in _parse_pairs(os.environ.get("LOG_SAMPLE")).items()})
+
+    q = queue.Queue(maxsize=QUEUE_SIZE)
+    _handler = _DroppingQueueHandler(q)
+    _handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    root.setLevel(os.environ.get("LOG_LEVEL", level))
+    root.addHandler(_handler)
+
+    component_levels = dict(levels or {})
+    component_levels.update(_parse_pairs(os.environ.get("LOG_LEVELS")))
+    for name, lvl in component_levels.items():
+        logging.getLogger(name).setLevel(lvl.upper() if isinstance(lvl, str) else lvl)
+
+    _listener = QueueListener(q, *outputs, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+
+def shutdown_logging() -> None:
+    """
+    Дописывает всё, что осталось в очереди. Вызывается автоматически при выходе.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -1,327 +1,659 @@
-import sqlite3
-import json
-import datetime
-import re
-
-# Открываем (или создаём) базу данных и создаём таблицы, если их ещё нет
-conn = sqlite3.connect('gifts.db')
-cursor = conn.cursor()
-
-# Таблица для статичных данных о подарках (здесь храним только имя, можно расширять)
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS gifts (
-    id INTEGER PRIMARY KEY,
-    name TEXT UNIQUE,
-    total_count INTEGER,
-    base_star_cost REAL
-)
-''')
-
-# Таблица для записей с ценами
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS prices (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    gift_name TEXT,
-    date TEXT,
-    delta_ton REAL,
-    floor_ton REAL,
-    floor_usd REAL,
-    floor_star REAL,
-    floor_rub REAL,
-    average_ton REAL,
-    average_usd REAL,
-    average_star REAL,
-    average_rub REAL
-)
-''')
-
-# Новая таблица для записей о продажах
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS sales (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    message_id INTEGER UNIQUE,
-    gift_name TEXT,
-    price_ton REAL,
-    date TEXT
-)
-''')
-conn.commit()
-
-def get_text(item):
-    """
-    Универсальная функция для получения текстового значения из элемента,
-    который может быть либо строкой, либо словарём с ключом "text".
-    """
-    if isinstance(item, dict):
-        return item.get("text", "").strip()
-    elif isinstance(item, str):
-        return item.strip()
-    return ""
-
-def parse_message(msg):
-    """
-    Парсит сообщение с данными о подарке.
-    
-    Ожидается, что:
-      - Имя подарка находится в первом элементе text.
-      - Delta берётся из text[2] (первый токен).
-      - Первая группа чисел в секции Floor (до маркера "Average") — это данные Tonnel.
-      - Секция Average определяется поиском элемента, содержащего "Average".
-    """
-    if not isinstance(msg, dict) or msg.get("type") != "message":
-        return None
-
-    text = msg.get("text")
-    if not text:
-        return None
-    if not isinstance(text, list):
-        text = [text]
-
-    # Минимальное число элементов для корректного парсинга (это можно настроить)
-    if len(text) < 10:
-        return None
-
-    # Извлекаем имя подарка
-    gift_name = get_text(text[0])
-    if not gift_name:
-        return None
-
-    # Извлекаем delta из text[2] (берём первый токен)
-    delta_raw = get_text(text[2]).split()[0]
-    try:
-        delta_value = float(delta_raw.replace(",", "."))
-    except ValueError:
-        return None
-
-    # Ищем первую секцию "Average" в сообщении
-    avg_marker = None
-    for i, item in enumerate(text):
-        if "Average" in get_text(item):
-            avg_marker = i
-            break
-    if avg_marker is None:
-        return None
-
-    # Среди элементов от начала до маркера Average ищем 4 подряд идущих чисел для секции Floor
-    floor_vals = []
-    for i in range(0, avg_marker):
-        val = get_text(text[i])
-        match = re.search(r"[-+]?\d*[\.,]?\d+", val)
-        if match:
-            try:
-                num = float(match.group(0).replace(",", "."))
-                floor_vals.append(num)
-            except ValueError:
-                continue
-
-    if len(floor_vals) < 4:
-        return None
-
-    # Предположим, что первые 4 найденных числа относятся к секции Floor (Tonnel, USD, Star, Rub)
-    floor_ton, floor_usd, floor_star, floor_rub = floor_vals[:4]
-
-    # Проверяем, что после маркера Average есть достаточное количество элементов для извлечения данных
-    if len(text) < avg_marker + 10:
-        return None
-    try:
-        average_ton = float(get_text(text[avg_marker + 3]).replace(",", "."))
-        average_usd = float(get_text(text[avg_marker + 5]).replace(",", "."))
-        average_star = float(get_text(text[avg_marker + 7]).replace(",", "."))
-        average_rub = float(get_text(text[avg_marker + 9]).replace(",", "."))
-    except ValueError:
-        return None
-
-    return {
-        "gift_name": gift_name,
-        "date": msg.get("date"),
-        "delta_ton": delta_value,
-        "floor_ton": floor_ton,
-        "floor_usd": floor_usd,
-        "floor_star": floor_star,
-        "floor_rub": floor_rub,
-        "average_ton": average_ton,
-        "average_usd": average_usd,
-        "average_star": average_star,
-        "average_rub": average_rub
-    }
-
-def insert_gift(gift_name):
-    """
-    Вставляет имя подарка в таблицу gifts, если его там ещё нет.
-    """
-    if gift_name and gift_name.strip():
-        try:
-            cursor.execute("INSERT OR IGNORE INTO gifts (name) VALUES (?)", (gift_name.strip(),))
-            conn.commit()
-        except Exception as e:
-            print("Ошибка при вставке подарка '{}': {}".format(gift_name, e))
-
-def insert_price_data(data):
-    """
-    Вставляет данные в таблицу prices.
-    Перед вставкой проверяем, есть ли уже запись с таким же gift_name и date.
-    Если да — пропускаем вставку.
-    """
-    cursor.execute("SELECT id FROM prices WHERE gift_name = ? AND date = ?", (data["gift_name"], data["date"]))
-    if cursor.fetchone() is not None:
-        print("Данные для подарка '{}' с датой {} уже существуют. Пропускаем вставку.".format(data["gift_name"], data["date"]))
-        return
-
-    cursor.execute('''
-    INSERT INTO prices (gift_name, date, delta_ton, floor_ton, floor_usd, floor_star, floor_rub, average_ton, average_usd, average_star, average_rub)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        data["gift_name"],
-        data["date"],
-        data["delta_ton"],
-        data["floor_ton"],
-        data["floor_usd"],
-        data["floor_star"],
-        data["floor_rub"],
-        data["average_ton"],
-        data["average_usd"],
-        data["average_star"],
-        data["average_rub"]
-    ))
-    conn.commit()
-
-def parse_sale_message(msg):
-    """
-    Парсит сообщение о продаже подарка.
-    
-    Ожидаемый формат сообщения (пример):
-      [
-         "Gift Sold\n\n",
-         {
-           "type": "text_link",
-           "text": "Perfume Bottle #1476",
-           "href": "https://t.me/nft/PerfumeBottle-1476"
-         },
-         "\n\nPrice: 12.5 TON"
-      ]
-      
-    Если сообщение удовлетворяет условиям (содержит "Gift Sold" и строку с "Price:"), 
-    возвращает словарь с данными:
-       - message_id
-       - gift_name
-       - price_ton
-       - date
-    В противном случае возвращает None.
-    """
-    if not isinstance(msg, dict) or msg.get("type") != "message":
-        return None
-
-    text = msg.get("text")
-    if not text:
-        return None
-    if not isinstance(text, list):
-        text = [text]
-
-    # Проверяем, что сообщение содержит отметку о продаже
-    if len(text) < 2:
-        return None
-    first_line = get_text(text[0])
-    if "Gift Sold" not in first_line:
-        return None
-
-    # Извлекаем название подарка (предполагаем, что оно во втором элементе)
-    gift_name = get_text(text[1])
-    if not gift_name:
-        return None
-
-    # Ищем цену продажи в TON (возможно, в любом элементе массива)
-    price_ton = None
-    pattern = r"Price:\s*([-+]?\d*[\.,]?\d+)"
-    for item in text:
-        t = get_text(item)
-        match = re.search(pattern, t)
-        if match:
-            try:
-                price_ton = float(match.group(1).replace(",", "."))
-            except ValueError:
-                price_ton = None
-            break
-
-    if price_ton is None:
-        return None
-
-    return {
-        "message_id": msg.get("id"),
-        "gift_name": gift_name,
-        "price_ton": price_ton,
-        "date": msg.get("date")
-    }
-
-def insert_sale_data(data):
-    """
-    Вставляет данные о продаже в таблицу sales.
-    Если запись с таким message_id уже существует, вставка не производится.
-    """
-    cursor.execute("SELECT id FROM sales WHERE message_id = ?", (data["message_id"],))
-    if cursor.fetchone() is not None:
-        print(f"Запись с message_id {data['message_id']} уже существует. Пропускаем.")
-        return
-
-    cursor.execute('''
-    INSERT INTO sales (message_id, gift_name, price_ton, date)
-    VALUES (?, ?, ?, ?)
-    ''', (data["message_id"], data["gift_name"], data["price_ton"], data["date"]))
-    conn.commit()
-
-# Обработка сообщений с данными о подарках (из файла result.json)
-try:
-    with open('result.json', 'r', encoding='utf-8') as f:
-        loaded = json.load(f)
-except Exception as e:
-    print("Ошибка загрузки result.json:", e)
-    loaded = {}
-
-if isinstance(loaded, dict) and "messages" in loaded:
-    gift_messages = loaded["messages"]
-elif isinstance(loaded, list):
-    gift_messages = loaded
-else:
-    gift_messages = []
-
-print("Найдено сообщений о подарках:", len(gift_messages))
-
-for msg in gift_messages:
-    parsed = parse_message(msg)
-    if parsed is None:
-        continue  # Пропускаем сообщения, не соответствующие ожидаемому формату
-    # Вставляем или обновляем информацию о подарке
-    insert_gift(parsed["gift_name"])
-    print("Обрабатывается подарок:", parsed["gift_name"])
-    # Добавляем запись с ценами, если такой ещё нет
-    insert_price_data(parsed)
-
-print("Парсинг сообщений о подарках завершён.\n")
-
-# Обработка сообщений с данными о продажах (из файла sales.json)
-try:
-    with open('sales.json', 'r', encoding='utf-8') as f:
-        loaded_sales = json.load(f)
-except Exception as e:
-    print("Ошибка загрузки sales.json:", e)
-    loaded_sales = {}
-
-if isinstance(loaded_sales, dict) and "messages" in loaded_sales:
-    sale_messages = loaded_sales["messages"]
-elif isinstance(loaded_sales, list):
-    sale_messages = loaded_sales
-else:
-    sale_messages = []
-
-print("Найдено сообщений о продажах:", len(sale_messages))
-
-for msg in sale_messages:
-    sale_data = parse_sale_message(msg)
-    if sale_data is None:
-        continue  # Пропускаем сообщения, не соответствующие формату продаж
-    print("Обрабатывается продажа подарка:", sale_data["gift_name"], "по цене:", sale_data["price_ton"], "TON")
-    insert_sale_data(sale_data)
-
-print("Парсинг сообщений о продажах завершён.")
-
-# Закрываем соединение с БД
-conn.close()
+import argparse
+import hashlib
+import os
+import sqlite3
+import json
+import datetime
+import re
+import logging
+import threading
+import time
+
+from anomaly import base_gift_name, ensure_schema, load_detector
+from changefeed import Publisher
+from compact import ensure_index
+from dedupe import load_seen, refresh_seen
+from gift_stats import GiftStatsWriter, ensure_schema as ensure_gift_stats
+from log_setup import setup_logging
+from retention import get_cutoff, is_compacted
+from sketches import SALE_SKETCHES_SCHEMA, SketchWriter
+
+DB_FILE = "gifts.db"
+# Файлы экспорта, которые читает запуск без аргументов (как раньше)
+DEFAULT_PRICES_FILE = "result.json"
+DEFAULT_SALES_FILE = "sales.json"
+# Режим --watch: опрос каталога, если нет watchdog (inotify), и время «успокоения» файла
+WATCH_POLL_SECONDS = 5
+SETTLE_SECONDS = 2
+# По сколько сообщений экспорта разбирать, чтобы понять, из какого он канала:
+# следующая порция берётся, пока один парсер не опередит другой вдвое
+SNIFF_MESSAGES = 200
+# Уже записанные ключи: дубликаты отсекаются в памяти, новые строки пишутся пачками
+BATCH_SIZE = 5000
+
+logger = logging.getLogger("main")
+log_message = logging.getLogger("main.message")
+
+INGESTED_FILES_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS ingested_files (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT,
+    size INTEGER,
+    mtime REAL,
+    channel TEXT,
+    messages INTEGER,
+    inserted INTEGER,
+    ingested_at TEXT
+)
+'''
+
+conn = None
+cursor = None
+prices_cutoff = None
+seen = None
+detector = None
+known_gifts = set()
+pending_prices = []
+pending_sales = []
+# Ключи строк, ещё не записанных flush(): в режиме bloom их не найти запросом к БД
+pending_price_keys = set()
+pending_sale_ids = set()
+# Уведомления analyzer_v2.py о новых строках (changefeed.py)
+changes = Publisher()
+sale_sketches = SketchWriter()
+# Сводка по подаркам для /gift (gift_stats.py), пишется в той же транзакции, что и строки
+gift_summary = GiftStatsWriter()
+
+def init_db(db_file=DB_FILE):
+    """
+    Открывает (или создаёт) базу данных, создаёт таблицы и загружает состояние импорта.
+    """
+    global conn, cursor, prices_cutoff, seen, detector, known_gifts
+    conn = sqlite3.connect(db_file, timeout=30)
+    cursor = conn.cursor()
+    # WAL: бот и snifer.py читают базу, пока идёт импорт
+    cursor.execute("PRAGMA journal_mode=WAL")
+
+    # Таблица для статичных данных о подарках (здесь храним только имя, можно расширять)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS gifts (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE,
+        total_count INTEGER,
+        base_star_cost REAL
+    )
+    ''')
+
+    # Таблица для записей с ценами
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS prices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        gift_name TEXT,
+        date TEXT,
+        delta_ton REAL,
+        floor_ton REAL,
+        floor_usd REAL,
+        floor_star REAL,
+        floor_rub REAL,
+        average_ton REAL,
+        average_usd REAL,
+        average_star REAL,
+        average_rub REAL
+    )
+    ''')
+
+    # Новая таблица для записей о продажах
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER UNIQUE,
+        gift_name TEXT,
+        price_ton REAL,
+        date TEXT
+    )
+    ''')
+
+    # Индекс для проверки дубликатов floor-цен (и для запросов анализатора по подарку);
+    # в компактной раскладке (compact.py) prices — представление, индекс уже есть на prices_compact
+    ensure_index(conn)
+    # Часовые квантильные скетчи цен продаж (sketches.py)
+    cursor.execute(SALE_SKETCHES_SCHEMA)
+    # Уже импортированные файлы экспорта (режим --watch)
+    cursor.execute(INGESTED_FILES_SCHEMA)
+    conn.commit()
+
+    # Граница свёрнутой истории (см. retention.py): более старые floor-строки уже хранятся в prices_daily
+    prices_cutoff = get_cutoff(conn)
+
+    seen = load_seen(conn)
+    # Потоковый детектор выбросов: помечает строки колонкой suspicious
+    ensure_schema(conn)
+    detector = load_detector(conn)
+    # Сводка по подаркам; при первом запуске заполняется по уже записанной истории
+    ensure_gift_stats(conn)
+    known_gifts = {name for (name,) in cursor.execute("SELECT name FROM gifts")}
+
+def get_text(item):
+    """
+    Универсальная функция для получения текстового значения из элемента,
+    который может быть либо строкой, либо словарём с ключом "text".
+    """
+    if isinstance(item, dict):
+        return item.get("text", "").strip()
+    elif isinstance(item, str):
+        return item.strip()
+    return ""
+
+def parse_message(msg):
+    """
+    Парсит сообщение с данными о подарке.
+    
+    Ожидается, что:
+      - Имя подарка находится в первом элементе text.
+      - Delta берётся из text[2] (первый токен).
+      - Первая группа чисел в секции Floor (до маркера "Average") — это данные Tonnel.
+      - Секция Average определяется поиском элемента, содержащего "Average".
+    """
+    if not isinstance(msg, dict) or msg.get("type") != "message":
+        return None
+
+    text = msg.get("text")
+    if not text:
+        return None
+    if not isinstance(text, list):
+        text = [text]
+
+    # Минимальное число элементов для корректного парсинга (это можно настроить)
+    if len(text) < 10:
+        return None
+
+    # Извлекаем имя подарка
+    gift_name = get_text(text[0])
+    if not gift_name:
+        return None
+
+    # Извлекаем delta из text[2] (берём первый токен)
+    delta_raw = get_text(text[2]).split()[0]
+    try:
+        delta_value = float(delta_raw.replace(",", "."))
+    except ValueError:
+        return None
+
+    # Ищем первую секцию "Average" в сообщении
+    avg_marker = None
+    for i, item in enumerate(text):
+        if "Average" in get_text(item):
+            avg_marker = i
+            break
+    if avg_marker is None:
+        return None
+
+    # Среди элементов от начала до маркера Average ищем 4 подряд идущих чисел для секции Floor
+    floor_vals = []
+    for i in range(0, avg_marker):
+        val = get_text(text[i])
+        match = re.search(r"[-+]?\d*[\.,]?\d+", val)
+        if match:
+            try:
+                num = float(match.group(0).replace(",", "."))
+                floor_vals.append(num)
+            except ValueError:
+                continue
+
+    if len(floor_vals) < 4:
+        return None
+
+    # Предположим, что первые 4 найденных числа относятся к секции Floor (Tonnel, USD, Star, Rub)
+    floor_ton, floor_usd, floor_star, floor_rub = floor_vals[:4]
+
+    # Проверяем, что после маркера Average есть достаточное количество элементов для извлечения данных
+    if len(text) < avg_marker + 10:
+        return None
+    try:
+        average_ton = float(get_text(text[avg_marker + 3]).replace(",", "."))
+        average_usd = float(get_text(text[avg_marker + 5]).replace(",", "."))
+        average_star = float(get_text(text[avg_marker + 7]).replace(",", "."))
+        average_rub = float(get_text(text[avg_marker + 9]).replace(",", "."))
+    except ValueError:
+        return None
+
+    return {
+        "gift_name": gift_name,
+        "date": msg.get("date"),
+        "delta_ton": delta_value,
+        "floor_ton": floor_ton,
+        "floor_usd": floor_usd,
+        "floor_star": floor_star,
+        "floor_rub": floor_rub,
+        "average_ton": average_ton,
+        "average_usd": average_usd,
+        "average_star": average_star,
+        "average_rub": average_rub
+    }
+
+def insert_gift(gift_name):
+    """
+    Вставляет имя подарка в таблицу gifts, если его там ещё нет.
+    """
+    if gift_name and gift_name.strip():
+        name = gift_name.strip()
+        if name in known_gifts:
+            return
+        try:
+            cursor.execute("INSERT OR IGNORE INTO gifts (name) VALUES (?)", (name,))
+            known_gifts.add(name)
+        except Exception as e:
+            logger.error("Ошибка при вставке подарка '{}': {}".format(gift_name, e))
+
+def insert_price_data(data):
+    """
+    Ставит данные в очередь на вставку в таблицу prices. Возвращает True, если строка поставлена.
+    Если запись с таким же gift_name и date уже есть (в БД или в этом импорте) — пропускаем.
+    Строки старше границы retention.py тоже пропускаются: они уже свёрнуты в prices_daily.
+    """
+    if is_compacted(data["date"], prices_cutoff):
+        return False
+
+    if seen.price_seen(data["gift_name"], data["date"]):
+        duplicate = True
+        if not seen.exact and (data["gift_name"], data["date"]) not in pending_price_keys:
+            # Фильтр Блума: возможный дубликат подтверждаем в БД
+            cursor.execute("SELECT id FROM prices WHERE gift_name = ? AND date = ?", (data["gift_name"], data["date"]))
+            duplicate = cursor.fetchone() is not None
+        if duplicate:
+            log_message.info("Данные для подарка уже существуют. Пропускаем вставку.",
+                             extra={"gift_name": data["gift_name"], "date": data["date"]})
+            return False
+
+    seen.add_price(data["gift_name"], data["date"])
+    pending_price_keys.add((data["gift_name"], data["date"]))
+    suspicious = detector.observe_floor(data["gift_name"], data["floor_ton"], data["date"])
+    pending_prices.append((
+        data["gift_name"],
+        data["date"],
+        data["delta_ton"],
+        data["floor_ton"],
+        data["floor_usd"],
+        data["floor_star"],
+        data["floor_rub"],
+        data["average_ton"],
+        data["average_usd"],
+        data["average_star"],
+        data["average_rub"],
+        int(suspicious)
+    ))
+    gift_summary.add_price(data["gift_name"], data["date"], data["delta_ton"], data["floor_ton"],
+                           data["average_ton"], suspicious)
+    if len(pending_prices) >= BATCH_SIZE:
+        flush()
+    return True
+
+def parse_sale_message(msg):
+    """
+    Парсит сообщение о продаже подарка.
+    
+    Ожидаемый формат сообщения (пример):
+      [
+         "Gift Sold\n\n",
+         {
+           "type": "text_link",
+           "text": "Perfume Bottle #1476",
+           "href": "https://t.me/nft/PerfumeBottle-1476"
+         },
+         "\n\nPrice: 12.5 TON"
+      ]
+      
+    Если сообщение удовлетворяет условиям (содержит "Gift Sold" и строку с "Price:"), 
+    возвращает словарь с данными:
+       - message_id
+       - gift_name
+       - price_ton
+       - date
+    В противном случае возвращает None.
+    """
+    if not isinstance(msg, dict) or msg.get("type") != "message":
+        return None
+
+    text = msg.get("text")
+    if not text:
+        return None
+    if not isinstance(text, list):
+        text = [text]
+
+    # Проверяем, что сообщение содержит отметку о продаже
+    if len(text) < 2:
+        return None
+    first_line = get_text(text[0])
+    if "Gift Sold" not in first_line:
+        return None
+
+    # Извлекаем название подарка (предполагаем, что оно во втором элементе)
+    gift_name = get_text(text[1])
+    if not gift_name:
+        return None
+
+    # Ищем цену продажи в TON (возможно, в любом элементе массива)
+    price_ton = None
+    pattern = r"Price:\s*([-+]?\d*[\.,]?\d+)"
+    for item in text:
+        t = get_text(item)
+        match = re.search(pattern, t)
+        if match:
+            try:
+                price_ton = float(match.group(1).replace(",", "."))
+            except ValueError:
+                price_ton = None
+            break
+
+    if price_ton is None:
+        return None
+
+    return {
+        "message_id": msg.get("id"),
+        "gift_name": gift_name,
+        "price_ton": price_ton,
+        "date": msg.get("date")
+    }
+
+def insert_sale_data(data):
+    """
+    Ставит данные о продаже в очередь на вставку в таблицу sales. Возвращает True, если строка поставлена.
+    Если запись с таким message_id уже существует, вставка не производится.
+    """
+    if seen.sale_seen(data["message_id"]):
+        duplicate = True
+        if not seen.exact and data["message_id"] not in pending_sale_ids:
+            # Фильтр Блума: возможный дубликат подтверждаем в БД
+            cursor.execute("SELECT id FROM sales WHERE message_id = ?", (data["message_id"],))
+            duplicate = cursor.fetchone() is not None
+        if duplicate:
+            log_message.info("Запись о продаже уже существует. Пропускаем.", extra={"message_id": data["message_id"]})
+            return False
+
+    seen.add_sale(data["message_id"])
+    pending_sale_ids.add(data["message_id"])
+    suspicious = detector.observe_sale(data["gift_name"], data["price_ton"], data["date"])
+    pending_sales.append((data["message_id"], data["gift_name"], data["price_ton"], data["date"], int(suspicious)))
+    if len(pending_sales) >= BATCH_SIZE:
+        flush()
+    return True
+
+def flush():
+    """
+    Записывает накопленные новые строки пачкой, одной транзакцией.
+    """
+    if pending_prices:
+        cursor.executemany('''
+        INSERT INTO prices (gift_name, date, delta_ton, floor_ton, floor_usd, floor_star, floor_rub, average_ton, average_usd, average_star, average_rub, suspicious)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', pending_prices)
+        # executemany не отдаёт id строк — сообщаем верхнюю границу пачки
+        max_id = cursor.execute("SELECT MAX(id) FROM prices").fetchone()[0]
+        for gift_name in {row[0] for row in pending_prices}:
+            changes.publish("prices", gift_name, max_id)
+    if pending_sales:
+        # По строке, а не executemany: OR IGNORE молча пропускает уже записанные
+        # продажи (например, вставленные snifer.py), и в сводку и скетчи должны
+        # попасть только действительно вставленные строки
+        inserted = set()
+        for row in pending_sales:
+            cursor.execute('''
+            INSERT OR IGNORE INTO sales (message_id, gift_name, price_ton, date, suspicious)
+            VALUES (?, ?, ?, ?, ?)
+            ''', row)
+            if cursor.rowcount != 1:
+                continue
+            message_id, gift_name, price_ton, date, suspicious = row
+            gift_summary.add_sale(gift_name, date, price_ton, suspicious)
+            if not suspicious:
+                sale_sketches.add(gift_name, date, price_ton)
+            inserted.add(base_gift_name(gift_name))
+        if inserted:
+            max_id = cursor.execute("SELECT MAX(id) FROM sales").fetchone()[0]
+            for gift_name in inserted:
+                changes.publish("sales", gift_name, max_id)
+    sale_sketches.flush(conn)
+    gift_summary.flush(conn)
+    conn.commit()
+    changes.flush()
+    pending_prices.clear()
+    pending_sales.clear()
+    pending_price_keys.clear()
+    pending_sale_ids.clear()
+
+def load_messages(path):
+    """
+    Читает экспорт чата Telegram (JSON) и возвращает (экспорт, список сообщений).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        loaded = json.load(f)
+    if isinstance(loaded, dict) and "messages" in loaded:
+        return loaded, loaded["messages"]
+    if isinstance(loaded, list):
+        return loaded, loaded
+    return loaded, []
+
+def detect_channel(messages):
+    """
+    Определяет канал экспорта по содержимому: "floor" (GiftChangesFloorPrices),
+    "sales" (GiftNotification) или None, если не похоже ни на один.
+    Сообщения разбираются порциями по SNIFF_MESSAGES, пока один из парсеров явно
+    не победит; при равенстве — до конца файла (в начале экспорта могут быть
+    только служебные сообщения).
+    """
+    floor_hits = sales_hits = 0
+    for start in range(0, len(messages), SNIFF_MESSAGES):
+        sample = messages[start:start + SNIFF_MESSAGES]
+        floor_hits += sum(1 for msg in sample if parse_message(msg) is not None)
+        sales_hits += sum(1 for msg in sample if parse_sale_message(msg) is not None)
+        if max(floor_hits, sales_hits) >= 2 * min(floor_hits, sales_hits) + 1:
+            break
+    if floor_hits == sales_hits:
+        return None
+    return "floor" if floor_hits > sales_hits else "sales"
+
+def ingest_gift_messages(gift_messages):
+    """
+    Обработка сообщений с данными о подарках (канал floor-цен). Возвращает число новых строк.
+    """
+    logger.info(f"Найдено сообщений о подарках: {len(gift_messages)}", extra={"count": len(gift_messages)})
+    inserted = 0
+    for msg in gift_messages:
+        parsed = parse_message(msg)
+        if parsed is None:
+            continue  # Пропускаем сообщения, не соответствующие ожидаемому формату
+        # Вставляем или обновляем информацию о подарке
+        insert_gift(parsed["gift_name"])
+        log_message.info("Обрабатывается подарок", extra={"gift_name": parsed["gift_name"]})
+        # Добавляем запись с ценами, если такой ещё нет
+        inserted += insert_price_data(parsed)
+    flush()
+    logger.info("Парсинг сообщений о подарках завершён.")
+    return inserted
+
+def ingest_sale_messages(sale_messages):
+    """
+    Обработка сообщений с данными о продажах. Возвращает число новых строк.
+    """
+    logger.info(f"Найдено сообщений о продажах: {len(sale_messages)}", extra={"count": len(sale_messages)})
+    inserted = 0
+    for msg in sale_messages:
+        sale_data = parse_sale_message(msg)
+        if sale_data is None:
+            continue  # Пропускаем сообщения, не соответствующие формату продаж
+        log_message.info("Обрабатывается продажа подарка", extra=sale_data)
+        inserted += insert_sale_data(sale_data)
+    flush()
+    logger.info("Парсинг сообщений о продажах завершён.")
+    return inserted
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_ingested(path, stat):
+    """
+    Файл уже импортирован: сначала дешёвая проверка по пути, размеру и mtime, затем по содержимому.
+    """
+    row = cursor.execute(
+        "SELECT 1 FROM ingested_files WHERE path = ? AND size = ? AND mtime = ?",
+        (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    ).fetchone()
+    if row:
+        return True
+    return cursor.execute("SELECT 1 FROM ingested_files WHERE sha256 = ?", (file_sha256(path),)).fetchone() is not None
+
+def ingest_file(path, channel=None):
+    """
+    Импортирует один файл экспорта и записывает его в ingested_files.
+    channel — "floor"/"sales"; если не задан, определяется по содержимому.
+    Возвращает число новых строк или None, если файл не удалось разобрать или определить его канал.
+    """
+    global prices_cutoff
+    stat = os.stat(path)
+    sha256 = file_sha256(path)
+    try:
+        _, messages = load_messages(path)
+    except Exception as e:
+        logger.error(f"Ошибка загрузки {path}: {e}")
+        return None
+    # С прошлого файла snifer.py мог записать новые строки, а retention.py — сдвинуть границу
+    refresh_seen(conn, seen)
+    prices_cutoff = get_cutoff(conn)
+    channel = channel or detect_channel(messages)
+    if channel == "floor":
+        inserted = ingest_gift_messages(messages)
+    elif channel == "sales":
+        inserted = ingest_sale_messages(messages)
+    else:
+        # В ingested_files не записываем: иначе файл не будет прочитан и после исправления парсеров
+        logger.warning(f"Не удалось определить канал экспорта {path}", extra={"path": path})
+        return None
+    cursor.execute(
+        "INSERT OR REPLACE INTO ingested_files (sha256, path, size, mtime, channel, messages, inserted, ingested_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (sha256, os.path.abspath(path), stat.st_size, stat.st_mtime, channel, len(messages), inserted,
+         datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+    conn.commit()
+    logger.info(f"Импортирован {path}: канал {channel}, новых строк {inserted}",
+                extra={"path": path, "channel": channel, "inserted": inserted})
+    return inserted
+
+def reset_state():
+    """
+    Откатывает прерванный импорт: транзакцию, очереди ещё не записанных строк и
+    накопленные для них сводки, а фильтр дубликатов и детектор выбросов, уже
+    учитывающие эти строки, заново загружает из БД.
+    """
+    global seen, detector, known_gifts
+    conn.rollback()
+    pending_prices.clear()
+    pending_sales.clear()
+    pending_price_keys.clear()
+    pending_sale_ids.clear()
+    sale_sketches.pending.clear()
+    gift_summary.pending.clear()
+    changes.pending.clear()
+    seen = load_seen(conn)
+    detector = load_detector(conn)
+    known_gifts = {name for (name,) in cursor.execute("SELECT name FROM gifts")}
+
+def _start_watchdog(directory, wakeup):
+    """
+    inotify (и аналоги) через watchdog, если он установлен. Событие только будит сканирование каталога.
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        return None
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            wakeup.set()
+
+    observer = Observer()
+    observer.schedule(Handler(), directory, recursive=False)
+    observer.start()
+    return observer
+
+def watch(directory):
+    """
+    Режим демона: импортирует новые *.json из каталога по мере появления.
+    Файл берётся в работу, когда его размер и mtime не меняются SETTLE_SECONDS
+    (экспорт может ещё дописываться).
+    """
+    os.makedirs(directory, exist_ok=True)
+    wakeup = threading.Event()
+    observer = _start_watchdog(directory, wakeup)
+    interval = WATCH_POLL_SECONDS * 12 if observer else WATCH_POLL_SECONDS
+    logger.info(f"Слежение за каталогом {directory} ({'watchdog' if observer else 'опрос'})")
+
+    candidates = {}  # путь -> (size, mtime, с какого момента не меняется)
+    try:
+        while True:
+            now = time.monotonic()
+            for entry in os.scandir(directory):
+                if not entry.is_file() or not entry.name.endswith(".json"):
+                    continue
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime)
+                previous = candidates.get(entry.path)
+                if previous is None or previous[:2] != signature:
+                    candidates[entry.path] = signature + (now,)
+                    continue
+                if previous[2] is None or now - previous[2] < SETTLE_SECONDS:
+                    continue
+                candidates[entry.path] = signature + (None,)  # обработан или уже был импортирован
+                if is_ingested(entry.path, stat):
+                    logger.info(f"{entry.path} уже импортирован, пропускаем")
+                    continue
+                try:
+                    ingest_file(entry.path)
+                except Exception as e:
+                    logger.error(f"Ошибка импорта {entry.path}: {e}")
+                    reset_state()
+            pending = any(c[2] is not None for c in candidates.values())
+            wakeup.wait(SETTLE_SECONDS if pending else interval)
+            wakeup.clear()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if observer:
+            observer.stop()
+            observer.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт экспортов чатов Telegram в gifts.db")
+    parser.add_argument("files", nargs="*", help="файлы экспорта; канал определяется по содержимому")
+    parser.add_argument("--watch", metavar="DIR", help="следить за каталогом и импортировать новые экспорты")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+
+    # Построчные сообщения импорта по умолчанию сэмплируются (каждое сотое),
+    # переопределяется через LOG_SAMPLE="main.message=1"
+    setup_logging("main", sampling={"main.message": 0.01})
+    init_db(args.db)
+    try:
+        if args.watch:
+            watch(args.watch)
+        elif args.files:
+            for path in args.files:
+                ingest_file(path)
+        else:
+            # Как раньше: result.json — канал floor-цен, sales.json — продажи
+            for path, channel in ((DEFAULT_PRICES_FILE, "floor"), (DEFAULT_SALES_FILE, "sales")):
+                if os.path.exists(path):
+                    ingest_file(path, channel)
+                else:
+                    logger.error(f"Ошибка загрузки {path}: файл не найден")
+    finally:
+        # Закрываем соединение с БД
+        conn.close()
+
+if __name__ == '__main__':
+    main()
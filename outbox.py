@@ -0,0 +1,277 @@
+"""
+Планировщик исходящих сообщений бота для массовых рассылок (уведомления, дайджесты, объявления).
+
+Лимиты Telegram Bot API: не больше ~30 сообщений в секунду на бота, не больше
+одного сообщения в секунду в один чат и 20 сообщений в минуту в группу.
+Планировщик держит их сам, а не ловит 429:
+
+  - токен-бакеты: общий на бота и отдельный на каждый чат;
+  - классы приоритета: уведомления о ценах обгоняют дайджесты и объявления;
+  - пока чат ждёт своего токена, новые сообщения в него копятся и уходят
+    одним сообщением (до MAX_BATCH_MESSAGES и лимита длины текста);
+  - на 429 (RetryAfter) отправка приостанавливается на указанное сервером время,
+    на сетевые ошибки — повтор с экспоненциальной задержкой.
+
+Пример:
+    outbox = Outbox(application.bot.send_message)
+    application.create_task(outbox.run())
+    outbox.submit(chat_id, "текст", PRIORITY_ALERT)
+
+Проверка на локальном фейковом Bot API: python fake_bot_api.py --demo 2000
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from metrics import Counter
+
+logger = logging.getLogger("analyzer.outbox")
+
+PRIORITY_ALERT = 0
+PRIORITY_DIGEST = 1
+PRIORITY_BROADCAST = 2
+PRIORITY_NAMES = {PRIORITY_ALERT: "alert", PRIORITY_DIGEST: "digest", PRIORITY_BROADCAST: "broadcast"}
+
+# С запасом относительно лимитов Telegram: за любую секунду уходит не больше burst + rate сообщений
+GLOBAL_RATE = 25.0
+GLOBAL_BURST = 5
+CHAT_RATE = 0.9
+GROUP_RATE = 18 / 60
+MAX_BATCH_MESSAGES = 20
+MAX_TEXT_LENGTH = 4096
+MAX_IN_FLIGHT = 8
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+BATCH_SEPARATOR = "\n\n"
+
+SENT_TOTAL = Counter("bot_outbox_sent_total", "Сообщения, отправленные планировщиком", ["priority"])
+REQUESTS_TOTAL = Counter("bot_outbox_requests_total", "Запросы sendMessage (после склейки)", ["status"])
+DROPPED_TOTAL = Counter("bot_outbox_dropped_total", "Сообщения, которые не удалось доставить", ["reason"])
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        Сколько секунд ждать до появления целого токена.
+        """
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+def _seconds(value) -> float:
+    # RetryAfter.retry_after — int или timedelta в зависимости от версии python-telegram-bot
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class _Message:
+    __slots__ = ("priority", "seq", "text", "on_sent", "attempts")
+
+    def __init__(self, priority, seq, text, on_sent):
+        self.priority = priority
+        self.seq = seq
+        self.text = text
+        self.on_sent = on_sent
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Outbox:
+    def __init__(self, send, global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 chat_rate: float = CHAT_RATE, group_rate: float = GROUP_RATE, max_in_flight: int = MAX_IN_FLIGHT):
+        """
+        send — корутина send(chat_id=..., text=...), обычно bot.send_message.
+        """
+        self.send = send
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_buckets = {}
+        self.pending = {}      # chat_id -> список _Message
+        self.not_before = {}   # chat_id -> monotonic-время, раньше которого в чат не писать (бэкофф)
+        self.waiting = []      # куча (ready_at, seq, chat_id): чаты, ждущие своего токена
+        self.ready = []        # куча (priority, seq, chat_id): чаты, которым можно писать
+        self.ready_priority = {}  # chat_id -> приоритет актуальной записи в self.ready
+        self.scheduled = set()    # чаты в waiting/ready или с запросом в полёте
+        self.paused_until = 0.0
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.wakeup = asyncio.Event()
+        self.seq = itertools.count()
+        self.tasks = set()
+        self.size = 0  # сообщений в очереди; счётчик, чтобы метрики читали его из другого потока
+
+    def __len__(self):
+        return self.size
+
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_ALERT, on_sent=None) -> None:
+        """
+        Ставит сообщение в очередь. on_sent — необязательная корутина без аргументов,
+        вызывается после успешной отправки.
+        """
+        message = _Message(priority, next(self.seq), text, on_sent)
+        self.pending.setdefault(chat_id, []).append(message)
+        self.size += 1
+        if chat_id not in self.scheduled:
+            self._schedule(chat_id, time.monotonic())
+        elif chat_id in self.ready_priority and priority < self.ready_priority[chat_id]:
+            # Чат уже в очереди готовых с низким приоритетом — поднимаем (старая запись станет неактуальной)
+            self.ready_priority[chat_id] = priority
+            heapq.heappush(self.ready, (priority, message.seq, chat_id))
+        self.wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные id — группы и каналы, у них свой, более строгий лимит
+            bucket = TokenBucket(self.group_rate if chat_id < 0 else self.chat_rate)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _schedule(self, chat_id: int, now: float) -> None:
+        ready_at = max(now + self._chat_bucket(chat_id).delay(now), self.not_before.get(chat_id, 0.0))
+        self.scheduled.add(chat_id)
+        heapq.heappush(self.waiting, (ready_at, next(self.seq), chat_id))
+
+    def _promote(self, now: float) -> None:
+        while self.waiting and self.waiting[0][0] <= now:
+            _, seq, chat_id = heapq.heappop(self.waiting)
+            priority = min(message.priority for message in self.pending[chat_id])
+            self.ready_priority[chat_id] = priority
+            heapq.heappush(self.ready, (priority, seq, chat_id))
+
+    def _pop_ready(self):
+        while self.ready:
+            priority, _, chat_id = heapq.heappop(self.ready)
+            if self.ready_priority.get(chat_id) == priority:
+                del self.ready_priority[chat_id]
+                return chat_id
+        return None
+
+    def _take_batch(self, chat_id: int) -> list:
+        messages = sorted(self.pending.pop(chat_id))
+        batch = [messages[0]]
+        length = len(messages[0].text)
+        for message in messages[1:]:
+            length += len(BATCH_SEPARATOR) + len(message.text)
+            if len(batch) >= MAX_BATCH_MESSAGES or length > MAX_TEXT_LENGTH:
+                break
+            batch.append(message)
+        rest = messages[len(batch):]
+        if rest:
+            self.pending[chat_id] = rest
+        return batch
+
+    def _requeue(self, chat_id: int, batch: list) -> None:
+        self.pending[chat_id] = batch + self.pending.get(chat_id, [])
+
+    async def _sleep(self, timeout) -> None:
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self) -> None:
+        while True:
+            now = time.monotonic()
+            if self.paused_until > now:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._promote(now)
+            if not self.ready:
+                await self._sleep(self.waiting[0][0] - now if self.waiting else None)
+                continue
+            delay = self.global_bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            chat_id = self._pop_ready()
+            if chat_id is None:
+                continue
+            await self.slots.acquire()
+            now = time.monotonic()
+            self.global_bucket.take(now)
+            self._chat_bucket(chat_id).take(now)
+            task = asyncio.create_task(self._deliver(chat_id, self._take_batch(chat_id)))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _deliver(self, chat_id: int, batch: list) -> None:
+        try:
+            await self.send(chat_id=chat_id, text=BATCH_SEPARATOR.join(message.text for message in batch))
+        except RetryAfter as e:
+            # 429 относится ко всему боту: приостанавливаем отправку целиком
+            retry_after = _seconds(e.retry_after)
+            REQUESTS_TOTAL.inc(status="429")
+            logger.warning(f"429 от Bot API, пауза {retry_after:.0f} с", extra={"chat_id": chat_id})
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self._requeue(chat_id, batch)
+        except (Forbidden, BadRequest) as e:
+            # Пользователь заблокировал бота или запрос некорректен — повтор не поможет
+            REQUESTS_TOTAL.inc(status="rejected")
+            self.size -= len(batch)
+            DROPPED_TOTAL.inc(len(batch), reason=type(e).__name__)
+            logger.info(f"Сообщение в чат {chat_id} отброшено: {e}")
+        except (NetworkError, OSError, asyncio.TimeoutError) as e:
+            REQUESTS_TOTAL.inc(status="error")
+            retry = [message for message in batch if message.attempts < MAX_RETRIES]
+            for message in retry:
+                message.attempts += 1
+            if len(retry) < len(batch):
+                DROPPED_TOTAL.inc(len(batch) - len(retry), reason="retries")
+                self.size -= len(batch) - len(retry)
+            if retry:
+                attempts = max(message.attempts for message in retry)
+                backoff = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX) * random.uniform(1.0, 1.5)
+                self.not_before[chat_id] = time.monotonic() + backoff
+                self._requeue(chat_id, retry)
+            logger.warning(f"Ошибка отправки в чат {chat_id}: {e}")
+        else:
+            REQUESTS_TOTAL.inc(status="ok")
+            self.size -= len(batch)
+            self.not_before.pop(chat_id, None)
+            for message in batch:
+                SENT_TOTAL.inc(priority=PRIORITY_NAMES.get(message.priority, str(message.priority)))
+                if message.on_sent is not None:
+                    try:
+                        await message.on_sent()
+                    except Exception as e:
+                        logger.error(f"Ошибка в on_sent для чата {chat_id}: {e}")
+        finally:
+            self.slots.release()
+            self.scheduled.discard(chat_id)
+            if chat_id in self.pending:
+                self._schedule(chat_id, time.monotonic())
+            self.wakeup.set()
+
+    async def drain(self, timeout: float = None) -> bool:
+        """
+        Ждёт, пока очередь опустеет. True — всё отправлено (или отброшено).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending or self.tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
@@ -0,0 +1,197 @@
+"""
+Портфели пользователей: /portfolio add 3 Plush Pepe, 10 Lunar Snake.
+
+Позиции хранятся в users.db (таблица holdings). Оценка идёт по кэшу последних
+floor/average цен в памяти (FloorCache): один проход по prices при первом
+обращении, дальше дочитываются только строки с id больше последнего увиденного —
+и только после события changefeed.py о новых ценах (snifer.py, main.py).
+Оценка портфеля — O(число позиций) обращений к словарю, без запросов к prices.
+
+График стоимости строится по дневным свечам: prices_daily (свёрнутая история)
+плюс дневные закрытия из ещё не свёрнутых строк prices.
+"""
+import asyncio
+import re
+from datetime import datetime, timedelta
+
+from changefeed import RESET
+from retention import DATE_GLOB
+
+MAX_HOLDINGS = 50
+MAX_QUANTITY = 1_000_000
+CHART_DAYS = 30
+DAY_FORMAT = "%Y.%m.%d"
+
+HOLDINGS_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS holdings (
+        user_id INTEGER,
+        gift_name TEXT,
+        quantity INTEGER,
+        updated_at TEXT,
+        PRIMARY KEY (user_id, gift_name)
+    )
+    ''',
+)
+
+# "3 Plush Pepe", "3x Plush Pepe", "3× Plush Pepe", "Plush Pepe x3", "Plush Pepe"
+_QTY_FIRST = re.compile(r"^(\d+)(?:\s*[×xXх*]\s+|[×xXх*]\s*|\s+)(.+)$")
+_QTY_LAST = re.compile(r"^(.+?)\s+[×xXх*]?\s*(\d+)$")
+
+
+def parse_holdings(text: str, default_quantity: int = 1) -> list:
+    """
+    "3× Plush Pepe, 10 Lunar Snake" -> [("Plush Pepe", 3), ("Lunar Snake", 10)].
+    Позиция без числа получает default_quantity. Ошибка формата — ValueError.
+    """
+    items = []
+    for part in re.split(r"[,;\n]", text):
+        part = part.strip()
+        if not part:
+            continue
+        match = _QTY_FIRST.match(part)
+        if match:
+            quantity, name = int(match.group(1)), match.group(2)
+        else:
+            match = _QTY_LAST.match(part)
+            if match:
+                name, quantity = match.group(1), int(match.group(2))
+            else:
+                name, quantity = part, default_quantity
+        name = name.strip()
+        if not name or quantity > MAX_QUANTITY:
+            raise ValueError(part)
+        items.append((name, quantity))
+    return items
+
+
+class FloorCache:
+    """
+    Подарок -> (floor TON, average TON, дата) по самой поздней строке prices
+    (или prices_daily, если сырые строки уже свёрнуты retention.py).
+    """
+
+    def __init__(self):
+        self.prices = {}
+        self.max_id = 0
+        self.loaded = False
+        self.stale = False
+        self.lock = asyncio.Lock()
+
+    def on_change(self, table: str, gift_name, rowid: int) -> None:
+        """
+        Обработчик событий changefeed.py.
+        """
+        if table == RESET:
+            self.loaded = False
+        elif table == "prices" and rowid > self.max_id:
+            self.stale = True
+
+    def _update(self, gift_name: str, date: str, floor, average) -> None:
+        current = self.prices.get(gift_name)
+        if current is None or date >= current[2]:
+            self.prices[gift_name] = (floor, average, date)
+
+    async def refresh(self, db, not_suspicious: str = "AND suspicious = 0") -> None:
+        async with self.lock:
+            if self.loaded and not self.stale:
+                return
+            self.stale = False
+            if not self.loaded:
+                self.prices = {}
+                self.max_id = 0
+                async with db.execute("""
+                    SELECT gift_name, MAX(last_date), close_floor, close_average
+                    FROM prices_daily WHERE close_floor IS NOT NULL GROUP BY gift_name
+                """) as cursor:
+                    for gift_name, date, floor, average in await cursor.fetchall():
+                        self._update(gift_name, date, floor, average)
+            # Верхняя граница id фиксируется заранее: строки, вставленные во время чтения,
+            # достанутся следующему обновлению
+            async with db.execute("SELECT COALESCE(MAX(id), 0) FROM prices") as cursor:
+                (upper_id,) = await cursor.fetchone()
+            # При единственном MAX() SQLite берёт остальные столбцы из той же строки
+            async with db.execute(f"""
+                SELECT gift_name, MAX(date), floor_ton, average_ton
+                FROM prices
+                WHERE id > ? AND id <= ? AND floor_ton IS NOT NULL AND date GLOB ? {not_suspicious}
+                GROUP BY gift_name
+            """, (self.max_id, upper_id, DATE_GLOB)) as cursor:
+                rows = await cursor.fetchall()
+            for gift_name, date, floor, average in rows:
+                self._update(gift_name, date, floor, average)
+            self.max_id = max(self.max_id, upper_id)
+            self.loaded = True
+
+    def value(self, holdings: list) -> tuple:
+        """
+        holdings — [(подарок, количество)]. Возвращает ([(подарок, количество, floor, average,
+        стоимость по floor, дата)], итог по floor, итог по average); без цены — None.
+        """
+        lines = []
+        total_floor = total_average = 0.0
+        for gift_name, quantity in holdings:
+            floor, average, date = self.prices.get(gift_name, (None, None, None))
+            amount = quantity * floor if floor is not None else None
+            total_floor += amount or 0.0
+            # Если average нет, позиция оценивается по floor
+            total_average += quantity * (average if average is not None else floor or 0.0)
+            lines.append((gift_name, quantity, floor, average, amount, date))
+        return lines, total_floor, total_average
+
+
+async def ensure_schema_async(db) -> None:
+    for ddl in HOLDINGS_SCHEMA:
+        await db.execute(ddl)
+    await db.commit()
+
+
+async def load_holdings(db, user_id: int) -> list:
+    async with db.execute(
+        "SELECT gift_name, quantity FROM holdings WHERE user_id = ? ORDER BY gift_name", (user_id,)
+    ) as cursor:
+        return [tuple(row) for row in await cursor.fetchall()]
+
+
+async def load_daily_closes(db, gift_names: list, days: int = CHART_DAYS,
+                            not_suspicious: str = "AND suspicious = 0") -> dict:
+    """
+    {подарок: {день "YYYY.MM.DD": floor на закрытие}} за последние days дней:
+    свечи prices_daily и последняя строка дня из prices.
+    """
+    since = (datetime.now() - timedelta(days=days)).strftime(DAY_FORMAT)
+    marks = ", ".join("?" * len(gift_names))
+    closes = {name: {} for name in gift_names}
+    async with db.execute(f"""
+        SELECT gift_name, day, close_floor FROM prices_daily
+        WHERE gift_name IN ({marks}) AND day >= ? AND close_floor IS NOT NULL
+    """, (*gift_names, since)) as cursor:
+        for gift_name, day, close in await cursor.fetchall():
+            closes[gift_name][day] = close
+    async with db.execute(f"""
+        SELECT gift_name, substr(date, 1, 10) AS day, floor_ton, MAX(date)
+        FROM prices
+        WHERE gift_name IN ({marks}) AND date >= ? AND date GLOB ? AND floor_ton IS NOT NULL {not_suspicious}
+        GROUP BY gift_name, day
+    """, (*gift_names, since, DATE_GLOB)) as cursor:
+        for gift_name, day, close, _ in await cursor.fetchall():
+            closes[gift_name][day] = close
+    return closes
+
+
+def value_history(closes: dict, holdings: list) -> list:
+    """
+    [(день, стоимость)] при текущем составе портфеля. Пропущенные дни заполняются
+    последним известным закрытием; дни, когда цены ещё нет ни у одной позиции, пропускаются.
+    """
+    quantities = dict(holdings)
+    days = sorted({day for by_day in closes.values() for day in by_day})
+    last = {}
+    history = []
+    for day in days:
+        for gift_name, by_day in closes.items():
+            if day in by_day:
+                last[gift_name] = by_day[day]
+        if last:
+            history.append((day, sum(quantities.get(name, 0) * close for name, close in last.items())))
+    return history
@@ -0,0 +1,184 @@
+"""
+Профилирование отдельных обработчиков бота по запросу.
+
+Профилирование «взводится» на следующие N вызовов выбранного обработчика:
+  - через переменные окружения при запуске:
+        PROFILE_HANDLER=forecast_inline_otc PROFILE_COUNT=5 python analyzer_v2.py
+  - или админ-командой бота: /profile forecast_inline_otc 5
+
+Для каждого профилированного вызова в каталог PROFILE_DIR пишутся:
+  - <handler>-<время>.pstats — файл cProfile (открывается через pstats/snakeviz),
+  - <handler>-<время>.txt   — время по этапам (SQL, parse_date, RANSAC, ...) и топ функций.
+
+Пока ничего не взведено, обёртка сводится к проверке одного флага,
+а stage() возвращает общий пустой контекстный менеджер.
+"""
+import contextvars
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+TOP_FUNCTIONS = 30
+
+# handler -> сколько вызовов ещё нужно профилировать
+_armed = {}
+# Флаг быстрого пути: True, пока что-то взведено или идёт профилирование
+enabled = False
+_running = 0
+_current = contextvars.ContextVar("profile_session", default=None)
+
+
+class _Session:
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.stages = {}
+        self.order = []
+
+    def add(self, name: str, seconds: float) -> None:
+        if name not in self.stages:
+            self.stages[name] = 0.0
+            self.order.append(name)
+        self.stages[name] += seconds
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("session", "name", "start")
+
+    def __init__(self, session: _Session, name: str):
+        self.session = session
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.session.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(name: str):
+    """
+    Отмечает этап обработчика. Время одноимённых этапов суммируется
+    (например, parse_date для prices и для sales).
+    """
+    if not enabled:
+        return _NULL_STAGE
+    session = _current.get()
+    if session is None:
+        return _NULL_STAGE
+    return _Stage(session, name)
+
+
+def _update_enabled() -> None:
+    global enabled
+    enabled = bool(_armed) or _running > 0
+
+
+def arm(handler: str, count: int = 1) -> None:
+    if count <= 0:
+        disarm(handler)
+        return
+    _armed[handler] = count
+    _update_enabled()
+    logger.info(f"Profiling armed: {handler} x{count}")
+
+
+def disarm(handler: str = None) -> None:
+    if handler is None:
+        _armed.clear()
+    else:
+        _armed.pop(handler, None)
+    _update_enabled()
+
+
+def status() -> dict:
+    return dict(_armed)
+
+
+def arm_from_env() -> None:
+    handler = os.environ.get("PROFILE_HANDLER")
+    if handler:
+        arm(handler, int(os.environ.get("PROFILE_COUNT", "1")))
+
+
+def should_profile(handler: str) -> bool:
+    # Одновременно может работать только один cProfile, поэтому
+    # параллельные вызовы во время активной сессии не профилируются.
+    return enabled and _running == 0 and handler in _armed
+
+
+async def run(handler: str, func, *args, **kwargs):
+    """
+    Выполняет обработчик под cProfile и сохраняет результаты.
+    Вызывать только если should_profile(handler) вернул True.
+    """
+    global _running
+    remaining = _armed.get(handler, 0) - 1
+    if remaining > 0:
+        _armed[handler] = remaining
+    else:
+        _armed.pop(handler, None)
+    _running += 1
+    _update_enabled()
+
+    session = _Session(handler)
+    token = _current.set(session)
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        return await func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        total = time.perf_counter() - start
+        _current.reset(token)
+        _running -= 1
+        _update_enabled()
+        try:
+            _dump(session, profiler, total)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить профиль {handler}: {e}")
+
+
+def _dump(session: _Session, profiler: cProfile.Profile, total: float) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    base = os.path.join(PROFILE_DIR, f"{session.handler}-{stamp}")
+    profiler.dump_stats(base + ".pstats")
+
+    lines = [f"handler: {session.handler}", f"total: {total * 1000:.1f} ms", "", "stages:"]
+    accounted = 0.0
+    for name in session.order:
+        seconds = session.stages[name]
+        accounted += seconds
+        lines.append(f"  {name:<14} {seconds * 1000:10.1f} ms  {seconds / total * 100 if total else 0:5.1f}%")
+    lines.append(f"  {'(other)':<14} {(total - accounted) * 1000:10.1f} ms")
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    lines.extend(["", out.getvalue()])
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+    summary = ", ".join(f"{n}={session.stages[n] * 1000:.0f}ms" for n in session.order)
+    logger.info(f"Profile {session.handler}: total={total * 1000:.0f}ms {summary} -> {base}.pstats")
+    return base
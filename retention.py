@@ -0,0 +1,313 @@
+"""
+Политика хранения сырой истории floor-цен.
+
+Сырые строки prices хранятся за последние KEEP_DAYS дней. Более старые строки
+сворачиваются в дневные агрегаты по подарку (таблица prices_daily: число строк,
+сумма delta_ton, open/high/low/close и сумма квадратов floor_ton), после чего
+удаляются из prices. Затем выполняется incremental VACUUM.
+
+Сворачиваются только строки с датой в формате snifer.py ("2025.01.13 - 03:13:19") —
+именно их показывает analyzer_v2.py. Граница всегда проходит по началу суток,
+поэтому дни не разрезаются между prices и prices_daily.
+
+Запуск:
+    python retention.py --db gifts.db --keep-days 90
+"""
+import argparse
+import os
+import re
+import sqlite3
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import anomaly
+from changefeed import Publisher
+
+DB_FILE = "gifts.db"
+KEEP_DAYS = 90
+DATE_FORMAT = "%Y.%m.%d - %H:%M:%S"
+DATE_GLOB = "[0-9][0-9][0-9][0-9].[0-9][0-9].[0-9][0-9] - [0-9][0-9]:[0-9][0-9]:[0-9][0-9]"
+BENCH_REPEATS = 3
+# Сколько строк prices сворачивать в одной транзакции (см. compact)
+COMPACT_BATCH_ROWS = 5000
+_DATE_RE = re.compile(r"^\d{4}\.\d{2}\.\d{2} - \d{2}:\d{2}:\d{2}$")
+
+PRICES_DAILY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS prices_daily (
+        gift_name TEXT,
+        day TEXT,
+        row_count INTEGER,
+        delta_sum REAL,
+        delta_count INTEGER,
+        open_floor REAL,
+        high_floor REAL,
+        low_floor REAL,
+        close_floor REAL,
+        floor_sum REAL,
+        floor_sq_sum REAL,
+        floor_count INTEGER,
+        close_average REAL,
+        first_date TEXT,
+        last_date TEXT,
+        PRIMARY KEY (gift_name, day)
+    )
+'''
+
+RETENTION_STATE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS retention_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+'''
+
+# Слияние с уже существующим агрегатом дня (например, после повторного импорта старой истории)
+_UPSERT_DAILY = '''
+    INSERT INTO prices_daily (
+        gift_name, day, row_count, delta_sum, delta_count,
+        open_floor, high_floor, low_floor, close_floor,
+        floor_sum, floor_sq_sum, floor_count, close_average, first_date, last_date
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (gift_name, day) DO UPDATE SET
+        row_count = row_count + excluded.row_count,
+        delta_sum = delta_sum + excluded.delta_sum,
+        delta_count = delta_count + excluded.delta_count,
+        open_floor = CASE WHEN excluded.first_date < first_date THEN excluded.open_floor ELSE open_floor END,
+        high_floor = MAX(COALESCE(high_floor, excluded.high_floor), COALESCE(excluded.high_floor, high_floor)),
+        low_floor = MIN(COALESCE(low_floor, excluded.low_floor), COALESCE(excluded.low_floor, low_floor)),
+        close_floor = CASE WHEN excluded.last_date > last_date THEN excluded.close_floor ELSE close_floor END,
+        close_average = CASE WHEN excluded.last_date > last_date THEN excluded.close_average ELSE close_average END,
+        floor_sum = floor_sum + excluded.floor_sum,
+        floor_sq_sum = floor_sq_sum + excluded.floor_sq_sum,
+        floor_count = floor_count + excluded.floor_count,
+        first_date = MIN(first_date, excluded.first_date),
+        last_date = MAX(last_date, excluded.last_date)
+'''
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.execute(PRICES_DAILY_SCHEMA)
+    conn.execute(RETENTION_STATE_SCHEMA)
+    anomaly.ensure_schema(conn)
+
+
+def get_cutoff(conn: sqlite3.Connection):
+    """
+    Граница уже свёрнутой истории: строки prices с датой раньше неё хранятся только в prices_daily.
+    Используется импортом, чтобы не возвращать в prices уже свёрнутые строки.
+    """
+    try:
+        row = conn.execute("SELECT value FROM retention_state WHERE key = 'prices_cutoff'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+async def get_cutoff_async(db):
+    """
+    get_cutoff для соединения aiosqlite (snifer.py).
+    """
+    try:
+        async with db.execute("SELECT value FROM retention_state WHERE key = 'prices_cutoff'") as cursor:
+            row = await cursor.fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def is_compacted(date: str, cutoff) -> bool:
+    """
+    True, если строка prices с такой датой уже свёрнута в prices_daily.
+    """
+    return bool(cutoff and date and _DATE_RE.match(date) and date < cutoff)
+
+
+class _DayAggregate:
+    def __init__(self, gift_name, day):
+        self.gift_name = gift_name
+        self.day = day
+        self.row_count = 0
+        self.delta_sum = 0.0
+        self.delta_count = 0
+        self.open_floor = self.high_floor = self.low_floor = self.close_floor = None
+        self.floor_sum = 0.0
+        self.floor_sq_sum = 0.0
+        self.floor_count = 0
+        self.close_average = None
+        self.first_date = None
+        self.last_date = None
+
+    def add(self, date, delta_ton, floor_ton, average_ton):
+        self.row_count += 1
+        if self.first_date is None:
+            self.first_date = date
+        self.last_date = date
+        if delta_ton is not None:
+            self.delta_sum += delta_ton
+            self.delta_count += 1
+        if floor_ton is not None:
+            if self.open_floor is None:
+                self.open_floor = floor_ton
+            self.close_floor = floor_ton
+            self.high_floor = floor_ton if self.high_floor is None else max(self.high_floor, floor_ton)
+            self.low_floor = floor_ton if self.low_floor is None else min(self.low_floor, floor_ton)
+            self.floor_sum += floor_ton
+            self.floor_sq_sum += floor_ton * floor_ton
+            self.floor_count += 1
+        if average_ton is not None:
+            self.close_average = average_ton
+
+    def as_row(self):
+        return (
+            self.gift_name, self.day, self.row_count, self.delta_sum, self.delta_count,
+            self.open_floor, self.high_floor, self.low_floor, self.close_floor,
+            self.floor_sum, self.floor_sq_sum, self.floor_count, self.close_average,
+            self.first_date, self.last_date,
+        )
+
+
+def compact(conn: sqlite3.Connection, cutoff: str, batch_rows: int = COMPACT_BATCH_ROWS) -> int:
+    """
+    Сворачивает строки prices с датой < cutoff в prices_daily и удаляет их.
+    Транзакции — по целым дням подарка, не больше batch_rows строк (кроме одного
+    очень большого дня): snifer.py и main.py пишут в ту же базу, и долгая блокировка
+    записи сорвала бы их пачки. Каждый день лежит либо в prices, либо в prices_daily,
+    поэтому прерванный запуск оставляет согласованную базу, а повторный доделывает остальное.
+    """
+    ensure_schema(conn)
+    # Граница пишется первой: пока идёт свёртка, импорт уже не вернёт в prices строки старше неё
+    with conn:
+        previous = get_cutoff(conn)
+        if previous is None or cutoff > previous:
+            conn.execute(
+                "INSERT OR REPLACE INTO retention_state (key, value) VALUES ('prices_cutoff', ?)", (cutoff,)
+            )
+    gift_names = [name for (name,) in conn.execute(
+        "SELECT DISTINCT gift_name FROM prices WHERE date < ? AND date GLOB ?", (cutoff, DATE_GLOB)
+    )]
+
+    compacted = 0
+    for gift_name in gift_names:
+        rows = conn.execute('''
+            SELECT id, date, delta_ton, floor_ton, average_ton, suspicious
+            FROM prices
+            WHERE gift_name = ? AND date < ? AND date GLOB ?
+            ORDER BY date, id
+        ''', (gift_name, cutoff, DATE_GLOB)).fetchall()
+        days = []
+        ids = []
+        for row_id, date, delta_ton, floor_ton, average_ton, suspicious in rows:
+            day = date[:10]
+            if suspicious:
+                # Выбросы (anomaly.py) не попадают в агрегаты, как и в статистику анализатора
+                delta_ton = floor_ton = average_ton = None
+            if not days or days[-1].day != day:
+                if len(ids) >= batch_rows:
+                    compacted += _write_days(conn, days, ids)
+                    days, ids = [], []
+                days.append(_DayAggregate(gift_name, day))
+            days[-1].add(date, delta_ton, floor_ton, average_ton)
+            ids.append((row_id,))
+        if ids:
+            compacted += _write_days(conn, days, ids)
+    return compacted
+
+
+def _write_days(conn: sqlite3.Connection, days: list, ids: list) -> int:
+    with conn:
+        conn.executemany(_UPSERT_DAILY, [day.as_row() for day in days])
+        conn.executemany("DELETE FROM prices WHERE id = ?", ids)
+    return len(ids)
+
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int = None) -> None:
+    """
+    Возвращает свободные страницы ОС. При первом запуске переводит базу в режим
+    auto_vacuum=INCREMENTAL (для этого один раз нужен полный VACUUM).
+    """
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return
+    # executescript, а не execute: прагма освобождает по странице за шаг,
+    # и только sqlite3_exec выполняет её до конца
+    if pages:
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    else:
+        conn.executescript("PRAGMA incremental_vacuum;")
+
+
+def db_size(conn: sqlite3.Connection, db_file: str) -> dict:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        "file_bytes": os.path.getsize(db_file),
+        "used_bytes": (page_count - freelist) * page_size,
+        "free_bytes": freelist * page_size,
+        "prices_rows": conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0],
+    }
+
+
+def bench_queries(conn: sqlite3.Connection) -> float:
+    """
+    Медианное время (мс) запросов, которые analyzer_v2.py выполняет для одного подарка.
+    """
+    gifts = [r[0] for r in conn.execute("SELECT DISTINCT gift_name FROM prices")]
+    if not gifts:
+        return 0.0
+    timings = []
+    for _ in range(BENCH_REPEATS):
+        for gift_name in gifts:
+            start = time.perf_counter()
+            conn.execute("SELECT delta_ton FROM prices WHERE gift_name = ? ORDER BY date ASC", (gift_name,)).fetchall()
+            conn.execute('''
+                SELECT date, floor_ton FROM prices
+                WHERE gift_name = ? AND floor_ton IS NOT NULL ORDER BY date ASC
+            ''', (gift_name,)).fetchall()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def _report(title: str, size: dict, latency_ms: float) -> None:
+    print(f"{title}:")
+    print(f"  Размер файла: {size['file_bytes'] / 1024 / 1024:.2f} МБ "
+          f"(занято {size['used_bytes'] / 1024 / 1024:.2f} МБ, свободно {size['free_bytes'] / 1024 / 1024:.2f} МБ)")
+    print(f"  Строк в prices: {size['prices_rows']}")
+    print(f"  Медиана запросов анализатора на подарок: {latency_ms:.2f} мс")
+
+
+def run(db_file: str = DB_FILE, keep_days: int = KEEP_DAYS, vacuum_pages: int = None) -> int:
+    conn = sqlite3.connect(db_file, timeout=30)
+    try:
+        ensure_schema(conn)
+        conn.commit()
+        _report("До", db_size(conn, db_file), bench_queries(conn))
+
+        # Граница — начало суток, чтобы день не оказался разрезан
+        cutoff_day = (datetime.now() - timedelta(days=keep_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff = cutoff_day.strftime(DATE_FORMAT)
+        compacted = compact(conn, cutoff)
+        print(f"Свёрнуто строк старше {cutoff}: {compacted}")
+        if compacted:
+            # Строки удалены из prices — анализатор должен сбросить закэшированные ряды
+            changes = Publisher()
+            changes.reset()
+            changes.flush()
+
+        incremental_vacuum(conn, vacuum_pages)
+        _report("После", db_size(conn, db_file), bench_queries(conn))
+        return compacted
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Свёртка старой истории prices в дневные агрегаты")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--keep-days", type=int, default=KEEP_DAYS, help="сколько дней хранить сырые строки")
+    parser.add_argument("--vacuum-pages", type=int, default=None, help="лимит страниц для incremental_vacuum")
+    args = parser.parse_args()
+    run(args.db, args.keep_days, args.vacuum_pages)
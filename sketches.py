@@ -0,0 +1,245 @@
+"""
+Сливаемые квантильные скетчи цен продаж по подаркам (в стиле DDSketch).
+
+Цена попадает в логарифмическую корзину: индекс ceil(log(x) / log(gamma)),
+gamma = (1 + a) / (1 - a). Любой перцентиль восстанавливается с относительной
+ошибкой не больше a (RELATIVE_ACCURACY = 1%), а два скетча сливаются простым
+сложением счётчиков корзин — результат тот же, что у скетча по объединённым данным.
+Число корзин ограничено: диапазон цен 0.01–10^6 TON — около 900 корзин.
+
+Скетчи хранятся по часам в таблице sale_sketches и обновляются при инжесте
+(snifer.py, main.py). Перцентили за любое окно — слияние часовых скетчей,
+сырые строки sales не читаются.
+
+Пересчёт из истории:
+    python sketches.py --db gifts.db --rebuild
+"""
+import argparse
+import math
+import re
+import sqlite3
+import struct
+from datetime import datetime, timedelta
+
+import anomaly
+from anomaly import base_gift_name
+from retention import DATE_GLOB
+
+DB_FILE = "gifts.db"
+RELATIVE_ACCURACY = 0.01
+MAX_BINS = 2048
+HOUR_FORMAT = "%Y.%m.%d - %H"
+_DATE_RE = re.compile(r"^\d{4}\.\d{2}\.\d{2} - \d{2}:\d{2}:\d{2}$")
+_HEADER = struct.Struct("<BQQdddI")
+_VERSION = 1
+
+SALE_SKETCHES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sale_sketches (
+        gift_name TEXT,
+        hour TEXT,
+        count INTEGER,
+        sketch BLOB,
+        PRIMARY KEY (gift_name, hour)
+    )
+'''
+
+_UPSERT = "INSERT OR REPLACE INTO sale_sketches (gift_name, hour, count, sketch) VALUES (?, ?, ?, ?)"
+
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}  # индекс корзины -> число значений
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.0
+
+    def add(self, value: float, weight: int = 1) -> None:
+        if value is None:
+            return
+        if value <= 0:
+            self.zero_count += weight
+        else:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + weight
+            if len(self.bins) > MAX_BINS:
+                self._collapse()
+        self.count += weight
+        self.sum += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self) -> None:
+        # Сливаем самые дешёвые корзины: точность страдает только в нижнем хвосте
+        indexes = sorted(self.bins)
+        extra = len(indexes) - MAX_BINS
+        target = indexes[extra]
+        for index in indexes[:extra]:
+            self.bins[target] += self.bins.pop(index)
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        for index, n in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + n
+        if len(self.bins) > MAX_BINS:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return max(self.min, 0.0)
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def to_bytes(self) -> bytes:
+        indexes = sorted(self.bins)
+        n = len(indexes)
+        return (_HEADER.pack(_VERSION, self.count, self.zero_count, self.min, self.max, self.sum, n)
+                + struct.pack(f"<{n}i{n}Q", *indexes, *(self.bins[i] for i in indexes)))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "QuantileSketch":
+        sketch = cls()
+        version, sketch.count, sketch.zero_count, sketch.min, sketch.max, sketch.sum, n = _HEADER.unpack_from(data)
+        values = struct.unpack_from(f"<{n}i{n}Q", data, _HEADER.size)
+        sketch.bins = dict(zip(values[:n], values[n:]))
+        return sketch
+
+
+def hour_key(date: str):
+    """
+    "2025.01.13 - 03:13:19" -> "2025.01.13 - 03"; для дат в другом формате — None.
+    """
+    if not date or not _DATE_RE.match(date):
+        return None
+    return date[:15]
+
+
+class SketchWriter:
+    """
+    Копит продажи в памяти и дописывает их в часовые скетчи в той же транзакции,
+    что и строки sales (flush/flush_async вызываются перед commit).
+    """
+
+    def __init__(self):
+        self.pending = {}  # (подарок, час) -> QuantileSketch
+
+    def add(self, gift_name: str, date: str, price_ton) -> None:
+        hour = hour_key(date)
+        if hour is None or price_ton is None:
+            return
+        key = (base_gift_name(gift_name), hour)
+        sketch = self.pending.get(key)
+        if sketch is None:
+            sketch = self.pending[key] = QuantileSketch()
+        sketch.add(price_ton)
+
+    def _merged_rows(self, existing: dict) -> list:
+        rows = []
+        for (gift_name, hour), sketch in self.pending.items():
+            blob = existing.get((gift_name, hour))
+            if blob is not None:
+                sketch = QuantileSketch.from_bytes(blob).merge(sketch)
+            rows.append((gift_name, hour, sketch.count, sketch.to_bytes()))
+        self.pending.clear()
+        return rows
+
+    def flush(self, conn: sqlite3.Connection) -> None:
+        existing = {}
+        for gift_name, hour in self.pending:
+            row = conn.execute("SELECT sketch FROM sale_sketches WHERE gift_name = ? AND hour = ?",
+                               (gift_name, hour)).fetchone()
+            if row:
+                existing[(gift_name, hour)] = row[0]
+        conn.executemany(_UPSERT, self._merged_rows(existing))
+
+    async def flush_async(self, db) -> None:
+        existing = {}
+        for gift_name, hour in self.pending:
+            async with db.execute("SELECT sketch FROM sale_sketches WHERE gift_name = ? AND hour = ?",
+                                  (gift_name, hour)) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                existing[(gift_name, hour)] = row[0]
+        await db.executemany(_UPSERT, self._merged_rows(existing))
+
+
+def window_start(days: int, now: datetime = None) -> str:
+    return ((now or datetime.now()) - timedelta(days=days)).strftime(HOUR_FORMAT)
+
+
+async def load_windows(db, gift_name: str, windows: dict) -> dict:
+    """
+    Скетчи за несколько окон одним запросом: windows = {"7 дней": 7, "Всё время": None}.
+    Возвращает {название: QuantileSketch}.
+    """
+    starts = {title: window_start(days) if days else "" for title, days in windows.items()}
+    merged = {title: QuantileSketch() for title in windows}
+    async with db.execute(
+        "SELECT hour, sketch FROM sale_sketches WHERE gift_name = ? AND hour >= ?",
+        (base_gift_name(gift_name), min(starts.values()))
+    ) as cursor:
+        rows = await cursor.fetchall()
+    for hour, blob in rows:
+        sketch = QuantileSketch.from_bytes(blob)
+        for title, start in starts.items():
+            if hour >= start:
+                merged[title].merge(sketch)
+    return merged
+
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    """
+    Пересчитывает sale_sketches по всей таблице sales (без строк, помеченных anomaly.py).
+    """
+    anomaly.ensure_schema(conn)
+    conn.execute(SALE_SKETCHES_SCHEMA)
+    writer = SketchWriter()
+    rows = conn.execute(
+        "SELECT gift_name, date, price_ton FROM sales WHERE price_ton IS NOT NULL AND suspicious = 0 AND date GLOB ?",
+        (DATE_GLOB,)
+    )
+    n = 0
+    for gift_name, date, price_ton in rows:
+        writer.add(gift_name, date, price_ton)
+        n += 1
+    with conn:
+        conn.execute("DELETE FROM sale_sketches")
+        conn.executemany(_UPSERT, writer._merged_rows({}))
+    return n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Часовые квантильные скетчи цен продаж")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--rebuild", action="store_true", help="пересчитать скетчи по всей таблице sales")
+    args = parser.parse_args()
+    if args.rebuild:
+        conn = sqlite3.connect(args.db, timeout=30)
+        try:
+            total = rebuild(conn)
+            hours = conn.execute("SELECT COUNT(*) FROM sale_sketches").fetchone()[0]
+            print(f"Продаж: {total}, часовых скетчей: {hours}")
+        finally:
+            conn.close()
+    else:
+        parser.print_help()
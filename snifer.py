@@ -1,294 +1,903 @@
-import asyncio
-import re
-from telethon import TelegramClient, events
-import aiosqlite
-
-# ----------------------- Настройки Telethon -----------------------
-# Замените на свои данные:
-api_id =         # например, 123456
-api_hash = ""   # например, "abcdef123456..."
-session_name = "my_session"  # имя файла сессии
-
-# Имена чатов/каналов (username или ID) для подписки
-SALES_CHANNEL = "GiftNotification"           # группа/канал о продажах
-FLOOR_CHANNEL = "GiftChangesFloorPrices"       # канал с обновлениями цен подарков
-
-# ----------------------- Функция форматирования даты -----------------------
-def format_date(dt):
-    """
-    Форматирует объект datetime в строку вида: 2025.01.13 - 03:13:19
-    """
-    return dt.strftime("%Y.%m.%d - %H:%M:%S") if dt else ""
-
-# ----------------------- Инициализация БД -----------------------
-DB_FILE = 'gifts.db'
-db = None  # Глобальная переменная для подключения к БД
-
-
-import re
-
-def remove_markdown(text: str) -> str:
-    """
-    Убираем часть Markdown-разметки:
-      - двойные звёздочки **...**
-      - двойные подчёркивания __...__
-      - а также [текст](ссылка) превращаем в просто текст
-    """
-    # 1) Заменяем **...** на просто ...
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    # 2) Заменяем __...__ на просто ...
-    text = re.sub(r'__(.*?)__', r'\1', text)
-    # 3) Заменяем [текст](ссылка) на просто текст
-    text = re.sub(r'\[(.*?)\]\(https?:\/\/[^\)]+\)', r'\1', text)
-    return text
-
-
-async def init_db():
-    global db
-    db = await aiosqlite.connect(DB_FILE)
-    await db.execute('''
-        CREATE TABLE IF NOT EXISTS gifts (
-            id INTEGER PRIMARY KEY,
-            name TEXT UNIQUE,
-            total_count INTEGER,
-            base_star_cost REAL
-        )
-    ''')
-    await db.execute('''
-        CREATE TABLE IF NOT EXISTS prices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            gift_name TEXT,
-            date TEXT,
-            delta_ton REAL,
-            floor_ton REAL,
-            floor_usd REAL,
-            floor_star REAL,
-            floor_rub REAL,
-            average_ton REAL,
-            average_usd REAL,
-            average_star REAL,
-            average_rub REAL
-        )
-    ''')
-    await db.execute('''
-        CREATE TABLE IF NOT EXISTS sales (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            message_id INTEGER UNIQUE,
-            gift_name TEXT,
-            price_ton REAL,
-            date TEXT
-        )
-    ''')
-    await db.commit()
-    print("База данных и таблицы инициализированы.")
-
-# ----------------------- Функции парсинга -----------------------
-def parse_sale_message(message):
-    """
-    Парсит сообщение о продаже подарка.
-    Ожидаемый формат:
-    
-    Gift Sold 
-    
-    Vintage Cigar #17369 (https://t.me/nft/VintageCigar-1476)
-    
-    Price: 5.5 TON
-    """
-    text = message.text
-    if not text:
-        return None
-    # Разбиваем сообщение на строки и отбрасываем пустые
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    if not lines or "Gift Sold" not in lines[0]:
-        return None
-    if len(lines) < 3:
-        return None
-
-    # Извлекаем название подарка из второй строки
-    gift_line = lines[1]
-    m = re.match(r"(.+?)\s*\(", gift_line)
-    gift_name = m.group(1).strip() if m else gift_line.strip()
-
-    # Ищем строку с ценой
-    price_ton = None
-    for line in lines:
-        if "Price:" in line:
-            m_price = re.search(r"Price:\s*([-+]?\d*[\.,]?\d+)", line)
-            if m_price:
-                try:
-                    price_ton = float(m_price.group(1).replace(",", "."))
-                except ValueError:
-                    price_ton = None
-                break
-
-    if price_ton is None:
-        return None
-
-    return {
-        "message_id": message.id,
-        "gift_name": gift_name,
-        "price_ton": price_ton,
-        "date": format_date(message.date)
-    }
-
-def parse_floor_message(message):
-    raw_text = message.text
-    if not raw_text:
-        return None
-
-    # Сначала убираем часть markdown
-    text = remove_markdown(raw_text)
-
-    # Теперь text выглядит примерно так:
-    # "Flying Broom +0.01 TON 📈
-    #   Floor Tonnel: 0,69 TON ≈ 2,58 USD ≈ 172 ⭐️ ≈ 235 ₽
-    #   ...
-    #   Average Tonnel: 0,71 TON ≈ 2,64 USD ≈ 176 ⭐️ ≈ 241 ₽"
-
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    if not lines:
-        return None
-
-    # --- 1) Парсим первую строку вида: "Flying Broom +0.01 TON"
-    #     (раньше у нас было "Flying Broom (https://...)", теперь ссылки нет)
-    first_line = lines[0]
-    # Можно адаптировать регулярку под "Название +0.01 TON":
-    m = re.match(r'^(.+?)\s+([-+]?\d*[.,]?\d+)\s*TON', first_line)
-    if not m:
-        return None
-
-    gift_name = m.group(1).strip()
-    delta_str = m.group(2).replace(',', '.')
-    try:
-        delta_ton = float(delta_str)
-    except ValueError:
-        return None
-
-    # --- 2) Ищем строки Floor Tonnel: ... и Average Tonnel: ...
-    floor_ton = floor_usd = floor_star = floor_rub = None
-    average_ton = average_usd = average_star = average_rub = None
-
-    # Пример шаблона для "X TON ≈ Y USD ≈ Z ⭐️ ≈ W ₽"
-    pattern_tonnel = r'([-+]?\d*[.,]?\d+)\s*TON\s*≈\s*([-+]?\d*[.,]?\d+)\s*USD\s*≈\s*([-+]?\d*[.,]?\d+)\s*\S*\s*≈\s*([-+]?\d*[.,]?\d+)'
-
-    for line in lines[1:]:
-        if line.startswith("Floor Tonnel"):
-            m_floor = re.search(pattern_tonnel, line)
-            if m_floor:
-                floor_ton  = float(m_floor.group(1).replace(',', '.').replace(' ', ''))
-                floor_usd  = float(m_floor.group(2).replace(',', '.').replace(' ', ''))
-                floor_star = float(m_floor.group(3).replace(',', '.').replace(' ', ''))
-                floor_rub  = float(m_floor.group(4).replace(',', '.').replace(' ', ''))
-
-        elif line.startswith("Average Tonnel"):
-            m_avg = re.search(pattern_tonnel, line)
-            if m_avg:
-                average_ton  = float(m_avg.group(1).replace(',', '.').replace(' ', ''))
-                average_usd  = float(m_avg.group(2).replace(',', '.').replace(' ', ''))
-                average_star = float(m_avg.group(3).replace(',', '.').replace(' ', ''))
-                average_rub  = float(m_avg.group(4).replace(',', '.').replace(' ', ''))
-
-    return {
-        "gift_name": gift_name,
-        "delta_ton": delta_ton,
-        "floor_ton": floor_ton,
-        "floor_usd": floor_usd,
-        "floor_star": floor_star,
-        "floor_rub": floor_rub,
-        "average_ton": average_ton,
-        "average_usd": average_usd,
-        "average_star": average_star,
-        "average_rub": average_rub,
-        "date": format_date(message.date),
-    }
-
-
-# ----------------------- Функции работы с БД -----------------------
-async def insert_gift(gift_name):
-    if gift_name and gift_name.strip():
-        try:
-            await db.execute("INSERT OR IGNORE INTO gifts (name) VALUES (?)", (gift_name.strip(),))
-            await db.commit()
-        except Exception as e:
-            print(f"Ошибка при вставке подарка '{gift_name}': {e}")
-
-async def insert_price_data(data):
-    async with db.execute("SELECT id FROM prices WHERE gift_name = ? AND date = ?", (data["gift_name"], data["date"])) as cursor:
-        row = await cursor.fetchone()
-        if row is not None:
-            print(f"Данные для подарка '{data['gift_name']}' с датой {data['date']} уже существуют. Пропускаем вставку.")
-            return
-
-    await db.execute('''
-        INSERT INTO prices (
-            gift_name, date, delta_ton, floor_ton, floor_usd,
-            floor_star, floor_rub, average_ton, average_usd, average_star, average_rub
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        data["gift_name"],
-        data["date"],
-        data["delta_ton"],
-        data["floor_ton"],
-        data["floor_usd"],
-        data["floor_star"],
-        data["floor_rub"],
-        data["average_ton"],
-        data["average_usd"],
-        data["average_star"],
-        data["average_rub"]
-    ))
-    await db.commit()
-
-async def insert_sale_data(data):
-    async with db.execute("SELECT id FROM sales WHERE message_id = ?", (data["message_id"],)) as cursor:
-        row = await cursor.fetchone()
-        if row is not None:
-            print(f"Запись с message_id {data['message_id']} уже существует. Пропускаем.")
-            return
-
-    await db.execute('''
-        INSERT INTO sales (message_id, gift_name, price_ton, date)
-        VALUES (?, ?, ?, ?)
-    ''', (data["message_id"], data["gift_name"], data["price_ton"], data["date"]))
-    await db.commit()
-
-# ----------------------- Основная логика с Telethon -----------------------
-async def main():
-    # Инициализируем базу данных
-    await init_db()
-
-    # Создаём клиент Telethon и подключаемся
-    client = TelegramClient(session_name, api_id, api_hash)
-    await client.start()
-    print("Телеграм-клиент запущен. Ожидаем новые сообщения...")
-
-    # Обработчик сообщений о продажах
-    @client.on(events.NewMessage(chats=SALES_CHANNEL))
-    async def handler_sales(event):
-        sale_data = parse_sale_message(event.message)
-        if sale_data:
-            print(f"Обрабатывается продажа подарка: {sale_data['gift_name']} по цене: {sale_data['price_ton']} TON")
-            await insert_sale_data(sale_data)
-
-    # Обработчик сообщений с обновлением цен (Gift Floor Prices)
-    @client.on(events.NewMessage(chats=FLOOR_CHANNEL))
-    async def handler_floor(event):
-        # Смотрим сырое сообщение
-        print("New floor message:", event.message.text)
-
-        floor_data = parse_floor_message(event.message)
-        if floor_data:
-            print(f"Обновление цены: {floor_data}")
-            # Допустим, записываем в БД
-            await insert_gift(floor_data["gift_name"])
-            await insert_price_data(floor_data)
-        else:
-            print("Сообщение не распознано парсером.")
-
-
-    # Запускаем клиент до отключения
-    await client.run_until_disconnected()
-
-if __name__ == '__main__':
-    asyncio.run(main())
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from telethon import TelegramClient, events
+import aiosqlite
+
+import alerts
+import archive
+import channels
+import gift_stats
+import spreads
+from anomaly import base_gift_name, ensure_schema_async, load_detector_async
+from changefeed import Publisher
+from compact import ensure_index_async
+from dedupe import load_seen_async, refresh_seen_async
+from log_setup import setup_logging
+from retention import PRICES_DAILY_SCHEMA, get_cutoff_async, is_compacted
+from sketches import SALE_SKETCHES_SCHEMA, SketchWriter
+from metrics import Counter, Gauge, Histogram, LAG_BUCKETS, is_locked_error, start_http_server
+
+logger = logging.getLogger("snifer")
+log_db = logging.getLogger("snifer.db")
+log_sales = logging.getLogger("snifer.sales")
+log_floor = logging.getLogger("snifer.floor")
+# Полный сырой текст floor-сообщений — только на уровне DEBUG
+log_floor_raw = logging.getLogger("snifer.floor.raw")
+
+# ----------------------- Настройки Telethon -----------------------
+# Замените на свои данные:
+api_id =         # например, 123456
+api_hash = ""   # например, "abcdef123456..."
+session_name = "my_session"  # имя файла сессии
+
+# Каналы (username или ID) и типы их парсеров — channels.json, см. channels.py
+CHANNELS_FILE = channels.CHANNELS_FILE
+
+# ----------------------- Метрики -----------------------
+# Локальный эндпоинт Prometheus: http://127.0.0.1:9101/metrics (None — отключить)
+METRICS_PORT = 9101
+# Читатели групп каналов (--reader) отдают свои метрики на 9111, 9112, ... по порядку групп
+READER_METRICS_PORT = 9111
+
+MESSAGES_TOTAL = Counter("snifer_messages_total", "Сообщения из каналов по результату обработки", ["channel", "status"])
+HANDLER_SECONDS = Histogram("snifer_handler_seconds", "Время обработки одного сообщения", ["handler"])
+INGEST_LAG_SECONDS = Histogram("snifer_ingest_lag_seconds", "Задержка между датой сообщения и вставкой в БД", ["channel"], buckets=LAG_BUCKETS)
+DB_QUERY_SECONDS = Histogram("snifer_db_query_seconds", "Время запросов к gifts.db", ["query"])
+DB_COMMIT_SECONDS = Histogram("snifer_db_commit_seconds", "Время commit в gifts.db")
+DB_LOCKED_TOTAL = Counter("snifer_db_locked_total", "Ошибки 'database is locked'", ["operation"])
+SUSPICIOUS_TOTAL = Counter("snifer_suspicious_total", "Строки, помеченные детектором выбросов", ["table"])
+ALERTS_FIRED_TOTAL = Counter("snifer_alerts_fired_total", "Сработавшие подписки на цену", ["source"])
+WRITE_QUEUE_DEPTH = Gauge("snifer_write_queue_depth", "Разобранные сообщения, ожидающие записи в БД")
+SPREADS_TOTAL = Counter("snifer_sale_spreads_total", "Продажи, сравнённые с текущим floor", ["direction"])
+ARCHIVE_ERRORS_TOTAL = Counter("snifer_archive_errors_total", "Ошибки записи в архив сырых сообщений")
+CHANNEL_LAST_MESSAGE = Gauge("snifer_channel_last_message_timestamp", "Время получения последнего сообщения канала (unix)", ["channel"])
+READER_RESTARTS_TOTAL = Counter("snifer_reader_restarts_total", "Перезапуски процессов-читателей групп каналов", ["group"])
+
+# ----------------------- Запись пачками -----------------------
+# Обработчики каналов только разбирают сообщения и ставят их в очередь; один писатель
+# забирает всё, что накопилось, и пишет пачку одной транзакцией с одним commit.
+WRITE_BATCH_SIZE = 500
+WRITE_QUEUE_SIZE = 10000
+READER_RESTART_SECONDS = 5
+
+# ----------------------- Функция форматирования даты -----------------------
+def format_date(dt):
+    """
+    Форматирует объект datetime в строку вида: 2025.01.13 - 03:13:19
+    """
+    return dt.strftime("%Y.%m.%d - %H:%M:%S") if dt else ""
+
+# ----------------------- Инициализация БД -----------------------
+DB_FILE = 'gifts.db'
+db = None  # Глобальная переменная для подключения к БД
+seen = None  # Фильтр уже записанных продаж и floor-цен (dedupe.py)
+known_gifts = set()  # Подарки, уже записанные в таблицу gifts
+prices_cutoff = None  # Граница свёрнутой истории retention.py: более старые floor-строки уже в prices_daily
+detector = None  # Потоковый детектор выбросов (anomaly.py)
+alert_db = None  # users.db бота: подписки на цены и очередь уведомлений
+alert_index = alerts.AlertIndex()
+changes = Publisher()  # уведомления analyzer_v2.py о новых строках (changefeed.py)
+sale_sketches = SketchWriter()  # часовые квантильные скетчи цен продаж (sketches.py)
+spread_tracker = spreads.SpreadTracker()  # последний floor по подаркам для спредов продаж (spreads.py)
+gift_summary = gift_stats.GiftStatsWriter()  # сводка по подаркам для /gift (gift_stats.py)
+raw_archive = None  # архив сырых сообщений (archive.py)
+write_queue = None  # (канал, данные, сообщение) для writer_loop
+reader_out = None  # процесс-читатель (--reader): сюда уходят разобранные сообщения для писателя
+# Канал -> тип парсера и группа -> каналы (channels.py); configure() загружает channels.json
+channel_parsers = {channel["name"]: channel["parser"] for channel in channels.DEFAULT_CHANNELS}
+channel_groups = channels.groups(channels.DEFAULT_CHANNELS)
+# Изменения текущей пачки, которые применяются к состоянию в памяти только после commit
+pending_gifts = set()
+pending_price_keys = set()
+pending_sale_ids = set()
+pending_alerts = []
+# Фоновые задачи main(): ссылки держим, чтобы задачу не собрал GC, а её падение попало в лог
+background_tasks = set()
+
+
+import re
+
+def remove_markdown(text: str) -> str:
+    """
+    Убираем часть Markdown-разметки:
+      - двойные звёздочки **...**
+      - двойные подчёркивания __...__
+      - а также [текст](ссылка) превращаем в просто текст
+    """
+    # 1) Заменяем **...** на просто ...
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    # 2) Заменяем __...__ на просто ...
+    text = re.sub(r'__(.*?)__', r'\1', text)
+    # 3) Заменяем [текст](ссылка) на просто текст
+    text = re.sub(r'\[(.*?)\]\(https?:\/\/[^\)]+\)', r'\1', text)
+    return text
+
+
+async def init_db():
+    global db
+    db = await aiosqlite.connect(DB_FILE)
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS gifts (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE,
+            total_count INTEGER,
+            base_star_cost REAL
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS prices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            gift_name TEXT,
+            date TEXT,
+            delta_ton REAL,
+            floor_ton REAL,
+            floor_usd REAL,
+            floor_star REAL,
+            floor_rub REAL,
+            average_ton REAL,
+            average_usd REAL,
+            average_star REAL,
+            average_rub REAL
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER UNIQUE,
+            gift_name TEXT,
+            price_ton REAL,
+            date TEXT
+        )
+    ''')
+    # Индекс для проверки дубликатов floor-цен (и для запросов анализатора по подарку);
+    # в компактной раскладке (compact.py) prices — представление, индекс уже есть на prices_compact
+    await ensure_index_async(db)
+    await db.execute(SALE_SKETCHES_SCHEMA)
+    # Дневные агрегаты retention.py: по ним прогревается последний floor подарков (spreads.py)
+    await db.execute(PRICES_DAILY_SCHEMA)
+    await db.commit()
+    await ensure_schema_async(db)
+    await spreads.ensure_schema_async(db)
+    await gift_stats.ensure_schema_async(db)
+    await spread_tracker.warm_up_async(db)
+
+    global seen, detector, prices_cutoff
+    seen = await load_seen_async(db)
+    prices_cutoff = await get_cutoff_async(db)
+    detector = await load_detector_async(db)
+    async with db.execute("SELECT name FROM gifts") as cursor:
+        known_gifts.update(name for (name,) in await cursor.fetchall())
+    logger.info("База данных и таблицы инициализированы.",
+                extra={"seen_mode": seen.mode, "known_gifts": len(known_gifts)})
+
+# ----------------------- Подписки на цены -----------------------
+async def init_alerts():
+    """
+    Подключается к users.db бота и загружает активные подписки в индекс.
+    """
+    global alert_db
+    alert_db = await aiosqlite.connect(alerts.USERS_DB_FILE)
+    await alert_db.execute("PRAGMA journal_mode=WAL;")
+    await alerts.ensure_schema_async(alert_db)
+    loaded = await alerts.load_new_alerts(alert_db, alert_index)
+    logger.info(f"Загружено подписок на цены: {loaded}")
+
+async def refresh_alerts_loop():
+    """
+    Периодически догружает новые подписки, созданные пользователями в боте.
+    """
+    while True:
+        await asyncio.sleep(alerts.REFRESH_SECONDS)
+        try:
+            await alerts.load_new_alerts(alert_db, alert_index)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки подписок: {e}")
+
+async def check_alerts(gift_name, price_ton, source):
+    """
+    O(log n) проверка цены по индексу подписок; совпадения уходят боту через alert_events.
+    """
+    fired = alert_index.match(gift_name, price_ton)
+    if fired:
+        try:
+            recorded = await alerts.record_matches(alert_db, fired, price_ton, source)
+        except Exception:
+            # В users.db подписки остались активными — возвращаем их в индекс
+            alert_index.restore(fired)
+            raise
+        alert_index.confirm(fired)
+        ALERTS_FIRED_TOTAL.inc(recorded, source=source)
+
+# ----------------------- Функции парсинга -----------------------
+def parse_sale_message(message):
+    """
+    Парсит сообщение о продаже подарка.
+    Ожидаемый формат:
+    
+    Gift Sold 
+    
+    Vintage Cigar #17369 (https://t.me/nft/VintageCigar-1476)
+    
+    Price: 5.5 TON
+    """
+    text = message.text
+    if not text:
+        return None
+    # Разбиваем сообщение на строки и отбрасываем пустые
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or "Gift Sold" not in lines[0]:
+        return None
+    if len(lines) < 3:
+        return None
+
+    # Извлекаем название подарка из второй строки
+    gift_line = lines[1]
+    m = re.match(r"(.+?)\s*\(", gift_line)
+    gift_name = m.group(1).strip() if m else gift_line.strip()
+
+    # Ищем строку с ценой
+    price_ton = None
+    for line in lines:
+        if "Price:" in line:
+            m_price = re.search(r"Price:\s*([-+]?\d*[\.,]?\d+)", line)
+            if m_price:
+                try:
+                    price_ton = float(m_price.group(1).replace(",", "."))
+                except ValueError:
+                    price_ton = None
+                break
+
+    if price_ton is None:
+        return None
+
+    return {
+        "message_id": message.id,
+        "gift_name": gift_name,
+        "price_ton": price_ton,
+        "date": format_date(message.date)
+    }
+
+def parse_floor_message(message):
+    raw_text = message.text
+    if not raw_text:
+        return None
+
+    # Сначала убираем часть markdown
+    text = remove_markdown(raw_text)
+
+    # Теперь text выглядит примерно так:
+    # "Flying Broom +0.01 TON 📈
+    #   Floor Tonnel: 0,69 TON ≈ 2,58 USD ≈ 172 ⭐️ ≈ 235 ₽
+    #   ...
+    #   Average Tonnel: 0,71 TON ≈ 2,64 USD ≈ 176 ⭐️ ≈ 241 ₽"
+
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return None
+
+    # --- 1) Парсим первую строку вида: "Flying Broom +0.01 TON"
+    #     (раньше у нас было "Flying Broom (https://...)", теперь ссылки нет)
+    first_line = lines[0]
+    # Можно адаптировать регулярку под "Название +0.01 TON":
+    m = re.match(r'^(.+?)\s+([-+]?\d*[.,]?\d+)\s*TON', first_line)
+    if not m:
+        return None
+
+    gift_name = m.group(1).strip()
+    delta_str = m.group(2).replace(',', '.')
+    try:
+        delta_ton = float(delta_str)
+    except ValueError:
+        return None
+
+    # --- 2) Ищем строки Floor Tonnel: ... и Average Tonnel: ...
+    floor_ton = floor_usd = floor_star = floor_rub = None
+    average_ton = average_usd = average_star = average_rub = None
+
+    # Пример шаблона для "X TON ≈ Y USD ≈ Z ⭐️ ≈ W ₽"
+    pattern_tonnel = r'([-+]?\d*[.,]?\d+)\s*TON\s*≈\s*([-+]?\d*[.,]?\d+)\s*USD\s*≈\s*([-+]?\d*[.,]?\d+)\s*\S*\s*≈\s*([-+]?\d*[.,]?\d+)'
+
+    for line in lines[1:]:
+        if line.startswith("Floor Tonnel"):
+            m_floor = re.search(pattern_tonnel, line)
+            if m_floor:
+                floor_ton  = float(m_floor.group(1).replace(',', '.').replace(' ', ''))
+                floor_usd  = float(m_floor.group(2).replace(',', '.').replace(' ', ''))
+                floor_star = float(m_floor.group(3).replace(',', '.').replace(' ', ''))
+                floor_rub  = float(m_floor.group(4).replace(',', '.').replace(' ', ''))
+
+        elif line.startswith("Average Tonnel"):
+            m_avg = re.search(pattern_tonnel, line)
+            if m_avg:
+                average_ton  = float(m_avg.group(1).replace(',', '.').replace(' ', ''))
+                average_usd  = float(m_avg.group(2).replace(',', '.').replace(' ', ''))
+                average_star = float(m_avg.group(3).replace(',', '.').replace(' ', ''))
+                average_rub  = float(m_avg.group(4).replace(',', '.').replace(' ', ''))
+
+    return {
+        "gift_name": gift_name,
+        "delta_ton": delta_ton,
+        "floor_ton": floor_ton,
+        "floor_usd": floor_usd,
+        "floor_star": floor_star,
+        "floor_rub": floor_rub,
+        "average_ton": average_ton,
+        "average_usd": average_usd,
+        "average_star": average_star,
+        "average_rub": average_rub,
+        "date": format_date(message.date),
+    }
+
+
+# ----------------------- Функции работы с БД -----------------------
+async def commit():
+    """
+    commit с замером времени и учётом блокировок БД.
+    """
+    try:
+        with DB_COMMIT_SECONDS.time():
+            await db.commit()
+    except sqlite3.OperationalError as e:
+        if is_locked_error(e):
+            DB_LOCKED_TOTAL.inc(operation="commit")
+        raise
+    # Подписчики узнают о строках только после того, как они видны в БД
+    changes.flush()
+
+def observe_ingest_lag(channel, message):
+    """
+    Задержка инжеста: время вставки минус дата сообщения в канале.
+    """
+    if message.date:
+        lag = (datetime.now(timezone.utc) - message.date).total_seconds()
+        INGEST_LAG_SECONDS.observe(max(lag, 0.0), channel=channel)
+
+async def insert_gift(gift_name):
+    if gift_name and gift_name.strip():
+        name = gift_name.strip()
+        if name in known_gifts or name in pending_gifts:
+            return
+        with DB_QUERY_SECONDS.time(query="insert_gift"):
+            await db.execute("INSERT OR IGNORE INTO gifts (name) VALUES (?)", (name,))
+        pending_gifts.add(name)
+
+async def insert_price_data(data):
+    """
+    Возвращает True, если запись вставлена, и False для дубликата.
+    Известные дубликаты отсекаются фильтром seen без обращения к БД.
+    Строка пишется в транзакцию текущей пачки, commit делает write_batch.
+    Строки старше границы retention.py пропускаются как дубликаты: они уже свёрнуты в prices_daily.
+    """
+    if is_compacted(data["date"], prices_cutoff):
+        return False
+    row = None
+    if (data["gift_name"], data["date"]) in pending_price_keys:
+        row = True
+    elif seen.price_seen(data["gift_name"], data["date"]):
+        if seen.exact:
+            row = True
+        else:
+            # Фильтр Блума: возможный дубликат подтверждаем в БД
+            with DB_QUERY_SECONDS.time(query="select_price"):
+                async with db.execute("SELECT id FROM prices WHERE gift_name = ? AND date = ?", (data["gift_name"], data["date"])) as cursor:
+                    row = await cursor.fetchone()
+    if row is not None:
+        log_db.info("Данные для подарка уже существуют. Пропускаем вставку.",
+                    extra={"gift_name": data["gift_name"], "date": data["date"]})
+        return False
+
+    suspicious = detector.observe_floor(data["gift_name"], data["floor_ton"], data["date"])
+    if suspicious:
+        SUSPICIOUS_TOTAL.inc(table="prices")
+        log_floor.warning("Подозрительная floor-цена", extra=data)
+
+    with DB_QUERY_SECONDS.time(query="insert_price"):
+        await db.execute('''
+            INSERT INTO prices (
+                gift_name, date, delta_ton, floor_ton, floor_usd,
+                floor_star, floor_rub, average_ton, average_usd, average_star, average_rub, suspicious
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            data["gift_name"],
+            data["date"],
+            data["delta_ton"],
+            data["floor_ton"],
+            data["floor_usd"],
+            data["floor_star"],
+            data["floor_rub"],
+            data["average_ton"],
+            data["average_usd"],
+            data["average_star"],
+            data["average_rub"],
+            int(suspicious)
+        ))
+    pending_price_keys.add((data["gift_name"], data["date"]))
+    gift_summary.add_price(data["gift_name"], data["date"], data["delta_ton"], data["floor_ton"],
+                           data["average_ton"], suspicious)
+    if not suspicious:
+        spread_tracker.observe_floor(data["gift_name"], data["floor_ton"], data["date"])
+        pending_alerts.append((data["gift_name"], data["floor_ton"], "floor"))
+    return True
+
+async def insert_sale_data(data):
+    """
+    Возвращает True, если запись вставлена, и False для дубликата.
+    Известные дубликаты отсекаются фильтром seen без обращения к БД.
+    Строка пишется в транзакцию текущей пачки, commit делает write_batch.
+    """
+    row = None
+    if data["message_id"] in pending_sale_ids:
+        row = True
+    elif seen.sale_seen(data["message_id"]):
+        if seen.exact:
+            row = True
+        else:
+            # Фильтр Блума: возможный дубликат подтверждаем в БД
+            with DB_QUERY_SECONDS.time(query="select_sale"):
+                async with db.execute("SELECT id FROM sales WHERE message_id = ?", (data["message_id"],)) as cursor:
+                    row = await cursor.fetchone()
+    if row is not None:
+        log_db.info("Запись о продаже уже существует. Пропускаем.", extra={"message_id": data["message_id"]})
+        return False
+
+    with DB_QUERY_SECONDS.time(query="insert_sale"):
+        cursor = await db.execute('''
+            INSERT OR IGNORE INTO sales (message_id, gift_name, price_ton, date)
+            VALUES (?, ?, ?, ?)
+        ''', (data["message_id"], data["gift_name"], data["price_ton"], data["date"]))
+    if not cursor.rowcount:
+        # Продажу уже записал другой процесс (main.py), а фильтр seen об этом ещё не знал
+        log_db.info("Запись о продаже уже существует. Пропускаем.", extra={"message_id": data["message_id"]})
+        return False
+    sale_id = cursor.lastrowid
+
+    # Детектор видит только действительно вставленные продажи; флаг дописывается в ту же транзакцию
+    suspicious = detector.observe_sale(data["gift_name"], data["price_ton"], data["date"])
+    if suspicious:
+        SUSPICIOUS_TOTAL.inc(table="sales")
+        log_sales.warning("Подозрительная цена продажи", extra=data)
+        with DB_QUERY_SECONDS.time(query="flag_sale"):
+            await db.execute("UPDATE sales SET suspicious = 1 WHERE id = ?", (sale_id,))
+
+    changes.publish("sales", base_gift_name(data["gift_name"]), sale_id)
+    gift_summary.add_sale(data["gift_name"], data["date"], data["price_ton"], suspicious)
+    pending_sale_ids.add(data["message_id"])
+    if not suspicious:
+        sale_sketches.add(data["gift_name"], data["date"], data["price_ton"])
+        add_spread(sale_id, data)
+        pending_alerts.append((data["gift_name"], data["price_ton"], "sale"))
+    return True
+
+def add_spread(sale_id, data):
+    """
+    Спред продажи к последнему floor подарка (spreads.py); пишется в write_batch вместе с пачкой.
+    """
+    row = spread_tracker.add_sale(sale_id, data["gift_name"], data["price_ton"], data["date"])
+    if row is None:
+        return
+    spread_pct = row[-1]
+    SPREADS_TOTAL.inc(direction="below" if spread_pct < 0 else "above")
+    if abs(spread_pct) >= spreads.LOG_PCT:
+        log_sales.warning("Продажа далеко от floor", extra={
+            "gift_name": row[1], "price_ton": row[3], "floor_ton": row[4], "spread_pct": round(spread_pct, 1)})
+
+PARSERS = {"floor": parse_floor_message, "sale": parse_sale_message}
+
+def configure(channel_list):
+    global channel_parsers, channel_groups
+    channel_parsers = {channel["name"]: channel["parser"] for channel in channel_list}
+    channel_groups = channels.groups(channel_list)
+
+def parse_message(channel, message):
+    return PARSERS[channel_parsers[channel]](message)
+
+def _reset_pending():
+    pending_gifts.clear()
+    pending_price_keys.clear()
+    pending_sale_ids.clear()
+    pending_alerts.clear()
+
+async def write_batch(items, live=True):
+    """
+    items — [(канал, данные, сообщение)]. Все вставки пачки — одна транзакция и один commit;
+    после commit обновляются фильтр дубликатов и known_gifts и проверяются подписки.
+    Возвращает список «вставлено/дубликат» по items или None, если пачка не записана
+    (сообщения остаются в архиве, их можно дописать через --replay).
+    """
+    global prices_cutoff
+    statuses = []
+    try:
+        # retention.py мог свернуть историю, а main.py — импортировать экспорт, пока snifer.py работает
+        prices_cutoff = await get_cutoff_async(db)
+        await refresh_seen_async(db, seen)
+        for channel, data, message in items:
+            if channel_parsers[channel] == "floor":
+                await insert_gift(data["gift_name"])
+                statuses.append(await insert_price_data(data))
+            else:
+                statuses.append(await insert_sale_data(data))
+        if pending_price_keys:
+            # lastrowid вставки через представление prices (compact.py) не определён,
+            # поэтому событие changefeed несёт MAX(id) пачки — как в main.py
+            async with db.execute("SELECT MAX(id) FROM prices") as cursor:
+                (max_id,) = await cursor.fetchone()
+            for gift_name in {gift_name for gift_name, _ in pending_price_keys}:
+                changes.publish("prices", gift_name, max_id)
+        await sale_sketches.flush_async(db)
+        await gift_summary.flush_async(db)
+        with DB_QUERY_SECONDS.time(query="insert_spreads"):
+            await spread_tracker.flush_async(db)
+        await commit()
+    except Exception as e:
+        if is_locked_error(e):
+            DB_LOCKED_TOTAL.inc(operation="write_batch")
+        log_db.error(f"Пачка из {len(items)} сообщений не записана: {e}")
+        await db.rollback()
+        changes.pending.clear()
+        sale_sketches.pending.clear()
+        gift_summary.pending.clear()
+        spread_tracker.rollback()
+        _reset_pending()
+        for channel, _, _ in items:
+            MESSAGES_TOTAL.inc(channel=channel, status="error")
+        return None
+
+    known_gifts.update(pending_gifts)
+    spread_tracker.commit()
+    for gift_name, date in pending_price_keys:
+        seen.add_price(gift_name, date)
+    for message_id in pending_sale_ids:
+        seen.add_sale(message_id)
+    fired = list(pending_alerts)
+    _reset_pending()
+
+    for (channel, data, message), inserted in zip(items, statuses):
+        MESSAGES_TOTAL.inc(channel=channel, status="parsed" if inserted else "duplicate")
+        if inserted and live:
+            observe_ingest_lag(channel, message)
+    if alert_db is not None:
+        # Пачка уже записана: ошибка users.db (например, занята ботом) не должна её отменять
+        try:
+            for gift_name, price_ton, source in fired:
+                await check_alerts(gift_name, price_ton, source)
+        except Exception as e:
+            if is_locked_error(e):
+                DB_LOCKED_TOTAL.inc(operation="check_alerts")
+            logger.error(f"Ошибка проверки подписок: {e}")
+    return statuses
+
+async def writer_loop(queue, live=True):
+    """
+    Забирает из очереди всё накопленное (до WRITE_BATCH_SIZE) и пишет одной пачкой.
+    Итоги по каналам — в MESSAGES_TOTAL.
+    """
+    while True:
+        items = [await queue.get()]
+        while len(items) < WRITE_BATCH_SIZE:
+            try:
+                items.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        try:
+            await write_batch(items, live)
+        except Exception as e:
+            # Писатель один: если он остановится, очередь заполнится и инжест встанет
+            log_db.exception(f"Ошибка обработки пачки из {len(items)} сообщений: {e}")
+        finally:
+            for _ in items:
+                queue.task_done()
+
+def start_background_task(coro, name):
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+def _background_task_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Фоновая задача {task.get_name()} завершилась с ошибкой", exc_info=task.exception())
+
+async def submit(channel, data, message):
+    """
+    Передаёт разобранное сообщение писателю: в очередь этого процесса или, в процессе-читателе
+    (--reader), строкой JSON в pipe к snifer.py. Если писатель не успевает, submit ждёт,
+    пока pipe освободится (drain), не блокируя цикл событий, — так же, как put в полную
+    очередь. data = None — сообщение отвергнуто парсером: писатель только учитывает его
+    в счётчиках канала.
+    """
+    if reader_out is None:
+        if data is None:
+            MESSAGES_TOTAL.inc(channel=channel, status="rejected")
+        else:
+            await write_queue.put((channel, data, message))
+        return
+    record = {"channel": channel, "data": data, "date": message.date.isoformat() if message.date else None}
+    reader_out.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+    await reader_out.drain()
+
+async def handle_message(channel, message):
+    """
+    Архивирует сырое сообщение, разбирает его и передаёт на запись.
+    """
+    parser = channel_parsers[channel]
+    CHANNEL_LAST_MESSAGE.set(time.time(), channel=channel)
+    with HANDLER_SECONDS.time(handler=parser):
+        errors = raw_archive.errors
+        raw_archive.append(channel, message)
+        if raw_archive.errors != errors:
+            ARCHIVE_ERRORS_TOTAL.inc()
+
+        if parser == "floor" and log_floor_raw.isEnabledFor(logging.DEBUG):
+            # Смотрим сырое сообщение (текст форматируется только если DEBUG включён)
+            log_floor_raw.debug("New floor message", extra={"raw": message.text})
+
+        data = parse_message(channel, message)
+        if not data:
+            if parser == "floor":
+                log_floor.warning("Сообщение не распознано парсером.", extra={"message_id": message.id, "channel": channel})
+            await submit(channel, None, message)
+            return
+        if parser == "floor":
+            log_floor.info("Обновление цены", extra=dict(data, channel=channel))
+        else:
+            log_sales.info("Обрабатывается продажа подарка", extra=dict(data, channel=channel))
+        await submit(channel, data, message)
+
+def subscribe(client, channel_list):
+    """
+    Обработчик NewMessage на каждый канал списка.
+    """
+    for channel in channel_list:
+        async def handler(event, channel=channel["name"]):
+            await handle_message(channel, event.message)
+        client.add_event_handler(handler, events.NewMessage(chats=channel["name"]))
+
+# ----------------------- Процессы-читатели -----------------------
+async def forward_reader(group, proc):
+    """
+    Читает разобранные сообщения читателя группы и ставит их в очередь писателя.
+    """
+    while True:
+        line = await proc.stdout.readline()
+        if not line:
+            break
+        try:
+            record = json.loads(line)
+            channel, data = record["channel"], record["data"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Читатель {group}: нераспознанная строка", extra={"group": group})
+            continue
+        if channel not in channel_parsers:
+            # channels.json поменялся после запуска писателя
+            logger.error(f"Читатель {group}: канал {channel} не из конфигурации писателя", extra={"group": group})
+            continue
+        message = archive.to_message({"id": data and data.get("message_id"), "date": record.get("date")})
+        await submit(channel, data, message)
+
+async def run_reader(group, args=(), restart=True):
+    """
+    Запускает читателя группы каналов (snifer.py --reader <группа>) и перезапускает его при падении.
+    """
+    while True:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--reader", group, "--channels", CHANNELS_FILE, *args,
+            stdout=asyncio.subprocess.PIPE, limit=1 << 20)
+        try:
+            await forward_reader(group, proc)
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+        code = await proc.wait()
+        if not restart:
+            return code
+        logger.error(f"Читатель {group} завершился с кодом {code}, перезапуск", extra={"group": group})
+        READER_RESTARTS_TOTAL.inc(group=group)
+        await asyncio.sleep(READER_RESTART_SECONDS)
+
+class PipeWriter(asyncio.Protocol):
+    """
+    Запись процесса-читателя в pipe к snifer.py через транспорт цикла событий.
+    drain() ждёт, пока буфер транспорта не опустится ниже порога (pause/resume_writing),
+    и бросает BrokenPipeError, если писатель закрыл pipe.
+    """
+    def __init__(self):
+        self.transport = None
+        self._paused = False
+        self._lost = None
+        self._waiters = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self._lost = exc or BrokenPipeError("pipe к писателю закрыт")
+        self._wake()
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wake()
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    def write(self, data: bytes) -> None:
+        self.transport.write(data)
+
+    async def drain(self) -> None:
+        while True:
+            if self._lost is not None:
+                raise self._lost
+            if not self._paused:
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+async def reader_main(group, replay_dir=None):
+    """
+    Процесс-читатель: архивирует и разбирает сообщения каналов группы, в БД не пишет.
+    С replay_dir вместо Telegram читает записи этих каналов из архива и выходит.
+    """
+    global reader_out, raw_archive
+    # Данные идут в исходный stdout, а всё, что печатают библиотеки (в т.ч. вход в Telegram), — в stderr
+    pipe = os.fdopen(os.dup(sys.stdout.fileno()), "wb", buffering=0)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    # Неблокирующая запись в pipe через цикл событий: пока писатель не читает, Telethon продолжает работать
+    loop = asyncio.get_running_loop()
+    transport, reader_out = await loop.connect_write_pipe(PipeWriter, pipe)
+    channel_list = channel_groups[group]
+    try:
+        if replay_dir:
+            names = {channel["name"] for channel in channel_list}
+            for record in archive.read(replay_dir, names):
+                message = archive.to_message(record)
+                await submit(record["channel"], parse_message(record["channel"], message), message)
+            return
+        groups = [name for name in channel_groups if name != channels.MAIN_GROUP]
+        if READER_METRICS_PORT:
+            start_http_server(READER_METRICS_PORT + groups.index(group))
+        raw_archive = archive.ArchiveWriter()
+        client = TelegramClient(channels.session_for(session_name, group), api_id, api_hash)
+        await client.start()
+        subscribe(client, channel_list)
+        logger.info(f"Читатель {group} запущен: {', '.join(c['name'] for c in channel_list)}", extra={"group": group})
+        try:
+            await client.run_until_disconnected()
+        finally:
+            raw_archive.close()
+    except (BrokenPipeError, ConnectionResetError):
+        logger.info(f"Читатель {group}: писатель закрыл pipe, выходим", extra={"group": group})
+    finally:
+        # Дожидаемся, пока в pipe уйдёт весь буфер: после выхода из цикла событий он потеряется
+        try:
+            transport.set_write_buffer_limits(0)
+            await reader_out.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        transport.close()
+
+# ----------------------- Повтор архива -----------------------
+async def replay(directory=archive.ARCHIVE_DIR):
+    """
+    Прогоняет архив сырых сообщений через парсеры и писатель пачками так быстро,
+    как позволяет машина. Уже записанные строки отсекаются как дубликаты (floor-строки
+    старше границы retention.py — тоже: они уже свёрнуты в prices_daily), так что
+    повтор восстанавливает только то, что раньше было отвергнуто или потеряно.
+    Каналы групп, кроме main, разбирают процессы-читатели (как в живом режиме).
+    Подписки на цены при повторе не проверяются.
+    """
+    global write_queue
+    await init_db()
+    write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+    writer = start_background_task(writer_loop(write_queue, live=False), "writer")
+    main_channels = {channel["name"] for channel in channel_groups.get(channels.MAIN_GROUP, [])}
+    reader_groups = [group for group in channel_groups if group != channels.MAIN_GROUP]
+    started = time.perf_counter()
+    try:
+        readers = [asyncio.create_task(run_reader(group, ("--replay", directory), restart=False))
+                   for group in reader_groups]
+        for record in archive.read(directory, main_channels):
+            message = archive.to_message(record)
+            await submit(record["channel"], parse_message(record["channel"], message), message)
+        for group, code in zip(reader_groups, await asyncio.gather(*readers)):
+            if code:
+                logger.error(f"Читатель {group} завершился с кодом {code}", extra={"group": group})
+        await write_queue.join()
+    finally:
+        writer.cancel()
+        await db.close()
+    elapsed = time.perf_counter() - started
+
+    counts = {channel: {status: MESSAGES_TOTAL.value(channel=channel, status=status)
+                        for status in ("parsed", "duplicate", "error", "rejected")}
+              for channel in channel_parsers}
+    groups = {channel["name"]: group for group, channel_list in channel_groups.items() for channel in channel_list}
+    total = sum(sum(c.values()) for c in counts.values())
+    print(f"Сообщений: {total:.0f} за {elapsed:.2f} с — {total / max(elapsed, 1e-9):.0f} сообщ/с")
+    for channel, c in counts.items():
+        n = sum(c.values())
+        print(f"  {channel} ({channel_parsers[channel]}, группа {groups[channel]}): {n:.0f} — "
+              f"{n / max(elapsed, 1e-9):.0f} сообщ/с, отвергнуто парсером: {c['rejected']:.0f}")
+    print(f"Вставлено: {sum(c['parsed'] for c in counts.values()):.0f}, "
+          f"дубликатов: {sum(c['duplicate'] for c in counts.values()):.0f}, "
+          f"не записано: {sum(c['error'] for c in counts.values()):.0f}")
+    return counts
+
+# ----------------------- Основная логика с Telethon -----------------------
+async def main():
+    setup_logging("snifer")
+
+    # Инициализируем базу данных
+    await init_db()
+    await init_alerts()
+    start_background_task(refresh_alerts_loop(), "refresh_alerts")
+
+    global raw_archive, write_queue
+    raw_archive = archive.ArchiveWriter()
+    write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+    start_background_task(writer_loop(write_queue), "writer")
+
+    if METRICS_PORT:
+        WRITE_QUEUE_DEPTH.set_function(write_queue.qsize)
+        start_http_server(METRICS_PORT)
+        logger.info(f"Метрики доступны на http://127.0.0.1:{METRICS_PORT}/metrics")
+
+    # Остальные группы каналов читают отдельные процессы, писатель у всех — этот
+    for group in channel_groups:
+        if group != channels.MAIN_GROUP:
+            start_background_task(run_reader(group), f"reader-{group}")
+
+    main_channels = channel_groups.get(channels.MAIN_GROUP)
+    try:
+        if not main_channels:
+            logger.info("Каналов группы main нет: процесс только пишет данные читателей")
+            await asyncio.Event().wait()
+            return
+        # Создаём клиент Telethon и подключаемся
+        client = TelegramClient(session_name, api_id, api_hash)
+        await client.start()
+        subscribe(client, main_channels)
+        logger.info(f"Телеграм-клиент запущен. Ожидаем новые сообщения: {', '.join(c['name'] for c in main_channels)}")
+
+        # Запускаем клиент до отключения
+        await client.run_until_disconnected()
+    finally:
+        raw_archive.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Сбор floor-цен и продаж из каналов Telegram")
+    parser.add_argument("--replay", nargs="?", const=archive.ARCHIVE_DIR, metavar="DIR",
+                        help="прогнать архив сырых сообщений через парсеры и выйти (бенчмарк инжеста)")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--channels", default=CHANNELS_FILE, help="файл каналов и парсеров (channels.json)")
+    parser.add_argument("--reader", metavar="GROUP", help="процесс-читатель группы каналов (запускает сам snifer.py)")
+    args = parser.parse_args()
+    DB_FILE = args.db
+    CHANNELS_FILE = args.channels
+    configure(channels.load(CHANNELS_FILE))
+    if args.reader:
+        if args.reader == channels.MAIN_GROUP or args.reader not in channel_groups:
+            parser.error(f"в {CHANNELS_FILE} нет группы каналов {args.reader} для читателя")
+        setup_logging("snifer")
+        asyncio.run(reader_main(args.reader, args.replay))
+    elif args.replay:
+        setup_logging("snifer")
+        asyncio.run(replay(args.replay))
+    else:
+        asyncio.run(main())
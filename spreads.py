@@ -0,0 +1,140 @@
+"""
+Спред продажи относительно текущего floor: насколько цена продажи из канала
+GiftNotification выше или ниже последнего floor Tonnel этого подарка.
+
+snifer.py держит последний floor каждого подарка в памяти (SpreadTracker) и для
+каждой продажи считает спред за O(1) — одно обращение к словарю, без запросов к
+prices. Записи копятся за пачку и пишутся в таблицу spreads одним executemany
+в той же транзакции, что и продажи;
+бот показывает крупнейшие отклонения за последние часы (/spreads) прямо из неё.
+
+Спред не считается, если floor подарка ещё не известен, старше MAX_FLOOR_AGE
+или новее самой продажи: сравнение с давно устаревшим floor (или с floor,
+появившимся уже после продажи) ничего не говорит о рынке.
+Подозрительные (anomaly.py) продажи и floor-цены в расчёт не попадают.
+"""
+from datetime import datetime, timedelta
+
+from anomaly import base_gift_name
+from portfolio import FloorCache
+from retention import DATE_FORMAT
+
+MAX_FLOOR_AGE = timedelta(hours=24)
+LOG_PCT = 20.0          # спреды больше этого (по модулю, %) snifer.py пишет в лог
+TOP_LIMIT = 10
+DEFAULT_HOURS = 24
+
+SPREADS_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS spreads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sale_id INTEGER,
+        gift_name TEXT,
+        date TEXT,
+        price_ton REAL,
+        floor_ton REAL,
+        floor_date TEXT,
+        spread_ton REAL,
+        spread_pct REAL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_spreads_date ON spreads (date)",
+)
+
+_INSERT = '''
+    INSERT INTO spreads (sale_id, gift_name, date, price_ton, floor_ton, floor_date, spread_ton, spread_pct)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def _parse(date: str):
+    # "2025.01.13 - 03:13:19" -> datetime; fromisoformat на порядок быстрее strptime
+    try:
+        return datetime.fromisoformat(date.replace(".", "-", 2).replace(" - ", " ", 1))
+    except (AttributeError, ValueError):
+        return None
+
+
+class SpreadTracker:
+    """
+    Последний floor по подаркам. Floor-цены текущей пачки snifer.py лежат в pending,
+    пока пачка не закоммичена: продажи той же пачки уже сравниваются с ними,
+    а при откате они просто отбрасываются вместе с ещё не записанными спредами.
+    """
+
+    def __init__(self, max_floor_age: timedelta = MAX_FLOOR_AGE):
+        self.max_floor_age = max_floor_age
+        self.floors = {}    # подарок -> (floor TON, дата)
+        self.pending = {}
+        self.rows = []      # спреды текущей пачки для flush_async
+
+    async def warm_up_async(self, db) -> None:
+        """
+        Последний floor каждого подарка из prices (или prices_daily) — тем же запросом, что у портфелей.
+        """
+        cache = FloorCache()
+        await cache.refresh(db)
+        self.floors = {name: (floor, date) for name, (floor, _, date) in cache.prices.items()}
+
+    def observe_floor(self, gift_name: str, floor_ton, date: str) -> None:
+        if floor_ton is None or not date:
+            return
+        current = self.pending.get(gift_name) or self.floors.get(gift_name)
+        if current is None or date >= current[1]:
+            self.pending[gift_name] = (floor_ton, date)
+
+    def commit(self) -> None:
+        self.floors.update(self.pending)
+        self.pending.clear()
+
+    def rollback(self) -> None:
+        self.pending.clear()
+        self.rows.clear()
+
+    def add_sale(self, sale_id: int, gift_name: str, price_ton, date: str):
+        """
+        Считает спред продажи и ставит строку в очередь на запись.
+        Возвращает строку или None, если сравнить не с чем.
+        """
+        name = base_gift_name(gift_name)
+        current = self.pending.get(name) or self.floors.get(name)
+        if current is None or not price_ton:
+            return None
+        floor_ton, floor_date = current
+        if not floor_ton:
+            return None
+        sale_at, floor_at = _parse(date), _parse(floor_date)
+        # Floor из будущего относительно продажи (повтор архива, догоняющая очередь) — тоже не сравниваем
+        if sale_at is None or floor_at is None or not timedelta(0) <= sale_at - floor_at <= self.max_floor_age:
+            return None
+        spread_ton = price_ton - floor_ton
+        row = (sale_id, name, date, price_ton, floor_ton, floor_date, spread_ton, spread_ton / floor_ton * 100)
+        self.rows.append(row)
+        return row
+
+    async def flush_async(self, db) -> None:
+        if self.rows:
+            await db.executemany(_INSERT, self.rows)
+            self.rows.clear()
+
+
+async def ensure_schema_async(db) -> None:
+    for ddl in SPREADS_SCHEMA:
+        await db.execute(ddl)
+    await db.commit()
+
+
+async def load_top(db, hours: int = DEFAULT_HOURS, limit: int = TOP_LIMIT, now: datetime = None) -> list:
+    """
+    Крупнейшие по модулю спреды за последние hours часов:
+    [(подарок, дата, цена продажи, floor, спред TON, спред %)].
+    """
+    since = ((now or datetime.now()) - timedelta(hours=hours)).strftime(DATE_FORMAT)
+    async with db.execute('''
+        SELECT gift_name, date, price_ton, floor_ton, spread_ton, spread_pct
+        FROM spreads
+        WHERE date >= ?
+        ORDER BY ABS(spread_pct) DESC
+        LIMIT ?
+    ''', (since, limit)) as cursor:
+        return [tuple(row) for row in await cursor.fetchall()]
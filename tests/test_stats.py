@@ -0,0 +1,118 @@
+"""
+Статистика /gift и детального анализа (analyzer_v2.py) по агрегатам SQLite и
+сводке gift_stats должна совпадать с прежним расчётом в Python по выгруженным
+строкам — и на «сырой» базе, и после свёртки истории retention.py.
+"""
+import asyncio
+import random
+import sqlite3
+import statistics
+from datetime import datetime, timedelta
+
+import pytest
+
+import analyzer_v2
+import main
+import retention
+
+GIFTS = ("Plush Pepe", "Durov's Cap", "Lol Pop")
+ROWS_PER_GIFT = 300
+START = datetime(2026, 1, 1)
+# Каждая такая строка — выброс floor в сто раз: детектор помечает её suspicious
+OUTLIER_EVERY = 97
+# Свёртка retention.py забирает примерно первую половину истории
+COMPACT_CUTOFF = (START + timedelta(minutes=17 * ROWS_PER_GIFT // 2)).strftime("%Y.%m.%d - %H:%M:%S")
+
+
+def _fill(rng):
+    for gift_index, gift_name in enumerate(GIFTS):
+        main.insert_gift(gift_name)
+        floor = rng.uniform(5, 50)
+        for i in range(ROWS_PER_GIFT):
+            date = (START + timedelta(minutes=17 * i, seconds=gift_index)).strftime("%Y.%m.%d - %H:%M:%S")
+            delta = round(rng.gauss(0, 0.3), 2)
+            floor = max(floor + delta, 0.5)
+            floor_ton = floor * 100 if i % OUTLIER_EVERY == OUTLIER_EVERY // 2 else floor
+            main.insert_price_data({
+                "gift_name": gift_name, "date": date, "delta_ton": delta,
+                "floor_ton": floor_ton, "floor_usd": floor_ton * 3, "floor_star": floor_ton * 250,
+                "floor_rub": floor_ton * 300, "average_ton": floor_ton * 1.1, "average_usd": floor_ton * 3.3,
+                "average_star": floor_ton * 275, "average_rub": floor_ton * 330,
+            })
+            if i % 3 == 0:
+                main.insert_sale_data({
+                    "message_id": gift_index * ROWS_PER_GIFT + i, "gift_name": f"{gift_name} #{i}",
+                    "price_ton": round(floor * rng.uniform(0.9, 1.3), 2), "date": date,
+                })
+    main.flush()
+
+
+@pytest.fixture(params=["raw", "compacted"])
+def gift_db_path(request, tmp_path, monkeypatch):
+    # analyzer_v2.init_gift_db открывает gifts.db в текущем каталоге
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "gifts.db")
+    main.init_db(path)
+    try:
+        _fill(random.Random(40))
+        if request.param == "compacted":
+            assert retention.compact(main.conn, COMPACT_CUTOFF) > 0
+    finally:
+        main.conn.close()
+    return path
+
+
+def _old_average_delta(path, gift_name):
+    """
+    Прежний расчёт /gift: среднее delta_ton по строкам prices и дневным агрегатам.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        deltas = [row[0] for row in conn.execute(
+            "SELECT delta_ton FROM prices WHERE gift_name = ? AND suspicious = 0", (gift_name,)
+        ) if row[0] is not None]
+        daily_sum, daily_count = conn.execute(
+            "SELECT SUM(delta_sum), SUM(delta_count) FROM prices_daily WHERE gift_name = ?", (gift_name,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return (sum(deltas) + (daily_sum or 0.0)) / (len(deltas) + (daily_count or 0))
+
+
+async def _analyze(gift_name):
+    # Как при старте бота: init_gift_db заодно создаёт prices_daily и остальные таблицы анализатора
+    await analyzer_v2.init_gift_db()
+    analyzer_v2.series_cache.clear()
+    try:
+        return (await analyzer_v2.fetch_price_stats(gift_name),
+                await analyzer_v2.fetch_price_series(gift_name),
+                await analyzer_v2.get_gift_info_text(gift_name))
+    finally:
+        await analyzer_v2.gift_db.close()
+        analyzer_v2.gift_db = None
+
+
+def test_fixture_has_outliers_and_compacted_history(gift_db_path):
+    conn = sqlite3.connect(gift_db_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM prices WHERE suspicious = 1").fetchone()[0] > 0
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("gift_name", GIFTS)
+def test_price_stats_match_series(gift_db_path, gift_name):
+    (mean_price, min_price, max_price, std_price), series, _ = asyncio.run(_analyze(gift_name))
+    prices = [price for _, price in series]
+    assert len(prices) > 1
+    assert mean_price == pytest.approx(statistics.mean(prices), rel=1e-9)
+    assert min_price == min(prices)
+    assert max_price == max(prices)
+    assert std_price == pytest.approx(statistics.stdev(prices), rel=1e-9)
+
+
+@pytest.mark.parametrize("gift_name", GIFTS)
+def test_gift_info_average_delta_matches_python(gift_db_path, gift_name):
+    _, _, text = asyncio.run(_analyze(gift_name))
+    expected = _old_average_delta(gift_db_path, gift_name)
+    assert f"Среднее изменение (delta_ton): {expected:.4f}\n" in text
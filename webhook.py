@@ -0,0 +1,302 @@
+"""
+Webhook-режим бота: фронт-процесс принимает обновления Telegram по HTTP и раскладывает
+их по N воркерам analyzer_v2.py (python analyzer_v2.py --worker <номер> <N>).
+
+Воркер выбирается по id пользователя (user_id % N): все обновления одного пользователя
+попадают в один процесс, а воркер обрабатывает их строго по очереди — порядок
+сохраняется, rate_limit и состояние пользователя работают как в одиночном боте.
+Обновления передаются воркеру через stdin, по строке JSON; если воркер не успевает,
+фронт не отвечает Telegram, пока pipe не освободится.
+
+Схему баз создаёт фронт (analyzer_v2.py --init-db), воркеры открывают gifts.db только
+на чтение через mmap — страницы базы общие для всех процессов в кэше ОС. Ряды цен
+каждый воркер кэширует сам и обновляет по changefeed.py. Уведомления о ценах
+доставляет воркер 0, лимит Bot API делится между воркерами поровну.
+
+Запуск (перед фронтом обычно стоит reverse proxy с TLS):
+    BOT_TOKEN=... python webhook.py --workers 4 --port 8443 --url https://example.com/telegram --secret s3cr3t
+
+Сквозная проверка с fake_bot_api.py вместо Telegram:
+    python webhook.py --e2e --workers 4 --users 50 --updates 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+
+from log_setup import setup_logging
+
+ANALYZER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analyzer_v2.py")
+DEFAULT_PORT = 8443
+DEFAULT_PATH = "/telegram"
+MAX_BODY_BYTES = 1 << 20
+RESTART_SECONDS = 1
+STOP_SECONDS = 10
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+logger = logging.getLogger("webhook")
+
+
+def update_user_id(update: dict):
+    """
+    id пользователя, от которого пришло обновление (для каналов — id чата).
+    """
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            if isinstance(value.get(field), dict) and "id" in value[field]:
+                return value[field]["id"]
+    return update.get("update_id", 0)
+
+
+class Front:
+    def __init__(self, workers: int, path: str = DEFAULT_PATH, secret: str = None):
+        self.workers = workers
+        self.path = path
+        self.secret = secret
+        self.procs = [None] * workers
+        self.routed = [0] * workers
+        self.rejected = 0
+        self.stopping = False
+
+    async def _spawn(self, index: int) -> None:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, ANALYZER, "--worker", str(index), str(self.workers), stdin=asyncio.subprocess.PIPE)
+        self.procs[index] = proc
+        asyncio.create_task(self._watch(index, proc))
+
+    async def _watch(self, index: int, proc) -> None:
+        code = await proc.wait()
+        if self.stopping:
+            return
+        logger.error(f"Воркер {index} завершился с кодом {code}, перезапуск")
+        await asyncio.sleep(RESTART_SECONDS)
+        if not self.stopping:
+            await self._spawn(index)
+
+    async def start(self) -> None:
+        init = await asyncio.create_subprocess_exec(sys.executable, ANALYZER, "--init-db")
+        if await init.wait() != 0:
+            raise RuntimeError("analyzer_v2.py --init-db завершился с ошибкой")
+        for index in range(self.workers):
+            await self._spawn(index)
+        logger.info(f"Запущено воркеров: {self.workers}")
+
+    async def stop(self) -> None:
+        """
+        Закрывает stdin воркеров: они дорабатывают очередь и выходят.
+        """
+        self.stopping = True
+        for proc in self.procs:
+            if proc is not None and proc.returncode is None:
+                proc.stdin.close()
+        for proc in self.procs:
+            if proc is None:
+                continue
+            try:
+                await asyncio.wait_for(proc.wait(), STOP_SECONDS)
+            except asyncio.TimeoutError:
+                proc.kill()
+
+    async def dispatch(self, update: dict) -> None:
+        index = update_user_id(update) % self.workers
+        proc = self.procs[index]
+        proc.stdin.write(json.dumps(update, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+        await proc.stdin.drain()
+        self.routed[index] += 1
+
+    async def _respond(self, method: str, path: str, headers: dict, body: bytes) -> str:
+        if method == "GET" and path == "/healthz":
+            return "200 OK"
+        if method != "POST" or path != self.path:
+            return "404 Not Found"
+        if self.secret and headers.get(SECRET_HEADER) != self.secret:
+            self.rejected += 1
+            return "403 Forbidden"
+        try:
+            update = json.loads(body)
+        except ValueError:
+            self.rejected += 1
+            return "400 Bad Request"
+        try:
+            await self.dispatch(update)
+        except (ConnectionError, AttributeError) as e:
+            # Воркер перезапускается — Telegram повторит обновление позже
+            logger.error(f"Не удалось передать обновление воркеру: {e}")
+            return "503 Service Unavailable"
+        return "200 OK"
+
+    async def handle_connection(self, reader, writer) -> None:
+        """
+        Минимальный HTTP/1.1 с keep-alive: Telegram шлёт только POST с JSON.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    writer.write(b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status = await self._respond(method, path, headers, body)
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode("latin-1"))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def set_webhook(url: str, secret: str = None) -> None:
+    from telegram import Bot
+
+    api_url = os.environ.get("BOT_API_URL")
+    kwargs = {"base_url": f"{api_url}/bot"} if api_url else {}
+    bot = Bot(os.environ.get("BOT_TOKEN", "BOT-TOKEN"), **kwargs)
+    async with bot:
+        await bot.set_webhook(url, secret_token=secret, allowed_updates=["message", "callback_query"])
+    logger.info(f"Webhook установлен: {url}")
+
+
+async def serve(host: str, port: int, workers: int, url: str = None, secret: str = None) -> None:
+    front = Front(workers, (urlparse(url).path or "/") if url else DEFAULT_PATH, secret)
+    await front.start()
+    server = await asyncio.start_server(front.handle_connection, host, port)
+    logger.info(f"Webhook на http://{host}:{port}{front.path}")
+    try:
+        if url:
+            await set_webhook(url, secret)
+        async with server:
+            await server.serve_forever()
+    finally:
+        await front.stop()
+
+
+# ----------------------- Сквозная проверка -----------------------
+def _callback_update(update_id: int, user_id: int, data: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                    "text": "Выберите подарок:"},
+    }}
+
+
+async def e2e(db_file: str, workers: int, users: int, updates: int, timeout: float) -> bool:
+    """
+    Фронт + воркеры + fake_bot_api.py: каждый пользователь по очереди нажимает кнопки
+    разных подарков, ответы бота (editMessageText) должны прийти в том же порядке.
+    """
+    import sqlite3
+
+    import httpx
+
+    from fake_bot_api import FakeBotAPI
+
+    gifts = [row[0] for row in sqlite3.connect(db_file).execute("SELECT name FROM gifts ORDER BY name")]
+    if not gifts:
+        print(f"В {db_file} нет подарков")
+        return False
+    db_file = os.path.abspath(db_file)
+    workdir = tempfile.mkdtemp(prefix="webhook-e2e-")
+    # Своя копия gifts.db: фронт создаёт схему, а users.db появится рядом
+    shutil.copy(db_file, os.path.join(workdir, "gifts.db"))
+    os.chdir(workdir)
+
+    api = FakeBotAPI(port=0).start()
+    os.environ["BOT_API_URL"] = f"http://{api.host}:{api.port}"
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["CHANGEFEED_DIR"] = os.path.join(workdir, "changefeed")
+
+    front = Front(workers, DEFAULT_PATH, secret="e2e")
+    await front.start()
+    server = await asyncio.start_server(front.handle_connection, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}{DEFAULT_PATH}"
+
+    # Воркер готов, когда его бот вызвал getMe; замер начинается после запуска всех воркеров
+    deadline = time.monotonic() + timeout
+    while sum(1 for method, _, _ in api.calls if method == "getMe") < workers and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+
+    expected = {}
+    update_ids = iter(range(1, users * updates + 1))
+    async with httpx.AsyncClient(headers={"X-Telegram-Bot-Api-Secret-Token": "e2e"}) as client:
+        async def user_session(user_id: int):
+            sequence = [gifts[(user_id + k) % len(gifts)] for k in range(updates)]
+            expected[user_id] = sequence
+            for gift_name in sequence:
+                response = await client.post(url, json=_callback_update(next(update_ids), user_id, f"gift:{gift_name}"))
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_session(10_000 + i) for i in range(users)))
+        sent = time.perf_counter() - started
+
+        total = users * updates
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if sum(1 for method, _, _ in api.calls if method == "editMessageText") >= total:
+                break
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+
+    server.close()
+    await front.stop()
+    api.stop()
+
+    replies = {}
+    for method, chat_id, text in api.calls:
+        if method == "editMessageText":
+            replies.setdefault(chat_id, []).append(text)
+    done = sum(len(v) for v in replies.values())
+    out_of_order = 0
+    for user_id, sequence in expected.items():
+        got = [next((g for g in gifts if f"Название: {g}\n" in text), None) for text in replies.get(user_id, [])]
+        if got != sequence[:len(got)]:
+            out_of_order += 1
+    print(f"Воркеров: {workers}, пользователей: {users}, обновлений: {total}")
+    print(f"  Отправлено за {sent:.2f} с, ответов бота: {done} за {elapsed:.2f} с — {done / elapsed:.0f} обн/с")
+    print(f"  Распределение по воркерам: {front.routed}")
+    print(f"  Пользователей с нарушенным порядком ответов: {out_of_order}")
+    shutil.rmtree(workdir, ignore_errors=True)
+    return done == total and out_of_order == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Webhook-фронт бота с несколькими воркерами")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--url", help="публичный адрес webhook для setWebhook")
+    parser.add_argument("--secret", default=os.environ.get("WEBHOOK_SECRET"), help="secret_token для проверки запросов")
+    parser.add_argument("--e2e", action="store_true", help="сквозная проверка с fake_bot_api.py и выход")
+    parser.add_argument("--db", default="gifts.db", help="gifts.db для --e2e (копируется во временный каталог)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=20, help="обновлений на пользователя в --e2e")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    setup_logging("webhook")
+    if args.e2e:
+        ok = asyncio.run(e2e(args.db, args.workers, args.users, args.updates, args.timeout))
+        sys.exit(0 if ok else 1)
+    asyncio.run(serve(args.host, args.port, args.workers, args.url, args.secret))